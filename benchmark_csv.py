@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CSV读取基准 - 比较 pandas 与 pyarrow 引擎读取原始导出及其 gzip 压缩版本的吞吐量（MB/秒）
+
+用法: python benchmark_csv.py [CSV文件 ...]，默认读取 data/ 下的 data.csv 和 data2.csv。
+压缩版本写到 outputs/cache/ 下，不改动原始数据。
+"""
+
+import gzip
+import shutil
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+from src.config import get_data_path, get_cache_path, DATA_CONFIG
+from src.csv_reader import benchmark, compression_of, find_data_file
+
+
+def gzip_copy(path):
+    """在缓存目录生成（或复用）文件的 gzip 压缩版本"""
+    target = get_cache_path(path.name + '.gz')
+    if not target.exists() or target.stat().st_mtime_ns < path.stat().st_mtime_ns:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'rb') as src, gzip.open(target, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 16 * 1024 * 1024)
+    return target
+
+
+def main(paths):
+    if not paths:
+        paths = [find_data_file(get_data_path(DATA_CONFIG[key])) for key in ['main_data_file', 'aux_data_file']]
+
+    results = []
+    for path in map(Path, paths):
+        if not path.exists():
+            print(f"跳过: 找不到 {path}")
+            continue
+        results.append(benchmark(path))
+        if compression_of(path) is None:
+            results.append(benchmark(gzip_copy(path)))
+
+    if not results:
+        return 1
+    print(pd.concat(results, ignore_index=True).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+增量读取检查 - 在临时目录中模拟追加式CSV，确认每次增量读取的结果
+与 pd.read_csv 整体解析整个文件完全相同
+
+覆盖字符串列中混有数字样的编号、整数列追加空值、数值列追加文本、
+末行未写完以及已读部分被改写等情况，任一不一致时以非零状态码退出。
+"""
+
+import io
+import sys
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+from src.delta_ingest import DeltaIngestor
+
+HEADER = 'code,采集时间,用量,count\n'
+
+# (说明, 追加的内容)；每一步追加后都与整体解析比较
+STEPS = [
+    ('初始数据', '40404T,2024-01-01 00:00:00,1.5,3\n401,2024-01-01 00:15:00,2.0,4\n'),
+    ('数字样的编号', '401,2024-01-01 00:30:00,1.0,5\n'),
+    ('未写完的末行', '40404T,2024-01-01 00:45:00,0.5,'),
+    ('补全末行', '6\n'),
+    ('整数列追加空值', '402,2024-01-01 01:00:00,0.7,\n'),
+    ('浮点列追加文本', '403,2024-01-01 01:15:00,无,7\n'),
+    ('前导零编号', '0401,2024-01-01 01:30:00,1.1,8\n'),
+]
+
+
+def _ingestor(file_path, store_dir):
+    ingestor = DeltaIngestor(file_path)
+    ingestor.store_dir = store_dir
+    ingestor.checkpoint_path = store_dir / 'checkpoint.json'
+    return ingestor
+
+
+def _expected(file_path):
+    """整体解析文件中完整的行"""
+    raw = file_path.read_bytes()
+    return pd.read_csv(io.BytesIO(raw[:raw.rfind(b'\n') + 1]))
+
+
+def main():
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = Path(tmp) / 'data.csv'
+        store_dir = Path(tmp) / 'store'
+        file_path.write_text(HEADER, encoding='utf-8')
+
+        steps = STEPS + [('改写已读部分', None)]
+        for name, text in steps:
+            if text is None:
+                content = file_path.read_text(encoding='utf-8').replace('401,', '405,', 1)
+                file_path.write_text(content, encoding='utf-8')
+            else:
+                with open(file_path, 'a', encoding='utf-8') as f:
+                    f.write(text)
+
+            data = _ingestor(file_path, store_dir).read()
+            try:
+                pd.testing.assert_frame_equal(data, _expected(file_path))
+                print(f"✓ {name}: {len(data)} 行一致")
+            except AssertionError as e:
+                print(f"✗ {name}: 增量读取与整体解析不一致\n{e}")
+                ok = False
+
+    if ok:
+        print("✓ 增量读取检查通过")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+启动性能检查 - 用 python -X importtime 测量导入 src.main 的耗时
+
+超出 STARTUP_CONFIG 中的预算，或导入了不应在启动时加载的模块
+（如matplotlib）时以非零状态码退出，可作为回归检查。
+"""
+
+import os
+import subprocess
+import sys
+
+from src.config import STARTUP_CONFIG
+
+
+def measure_import_time(module='src.main'):
+    """在子进程中导入模块，返回 (总耗时毫秒, 已导入的模块集合)"""
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    )
+
+    total_us = 0
+    modules = set()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.add(name.strip())
+        # 顶层导入（无缩进）的累计耗时之和即为总耗时
+        if not name[1:].startswith(' '):
+            total_us += int(cumulative)
+
+    return total_us / 1000, modules
+
+
+def main():
+    total_ms, modules = measure_import_time()
+    budget_ms = STARTUP_CONFIG['import_budget_ms']
+    print(f"导入 src.main 耗时: {total_ms:.0f} ms（预算 {budget_ms} ms）")
+
+    ok = True
+    if total_ms > budget_ms:
+        print("✗ 超出启动耗时预算")
+        ok = False
+
+    for forbidden in STARTUP_CONFIG['forbidden_modules']:
+        loaded = sorted(m for m in modules if m == forbidden or m.startswith(forbidden + '.'))
+        if loaded:
+            print(f"✗ 启动时导入了 {forbidden}（共 {len(loaded)} 个模块）")
+            ok = False
+
+    if ok:
+        print("✓ 启动性能检查通过")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+校历 - 按日期区间（学期、假期、考试周、法定节假日）标注教学活动，按唯一日期向量化查找
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from .config import get_data_path, DATA_CONFIG, ANALYSIS_CONFIG
+
+DAY = np.timedelta64(1, 'D')
+
+
+class AcademicCalendar:
+    """日期精确的校历
+
+    校历文件每行一个闭区间：开始日期、结束日期、教学活动，可选“类型”和“优先级”。
+    区间可以重叠（如考试周位于学期内），加载时一次展平为互不重叠、按开始日期
+    排序的小段，每段取覆盖它的优先级最高的区间（同优先级取更短的区间），
+    之后查找只需对唯一日期做一次 searchsorted。校历未覆盖的日期按
+    ANALYSIS_CONFIG['season_mapping'] 的月份规则回退。
+    """
+
+    def __init__(self, intervals=None):
+        self.fallback = ANALYSIS_CONFIG['season_mapping']
+        self.boundaries = np.array([], dtype='datetime64[D]')
+        self.segment_labels = np.array([], dtype=object)
+        if intervals is not None and len(intervals) > 0:
+            self._flatten(intervals)
+
+    def _flatten(self, intervals):
+        """把可能重叠的区间展平为不重叠的小段"""
+        params = ANALYSIS_CONFIG['calendar']
+        starts = pd.to_datetime(intervals['开始日期']).to_numpy().astype('datetime64[D]')
+        stops = pd.to_datetime(intervals['结束日期']).to_numpy().astype('datetime64[D]') + DAY
+        labels = intervals['教学活动'].to_numpy(dtype=object)
+        if '优先级' in intervals.columns:
+            priority = intervals['优先级'].fillna(0).to_numpy(dtype=float)
+        elif '类型' in intervals.columns:
+            priority = intervals['类型'].map(params['type_priority']).fillna(0).to_numpy(dtype=float)
+        else:
+            priority = np.zeros(len(intervals))
+
+        bad = stops <= starts
+        if bad.any():
+            raise ValueError(f"校历中有 {bad.sum()} 个区间的结束日期早于开始日期")
+
+        # 所有区间端点切出的小段 × 区间 的覆盖矩阵，每段取得分最高的区间
+        boundaries = np.unique(np.concatenate([starts, stops]))
+        seg_starts = boundaries[:-1]
+        covers = (starts[None, :] <= seg_starts[:, None]) & (seg_starts[:, None] < stops[None, :])
+        span = (stops - starts) / DAY
+        score = priority * 1e7 - span * 10 + np.arange(len(starts)) / len(starts)
+        best = np.where(covers, score[None, :], -np.inf).argmax(axis=1)
+        segment_labels = np.where(covers.any(axis=1), labels[best], None)
+
+        self.boundaries = boundaries
+        self.segment_labels = segment_labels
+
+    @classmethod
+    def load(cls, file_path=None):
+        """读取校历文件（csv 或 xlsx），文件不存在时只使用月份规则"""
+        file_path = file_path or get_data_path(DATA_CONFIG['calendar_file'])
+        if not file_path.exists():
+            return cls()
+        if file_path.suffix in ('.xlsx', '.xls'):
+            intervals = pd.read_excel(file_path)
+        else:
+            intervals = pd.read_csv(file_path)
+        calendar = cls(intervals)
+        print(f"✓ 已加载校历: {len(intervals)} 个区间，覆盖 "
+              f"{calendar.boundaries[0]} 至 {calendar.boundaries[-1] - DAY}")
+        return calendar
+
+    def signature(self):
+        """校历内容的摘要，校历变化时按教学活动累积的缓存需要重建"""
+        text = '|'.join(f'{b}:{l}' for b, l in zip(self.boundaries, self.segment_labels))
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+    def label_dates(self, dates):
+        """为一组（唯一的）日期查找教学活动"""
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        labels = np.full(len(dates), None, dtype=object)
+        if len(self.segment_labels) > 0:
+            idx = np.searchsorted(self.boundaries, dates, side='right') - 1
+            inside = (idx >= 0) & (idx < len(self.segment_labels))
+            labels[inside] = self.segment_labels[idx[inside]]
+
+        # 未覆盖的日期按月份回退
+        missing = pd.isnull(labels)
+        if missing.any():
+            months = pd.DatetimeIndex(dates[missing]).month
+            labels[missing] = pd.Series(months).map(self.fallback).to_numpy()
+        return labels
+
+    def label(self, times):
+        """为每个时间标注教学活动：只对覆盖范围内的每一天查找一次，再按日期序号展开
+
+        缺失的时间（NaT）标注为 None，不参与日期范围的计算。
+        """
+        times = pd.DatetimeIndex(times)
+        labels = np.full(len(times), None, dtype=object)
+        valid = ~times.isna()
+        if not valid.any():
+            return labels
+        days = times[valid].values.astype('datetime64[D]').astype(np.int64)
+        first = days.min()
+        day_range = np.arange(first, days.max() + 1).astype('datetime64[D]')
+        labels[valid] = self.label_dates(day_range)[days - first]
+        return labels
+
+
+_calendar = None
+_calendar_fingerprint = None
+
+
+def get_calendar():
+    """进程内共享的校历，文件变化时重新加载"""
+    global _calendar, _calendar_fingerprint
+    file_path = get_data_path(DATA_CONFIG['calendar_file'])
+    fingerprint = (str(file_path), file_path.stat().st_mtime_ns) if file_path.exists() else (str(file_path), None)
+    if _calendar is None or fingerprint != _calendar_fingerprint:
+        _calendar = AcademicCalendar.load(file_path)
+        _calendar_fingerprint = fingerprint
+    return _calendar
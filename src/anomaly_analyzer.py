@@ -0,0 +1,298 @@
+"""
+异常检测分析器 - 基于中位数/MAD稳健基线的批量异常评分
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+import warnings
+
+warnings.filterwarnings('ignore')
+from .config import (
+    get_figure_path,
+    ANALYSIS_CONFIG, VISUALIZATION_CONFIG
+)
+from .academic_calendar import get_calendar
+from .baseline_profile import BaselineProfile
+from .constants import SLOTS_PER_DAY
+from .plotting import get_pyplot
+from .report_writer import save_report
+
+
+class AnomalyAnalyzer:
+    """异常检测分析器
+
+    将所有水表的15分钟用水量排成 水表×时段 矩阵，按
+    (教学活动, 星期几×小时) 分组计算每个水表的中位数和MAD基线，
+    再以稳健Z分数一次性为全部水表打分。本次数据中样本不足的分组
+    改用基线画像（见 baseline_profile.py）中同一水表名的历史均值和标准差。
+    """
+
+    def __init__(self, data_loader):
+        self.data_loader = data_loader
+        self.result = None
+        self.params = ANALYSIS_CONFIG['anomaly']
+
+        # 水表×时段矩阵及其元数据
+        self.matrix = None
+        self.meter_codes = None
+        self.meter_names = None
+        self.profile = None
+        self.slot_times = None
+        self.anomalies = None
+
+    def prepare_data(self):
+        """准备数据"""
+        self.result = self.data_loader.load_and_prepare_all_data()
+        return self.result
+
+    def build_usage_matrix(self):
+        """构建 水表×15分钟时段 用水量矩阵（缺失时段为NaN）"""
+        print("正在构建水表×时段用水量矩阵...")
+
+        if self.result is None:
+            print("请先准备数据")
+            return None
+
+        # 直接按float32规整15分钟网格，缺失时段为NaN，不再另存一份float64矩阵
+        grid = self.data_loader.regularize_usage(
+            self.result, 'code', ['水表名'], report_name='data_quality_data.xlsx', dtype=np.float32
+        )
+        self.slot_times = grid.slot_times
+        self.meter_codes = np.asarray(grid.keys)
+        self.meter_names = grid.meta['水表名'].to_numpy()
+        self.matrix = grid.values
+        n_meters, n_slots = self.matrix.shape
+
+        print(f"✓ 矩阵构建完成: {n_meters} 个水表 × {n_slots} 个时段")
+        return self.matrix
+
+    def load_baseline_profile(self):
+        """读取功能区分析持续累积的基线画像（按水表名）"""
+        self.profile = BaselineProfile.load('水表名')
+        print(f"✓ 已读取基线画像: {len(self.profile.keys)} 个水表名")
+        return self.profile
+
+    def _profile_baseline(self, names, present, group_times, n_groups):
+        """从基线画像查询一批水表在各分组的历史均值和标准差 (水表, 分组)，查不到为NaN"""
+        mean = np.full((len(names), n_groups), np.nan)
+        std = np.full((len(names), n_groups), np.nan)
+        found_mean, found_std = self.profile.expected_many(
+            np.repeat(names, len(present)), np.tile(group_times, len(names)), self.params['min_samples']
+        )
+        mean[:, present] = found_mean.reshape(len(names), len(present))
+        std[:, present] = found_std.reshape(len(names), len(present))
+        return mean, std
+
+    def _slot_groups(self):
+        """计算每个时段所属的基线分组 (教学活动, 星期几×小时)"""
+        activity = get_calendar().label(self.slot_times)
+        activity_idx, activities = pd.factorize(activity)
+        hour_of_week = self.slot_times.dayofweek * 24 + self.slot_times.hour
+        groups = activity_idx * 168 + np.asarray(hour_of_week)
+        return groups, len(activities) * 168
+
+    def _robust_baseline(self, block, groups, n_groups):
+        """按分组计算一批水表的中位数和MAD
+
+        将各分组的时段列重排成 (水表, 分组, 组内样本) 的补齐数组，
+        用一次nanmedian同时得到所有水表、所有分组的统计量。
+        """
+        order = np.argsort(groups, kind='stable')
+        counts = np.bincount(groups, minlength=n_groups)
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        rank = np.arange(len(order)) - np.repeat(offsets, counts)
+
+        # 补齐位置指向追加的NaN列
+        padded = np.full((n_groups, max(counts.max(), 1)), block.shape[1], dtype=np.int64)
+        padded[groups[order], rank] = order
+        extended = np.concatenate([block, np.full((block.shape[0], 1), np.nan, block.dtype)], axis=1)
+        samples = extended[:, padded]
+
+        n_valid = np.sum(~np.isnan(samples), axis=2)
+        median = self._sorted_median(samples, n_valid)
+        mad = self._sorted_median(np.abs(samples - median[:, :, None]), n_valid)
+
+        # 样本不足的分组不参与评分
+        median[n_valid < self.params['min_samples']] = np.nan
+        return median, mad
+
+    @staticmethod
+    def _sorted_median(samples, n_valid):
+        """沿最后一维求忽略NaN的中位数（排序后NaN位于末尾，按有效个数取中间位置）"""
+        ordered = np.sort(samples, axis=2)
+        lower = np.take_along_axis(ordered, np.maximum(n_valid - 1, 0)[:, :, None] // 2, axis=2)
+        upper = np.take_along_axis(ordered, (n_valid // 2)[:, :, None], axis=2)
+        median = ((lower + upper) / 2)[:, :, 0]
+        median[n_valid == 0] = np.nan
+        return median
+
+    @staticmethod
+    def _extract_events(flags, score, actual, expected):
+        """把逐时段的标记合并为连续事件，返回事件的行列范围及汇总值"""
+        rows, cols = np.nonzero(flags)
+        if len(rows) == 0:
+            return None
+
+        new_event = np.concatenate([[True], (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1] + 1)])
+        starts = np.flatnonzero(new_event)
+        ends = np.concatenate([starts[1:] - 1, [len(cols) - 1]])
+
+        return {
+            'row': rows[starts],
+            'start': cols[starts],
+            'end': cols[ends],
+            'peak': np.maximum.reduceat(np.abs(score[rows, cols]), starts),
+            'actual': np.add.reduceat(actual[rows, cols], starts),
+            'expected': np.add.reduceat(expected[rows, cols], starts),
+        }
+
+    def score_anomalies(self):
+        """对所有水表批量计算异常得分并生成异常排名表"""
+        print("\n开始批量异常评分...")
+
+        if self.matrix is None:
+            print("请先构建用水量矩阵")
+            return None
+
+        start_time = time.time()
+        params = self.params
+        groups, n_groups = self._slot_groups()
+        night = np.isin(self.slot_times.hour, params['night_hours'])
+
+        # 每个分组取一个时刻，用于在基线画像中查询同一 (教学活动, 星期几, 小时)
+        if params['profile_fallback'] and self.profile is None:
+            self.load_baseline_profile()
+        present, first = np.unique(groups, return_index=True)
+        group_times = self.slot_times[first]
+
+        n_slots = len(self.slot_times)
+        n_days = -(-n_slots // SLOTS_PER_DAY)
+        day_starts = np.arange(n_days) * SLOTS_PER_DAY
+
+        frames = []
+        for block_start in range(0, len(self.meter_codes), params['block_size']):
+            block = self.matrix[block_start:block_start + params['block_size']]
+
+            median, mad = self._robust_baseline(block, groups, n_groups)
+            spread = 1.4826 * mad
+            if params['profile_fallback'] and len(self.profile.keys) > 0:
+                names = self.meter_names[block_start:block_start + len(block)]
+                profile_mean, profile_std = self._profile_baseline(names, present, group_times, n_groups)
+                fallback = np.isnan(median) & ~np.isnan(profile_mean)
+                median = np.where(fallback, profile_mean, median)
+                spread = np.where(fallback, profile_std, spread)
+            expected = median[:, groups]
+            scale = np.maximum(spread, params['mad_floor'])[:, groups]
+            score = (block - expected) / scale
+            scored = ~np.isnan(score)
+
+            burst = scored & (score >= params['z_threshold'])
+            night_use = scored & night[None, :] & (score >= params['night_z_threshold']) & ~burst
+
+            # 日尺度的基线偏移：每日残差之和相对其标准差的滚动中位数
+            residual = np.where(scored, block - expected, 0.0)
+            variance = np.where(scored, scale ** 2, 0.0)
+            daily_actual = np.add.reduceat(np.where(scored, block, 0.0), day_starts, axis=1)
+            daily_expected = np.add.reduceat(np.where(scored, expected, 0.0), day_starts, axis=1)
+            daily_var = np.add.reduceat(variance, day_starts, axis=1)
+            daily_z = np.add.reduceat(residual, day_starts, axis=1) / np.sqrt(
+                np.where(daily_var > 0, daily_var, np.nan)
+            )
+            rolling_z = pd.DataFrame(daily_z.T).rolling(
+                params['shift_window_days'], min_periods=params['shift_window_days']
+            ).median().to_numpy().T
+            shift = np.abs(np.nan_to_num(rolling_z)) >= params['shift_z_threshold']
+
+            for kind, flags, s, a, e, unit in [
+                ('突增', burst, score, block, expected, 1),
+                ('夜间异常用水', night_use, score, block, expected, 1),
+                ('基线偏移', shift, rolling_z, daily_actual, daily_expected, SLOTS_PER_DAY),
+            ]:
+                events = self._extract_events(flags, s, a, e)
+                if events is None:
+                    continue
+
+                rows = events['row'] + block_start
+                end_slot = np.minimum((events['end'] + 1) * unit, n_slots) - 1
+                frames.append(pd.DataFrame({
+                    '水表编码': self.meter_codes[rows],
+                    '水表名': self.meter_names[rows],
+                    '异常类型': kind,
+                    '开始时间': self.slot_times[events['start'] * unit],
+                    '结束时间': self.slot_times[end_slot] + pd.Timedelta('15min'),
+                    '持续时段数': end_slot - events['start'] * unit + 1,
+                    '峰值得分': events['peak'].astype(float).round(2),
+                    '实际用量': events['actual'].astype(float).round(3),
+                    '期望用量': events['expected'].astype(float).round(3),
+                }))
+
+        if frames:
+            self.anomalies = pd.concat(frames, ignore_index=True).sort_values(
+                '峰值得分', ascending=False
+            ).reset_index(drop=True)
+        else:
+            self.anomalies = pd.DataFrame(columns=[
+                '水表编码', '水表名', '异常类型', '开始时间', '结束时间',
+                '持续时段数', '峰值得分', '实际用量', '期望用量'
+            ])
+
+        print(f"✓ 异常评分完成，用时 {time.time() - start_time:.2f} 秒，共发现 {len(self.anomalies)} 个异常事件")
+        if len(self.anomalies) > 0:
+            print(self.anomalies['异常类型'].value_counts().to_string())
+        return self.anomalies
+
+    def visualize_anomalies(self):
+        """可视化异常排名"""
+        if self.anomalies is None or len(self.anomalies) == 0:
+            print("没有异常数据可可视化")
+            return
+
+        top_data = self.anomalies.head(self.params['top_n'])
+        labels = [f"{name}({kind})" for name, kind in zip(top_data['水表名'], top_data['异常类型'])]
+
+        plt = get_pyplot()
+        fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
+        ax.barh(range(len(top_data)), top_data['峰值得分'])
+        ax.set_yticks(range(len(top_data)))
+        ax.set_yticklabels(labels)
+        ax.invert_yaxis()
+        ax.set_xlabel('峰值得分（稳健Z分数）')
+        ax.set_title(f'异常事件排名前{len(top_data)}')
+        ax.grid(True, alpha=0.3, axis='x')
+
+        plt.tight_layout()
+        plt.savefig(get_figure_path('异常事件排名.png'), dpi=VISUALIZATION_CONFIG['dpi'])
+        plt.close()
+        print("✓ 已保存: 异常事件排名.png")
+
+    def save_anomaly_results(self):
+        """保存异常排名表"""
+        if self.anomalies is not None and len(self.anomalies) > 0:
+            output_path = save_report('anomaly_rank.xlsx', {'异常排名': self.anomalies})
+            print(f"✓ 异常排名已保存到: {output_path}")
+
+    def run_analysis(self, plot=True):
+        """运行完整异常检测（plot=False 时不绘图，也不导入matplotlib）"""
+        print("=" * 60)
+        print("异常检测开始")
+        print("=" * 60)
+
+        # 1. 准备数据
+        self.prepare_data()
+
+        # 2. 构建用水量矩阵
+        self.build_usage_matrix()
+
+        # 3. 批量异常评分
+        self.score_anomalies()
+
+        # 4. 可视化并保存结果
+        if plot:
+            self.visualize_anomalies()
+        self.save_anomaly_results()
+
+        print("=" * 60)
+        print("异常检测完成")
+        print("=" * 60)
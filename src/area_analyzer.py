@@ -2,28 +2,36 @@
 功能区分析器 - 从"不同功能区的用水规律特征分析.py"重构
 """
 
+import time
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import warnings
 
 warnings.filterwarnings('ignore')
 from .config import (
-    get_figure_path, get_report_path,
+    get_figure_path,
     DATA_CONFIG, VISUALIZATION_CONFIG,
     ANALYSIS_CONFIG
 )
+from .baseline_profile import BaselineProfile
+from .clustering import normalize_profiles, squared_distances, kmeans
+from .plotting import get_pyplot, render_small_multiples, StagedPlotting
+from .report_writer import ReportWriter, save_report
 
 
-class AreaAnalyzer:
+class AreaAnalyzer(StagedPlotting):
     """功能区分析器"""
 
     def __init__(self, data_loader):
         self.data_loader = data_loader
         self.result = None
-
-        # 设置中文字体
-        plt.rcParams['font.sans-serif'] = [VISUALIZATION_CONFIG['font_family']]
-        plt.rcParams['axes.unicode_minus'] = False
+        self.groups = None
+        self.profile = None
+        self.rollup = None
+        self.clusters = None
+        self.figures = []
+        self.errors = []
 
         # 功能区映射
         self.area2place = DATA_CONFIG['area_mapping']
@@ -44,8 +52,9 @@ class AreaAnalyzer:
         # 加载并准备数据
         self.result = self.data_loader.load_and_prepare_all_data()
 
-        # 映射功能区
+        # 映射功能区（按功能区的图表由用量汇总得到，不再为功能区建立分组索引）
         self.result['area'] = self.result['水表名'].map(self.place2area)
+        self.groups = self.data_loader.group_index
 
         # 检查未映射的水表
         unmapped = self.result[self.result['area'].isnull()]['水表名'].unique()
@@ -64,10 +73,24 @@ class AreaAnalyzer:
             '水表所属区域名称': list(self.area2place.values())
         })
 
-        output_path = get_report_path('area2place.xlsx')
-        area_df.to_excel(output_path, index=False)
+        output_path = save_report('area2place.xlsx', {'功能区映射': area_df})
         print(f"✓ 功能区映射已保存到: {output_path}")
 
+    def build_usage_rollup(self):
+        """加载持久化的 水表 × 日 × 小时 用量汇总，并合并本次数据中新增的读数"""
+        if self.result is None:
+            print("请先准备数据")
+            return None
+
+        self.rollup = self.data_loader.load_usage_rollup(self.result)
+        return self.rollup
+
+    def _area_hourly(self):
+        """功能区 × 日 × 小时 用量长表（由用量汇总按功能区相加）"""
+        if self.rollup is None:
+            self.build_usage_rollup()
+        return self.rollup.table(self.rollup.attribute('水表名').map(self.place2area).rename('area'))
+
     def analyze_area_daily_usage(self):
         """分析功能区每日用水量"""
         print("\n分析功能区每日用水量...")
@@ -77,38 +100,60 @@ class AreaAnalyzer:
             return
 
         try:
-            # 按日期和功能区分组
-            area_daily = self.result.groupby(['area', 'date']).agg({'用量': 'sum'}).reset_index()
-
-            # 获取所有功能区
-            areas = sorted(self.result['area'].dropna().unique())
-
-            if len(areas) > 0:
-                # 创建子图
-                fig, axes = plt.subplots(len(areas), 1, figsize=(15, 5 * len(areas)))
-
-                # 如果只有一个功能区，axes不是数组
-                if len(areas) == 1:
-                    axes = [axes]
-
-                for i, area in enumerate(areas):
-                    area_data = area_daily[area_daily['area'] == area]
-
-                    if not area_data.empty:
-                        area_data = area_data.sort_values('date')
-                        axes[i].plot(area_data['date'], area_data['用量'], marker='o', linewidth=2)
-                        axes[i].set_title(f'{area}区 - 每日用水量')
-                        axes[i].set_xlabel('日期')
-                        axes[i].set_ylabel('用水量')
-                        axes[i].tick_params(axis='x', rotation=45)
-                        axes[i].grid(True, alpha=0.3)
-
-                plt.tight_layout()
-                plt.savefig(get_figure_path('不同功能区用水量.png'), dpi=VISUALIZATION_CONFIG['dpi'])
-                plt.close()
-                print("✓ 已保存: 不同功能区用水量.png")
+            # 按日期和功能区分组（由用量汇总得到，不再扫描全部读数）
+            area_daily = self._area_hourly().groupby(['area', 'date']).agg({'用量': 'sum'}).reset_index()
+            if area_daily['area'].nunique() > 0:
+                self.figure('plot_area_daily_usage', area_daily)
         except Exception as e:
-            print(f"分析功能区每日用水量失败: {e}")
+            self.error(f"分析功能区每日用水量失败: {e}")
+
+    def plot_area_daily_usage(self, area_daily):
+        """每个功能区一张子图绘制每日用水量"""
+        areas = sorted(area_daily['area'].unique())
+
+        # 创建子图
+        plt = get_pyplot()
+        fig, axes = plt.subplots(len(areas), 1, figsize=(15, 5 * len(areas)))
+
+        # 如果只有一个功能区，axes不是数组
+        if len(areas) == 1:
+            axes = [axes]
+
+        for i, area in enumerate(areas):
+            area_data = area_daily[area_daily['area'] == area]
+
+            if not area_data.empty:
+                area_data = area_data.sort_values('date')
+                axes[i].plot(area_data['date'], area_data['用量'], marker='o', linewidth=2)
+                axes[i].set_title(f'{area}区 - 每日用水量')
+                axes[i].set_xlabel('日期')
+                axes[i].set_ylabel('用水量')
+                axes[i].tick_params(axis='x', rotation=45)
+                axes[i].grid(True, alpha=0.3)
+
+        plt.tight_layout()
+        plt.savefig(get_figure_path('不同功能区用水量.png'), dpi=VISUALIZATION_CONFIG['dpi'])
+        plt.close()
+        print("✓ 已保存: 不同功能区用水量.png")
+
+    def plot_hourly_pattern(self, pattern, title, filename):
+        """绘制按季度或教学活动分组的24小时用水曲线"""
+        plt = get_pyplot()
+        fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
+        pattern.T.loc['用量', :].plot.line(ax=ax, title=title)
+        ax.set_xlabel('小时')
+        ax.set_ylabel('用水量')
+        ax.grid(True, alpha=0.3)
+
+        plt.tight_layout()
+        plt.savefig(get_figure_path(filename), dpi=VISUALIZATION_CONFIG['dpi'])
+        plt.close()
+        print(f"✓ 已保存: {filename}")
+
+    def plot_meter_multiples(self, cube, names, series_labels, title, filename, description, ylabel='用水量'):
+        """把各水表的24小时曲线分页排成小图"""
+        paths = render_small_multiples(cube, names, series_labels, np.arange(24), title, filename, ylabel=ylabel)
+        print(f"✓ 已保存 {len(names)} 个水表的{description}: {', '.join(p.name for p in paths)}")
 
     def analyze_seasonal_patterns(self):
         """分析季节性用水模式"""
@@ -118,31 +163,17 @@ class AreaAnalyzer:
             print("请先准备数据")
             return
 
-        for area in self.result['area'].dropna().unique():
+        for area, data_tmp in self._area_hourly().groupby('area'):
             try:
-                data_tmp = self.result[self.result['area'] == area]
-
                 if len(data_tmp) > 0:
                     # 按季度和小时分析
                     seasonal_data = data_tmp.groupby(['season', 'hours']).agg({'用量': 'sum'}).unstack().fillna(0)
 
                     if not seasonal_data.empty:
-                        fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
-                        seasonal_data.T.loc['用量', :].plot.line(
-                            ax=ax,
-                            title=f'{area}功能区用水量的变化趋势图（按季度）'
-                        )
-                        ax.set_xlabel('小时')
-                        ax.set_ylabel('用水量')
-                        ax.grid(True, alpha=0.3)
-
-                        plt.tight_layout()
-                        plt.savefig(get_figure_path(f'{area}_季度用水趋势.png'), dpi=VISUALIZATION_CONFIG['dpi'])
-                        plt.close()
-
-                        print(f"✓ 已保存: {area}_季度用水趋势.png")
+                        self.figure('plot_hourly_pattern', seasonal_data,
+                                    f'{area}功能区用水量的变化趋势图（按季度）', f'{area}_季度用水趋势.png')
             except Exception as e:
-                print(f"分析{area}季节性模式失败: {e}")
+                self.error(f"分析{area}季节性模式失败: {e}")
 
     def analyze_teaching_activity_patterns(self):
         """分析教学活动用水模式"""
@@ -152,105 +183,185 @@ class AreaAnalyzer:
             print("请先准备数据")
             return
 
-        for area in self.result['area'].dropna().unique():
+        for area, data_tmp in self._area_hourly().groupby('area'):
             try:
-                data_tmp = self.result[self.result['area'] == area]
-
                 if len(data_tmp) > 0:
                     # 按教学活动和小时分析
                     activity_data = data_tmp.groupby(['教学活动', 'hours']).agg({'用量': 'sum'}).unstack().fillna(0)
 
                     if not activity_data.empty:
-                        fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
-                        activity_data.T.loc['用量', :].plot.line(
-                            ax=ax,
-                            title=f'{area}功能区用水量的变化趋势图（按教学活动）'
-                        )
-                        ax.set_xlabel('小时')
-                        ax.set_ylabel('用水量')
-                        ax.grid(True, alpha=0.3)
-
-                        plt.tight_layout()
-                        plt.savefig(get_figure_path(f'{area}_教学活动用水趋势.png'), dpi=VISUALIZATION_CONFIG['dpi'])
-                        plt.close()
-
-                        print(f"✓ 已保存: {area}_教学活动用水趋势.png")
+                        self.figure('plot_hourly_pattern', activity_data,
+                                    f'{area}功能区用水量的变化趋势图（按教学活动）', f'{area}_教学活动用水趋势.png')
             except Exception as e:
-                print(f"分析{area}教学活动模式失败: {e}")
+                self.error(f"分析{area}教学活动模式失败: {e}")
 
     def analyze_seasonal_hourly_usage(self):
-        """分析每季度的小时用水量"""
+        """分析每季度的小时用水量（所有水表分页小图）"""
         print("\n分析每季度的小时用水量...")
 
         if self.result is None:
             print("请先准备数据")
             return
 
-        # 按水表名、季度和小时分组
-        tmp = self.result.groupby(['水表名', 'season', 'hours']).agg({'用量': 'sum'}).unstack().fillna(0)
-        water_names = self.result['水表名'].unique()
+        if self.rollup is None:
+            self.build_usage_rollup()
 
-        # 只绘制前10个水表，避免过多图形
-        for n in water_names[:10]:
-            try:
-                if n in tmp.index:
-                    fig, axes = plt.subplots(2, 2, figsize=(12, 10))
-                    fig.suptitle(f'{n} - 每季度小时用水量', fontsize=16)
-
-                    for i, season in enumerate(sorted(tmp.loc[n, '用量'].columns.get_level_values(0).unique())):
-                        ax = axes[i // 2, i % 2]
-                        season_data = tmp.loc[n, '用量'][season]
-                        season_data.plot(kind='line', ax=ax, title=f'第{season}季度')
-                        ax.set_xlabel('小时')
-                        ax.set_ylabel('用水量')
-                        ax.grid(True, alpha=0.3)
-
-                    plt.tight_layout()
-                    plt.savefig(get_figure_path(f'{n}_季度用水量.png'), dpi=VISUALIZATION_CONFIG['dpi'])
-                    plt.close()
-                    print(f"✓ 已保存: {n}_季度用水量.png")
-            except Exception as e:
-                print(f"绘制{n}的季度用水量图失败: {e}")
+        try:
+            # 由用量汇总按水表名相加，得到 水表 × 季度 × 小时 的用水量矩阵
+            meter_names = self.rollup.attribute('水表名')
+            water_names = meter_names.dropna().unique()
+            seasons = [1, 2, 3, 4]
+            index = pd.MultiIndex.from_product([water_names, seasons, range(24)])
+            cube = (
+                self.rollup.table(meter_names).groupby(['水表名', 'season', 'hours'])['用量'].sum()
+                .reindex(index, fill_value=0)
+                .to_numpy()
+                .reshape(len(water_names), len(seasons), 24)
+            )
+
+            self.figure('plot_meter_multiples', cube, water_names, [f'第{s}季度' for s in seasons],
+                        '各水表每季度小时用水量', '各水表_季度小时用水量.pdf', '季度小时用水量')
+        except Exception as e:
+            self.error(f"绘制季度小时用水量图失败: {e}")
+
+    def build_baseline_profile(self):
+        """加载持久化的水表基线画像，并用本次数据增量更新"""
+        print("\n更新水表基线画像...")
+
+        if self.result is None:
+            print("请先准备数据")
+            return None
+
+        self.profile = BaselineProfile.load('水表名')
+        added = self.profile.update(self.result)
+        path = self.profile.save()
+        print(f"✓ 基线画像新增 {added} 条读数，共 {len(self.profile.keys)} 个水表，已保存到: {path}")
+        return self.profile
 
     def analyze_teaching_activity_hourly_usage(self):
-        """分析不同教学活动每小时平均用水量"""
+        """分析不同教学活动每小时平均用水量（所有水表分页小图）"""
         print("\n分析不同教学活动每小时平均用水量...")
 
         if self.result is None or '教学活动' not in self.result.columns:
             print("请先准备数据")
             return
 
-        # 按水表名、教学活动和小时分组
-        tmp = self.result.groupby(['水表名', '教学活动', 'hours']).agg({'用量': 'mean'}).unstack().fillna(0)
-        water_names = self.result['水表名'].unique()
+        if self.profile is None:
+            self.build_baseline_profile()
 
-        # 只绘制前10个水表
-        for n in water_names[:10]:
-            try:
-                if n in tmp.index:
-                    activities = sorted(tmp.loc[n, '用量'].columns.get_level_values(0).unique())
-
-                    if len(activities) > 0:
-                        fig, axes = plt.subplots(2, 2, figsize=(12, 10))
-                        fig.suptitle(f'{n} - 不同教学活动小时平均用水量', fontsize=16)
-
-                        for i, activity in enumerate(activities):
-                            if i < 4:  # 最多显示4个子图
-                                ax = axes[i // 2, i % 2]
-                                activity_data = tmp.loc[n, '用量'][activity]
-                                activity_data.plot(kind='line', ax=ax, title=activity)
-                                ax.set_xlabel('小时')
-                                ax.set_ylabel('平均用水量')
-                                ax.grid(True, alpha=0.3)
-
-                        plt.tight_layout()
-                        plt.savefig(get_figure_path(f'{n}_教学活动用水量.png'), dpi=VISUALIZATION_CONFIG['dpi'])
-                        plt.close()
-                        print(f"✓ 已保存: {n}_教学活动用水量.png")
-            except Exception as e:
-                print(f"绘制{n}的教学活动用水量图失败: {e}")
+        try:
+            # 直接使用基线画像的 (水表名, 教学活动) × 小时 平均用量，不再重新分组
+            water_names = self.result['水表名'].dropna().unique()
+            activities = sorted(self.result['教学活动'].dropna().unique())
+            index = pd.MultiIndex.from_product([water_names, activities])
+            cube = (
+                self.profile.hourly_mean_table()
+                .reindex(index, fill_value=0)
+                .to_numpy()
+                .reshape(len(water_names), len(activities), 24)
+            )
+
+            self.figure('plot_meter_multiples', cube, water_names, activities,
+                        '各水表不同教学活动小时平均用水量', '各水表_教学活动小时平均用水量.pdf',
+                        '教学活动小时用水量', '平均用水量')
+        except Exception as e:
+            self.error(f"绘制教学活动小时用水量图失败: {e}")
+
+    def cluster_meters(self):
+        """按周内小时用水曲线聚类，为未映射水表建议功能区并标记与所属功能区不符的水表"""
+        print("\n按用水曲线聚类水表...")
 
-    def run_analysis(self):
+        if self.result is None:
+            print("请先准备数据")
+            return None
+
+        if self.profile is None:
+            self.build_baseline_profile()
+
+        params = ANALYSIS_CONFIG['clustering']
+        start_time = time.time()
+
+        # 本次数据中各水表的归一化周内小时曲线
+        names = pd.Index(self.result['水表名'].dropna().unique())
+        rows = [self.profile.key_index[name] for name in names]
+        profiles = normalize_profiles(self.profile.hour_of_week_means()[rows])
+        usable = ~np.isnan(profiles).any(axis=1)
+        names, profiles = names[usable], profiles[usable]
+        areas = names.map(self.place2area)
+        if len(names) == 0:
+            print("没有可聚类的水表")
+            return None
+
+        # 无监督聚类
+        n_clusters = params['n_clusters'] or len(self.area2place)
+        labels, centers, _ = kmeans(profiles, n_clusters, params['n_init'], params['max_iter'],
+                                    random_state=params['random_state'])
+
+        # 各功能区的中心曲线：用于建议功能区和判断是否匹配
+        mapped = pd.notnull(areas)
+        area_names = sorted(areas[mapped].unique())
+        area_centers = np.array([profiles[np.asarray(areas == area)].mean(axis=0) for area in area_names])
+        table = pd.DataFrame({'水表名': names, '功能区': areas, '聚类': labels})
+        cluster_area = table[mapped].groupby('聚类')['功能区'].agg(lambda s: s.mode().iloc[0])
+        table['聚类主要功能区'] = table['聚类'].map(cluster_area)
+
+        if len(area_names) > 0:
+            distances = np.sqrt(squared_distances(profiles, area_centers))
+            nearest = distances.argmin(axis=1)
+            table['建议功能区'] = np.asarray(area_names)[nearest]
+            table['到最近功能区距离'] = distances[np.arange(len(names)), nearest].round(5)
+            own = pd.Series(areas).map({area: i for i, area in enumerate(area_names)}).to_numpy()
+            own_distance = np.full(len(names), np.nan)
+            own_distance[mapped] = distances[np.flatnonzero(mapped), own[mapped].astype(np.int64)]
+            table['到所属功能区距离'] = own_distance.round(5)
+
+            mismatch = mapped & (table['建议功能区'] != table['功能区']) & (
+                own_distance > distances[np.arange(len(names)), nearest] * (1 + params['mismatch_margin'])
+            )
+            table['状态'] = np.where(~mapped, '未映射', np.where(mismatch, '与所属功能区不符', '一致'))
+        else:
+            table['状态'] = '未映射'
+
+        self.clusters = table.sort_values(['状态', '聚类', '水表名']).reset_index(drop=True)
+        status = self.clusters['状态'].value_counts()
+        print(f"✓ {len(names)} 个水表聚为 {len(centers)} 类，用时 {time.time() - start_time:.2f} 秒："
+              f"未映射 {status.get('未映射', 0)} 个，与所属功能区不符 {status.get('与所属功能区不符', 0)} 个")
+
+        # 保存到 area2place.xlsx 所在目录
+        hours = [f'周{"一二三四五六日"[d]}{h:02d}时' for d in range(7) for h in range(24)]
+        centers_table = pd.DataFrame(centers, columns=hours)
+        centers_table.insert(0, '主要功能区', pd.Series(range(len(centers))).map(cluster_area).to_numpy())
+        centers_table.index.name = '聚类'
+        with ReportWriter('area_clusters.xlsx') as writer:
+            writer.write_sheet('水表聚类', self.clusters)
+            writer.write_sheet('未映射水表建议', self.clusters[self.clusters['状态'] == '未映射'])
+            writer.write_sheet('与功能区不符', self.clusters[self.clusters['状态'] == '与所属功能区不符'])
+            writer.write_sheet('聚类中心', centers_table, index=True)
+        print(f"✓ 水表聚类结果已保存到: {writer.paths[0]}")
+
+        self.figure('plot_cluster_centers', centers, cluster_area)
+        return self.clusters
+
+    def plot_cluster_centers(self, centers, cluster_area):
+        """绘制各聚类的周内小时用水曲线"""
+        plt = get_pyplot()
+        fig, ax = plt.subplots(figsize=(15, 6))
+        for i, center in enumerate(centers):
+            ax.plot(np.arange(168), center, label=f'聚类{i}（{cluster_area.get(i, "无映射水表")}）')
+        ax.set_xticks(np.arange(0, 168, 24))
+        ax.set_xticklabels([f'周{d}' for d in '一二三四五六日'])
+        ax.set_xlabel('周内小时')
+        ax.set_ylabel('归一化用水量')
+        ax.set_title('水表聚类中心的周内用水曲线')
+        ax.legend()
+        ax.grid(True, alpha=0.3)
+
+        plt.tight_layout()
+        plt.savefig(get_figure_path('水表聚类中心.png'), dpi=VISUALIZATION_CONFIG['dpi'])
+        plt.close()
+        print("✓ 已保存: 水表聚类中心.png")
+
+    def run_analysis(self, save_mapping=True):
         """运行完整的功能区分析"""
         print("=" * 60)
         print("功能区分析开始")
@@ -260,7 +371,8 @@ class AreaAnalyzer:
         self.prepare_data()
 
         # 2. 保存功能区映射
-        self.save_area_mapping()
+        if save_mapping:
+            self.save_area_mapping()
 
         # 3. 分析每日用水量
         self.analyze_area_daily_usage()
@@ -274,9 +386,15 @@ class AreaAnalyzer:
         # 6. 分析每季度小时用水量
         self.analyze_seasonal_hourly_usage()
 
-        # 7. 分析教学活动小时用水量
+        # 7. 更新基线画像
+        self.build_baseline_profile()
+
+        # 8. 分析教学活动小时用水量
         self.analyze_teaching_activity_hourly_usage()
 
+        # 9. 按用水曲线聚类水表
+        self.cluster_meters()
+
         print("=" * 60)
         print("功能区分析完成")
         print("=" * 60)
\ No newline at end of file
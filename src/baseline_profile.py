@@ -0,0 +1,248 @@
+"""
+基线画像索引 - 按 水表/功能区 × 教学活动 × 星期几 × 小时 预计算期望用水量
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from .config import get_cache_path, ANALYSIS_CONFIG
+from .academic_calendar import get_calendar
+
+# 一天的纳秒数
+DAY_NS = 24 * 3600 * 10 ** 9
+
+
+class BaselineProfile:
+    """小时级基线画像索引
+
+    以可累加的 和/平方和/计数 三个数组保存每个
+    (键, 教学活动, 星期几, 小时) 单元的统计量，
+    新数据到来时只需累加，查询某时刻的期望用量为常数时间。
+    统计对象为单条15分钟读数的用量。
+    """
+
+    def __init__(self, key_column='水表名'):
+        self.key_column = key_column
+
+        self.keys = []
+        self.key_index = {}
+        self.activities = list(dict.fromkeys(ANALYSIS_CONFIG['season_mapping'].values()))
+        self.activity_index = {a: i for i, a in enumerate(self.activities)}
+
+        shape = (0, len(self.activities), 7, 24)
+        self.sums = np.zeros(shape)
+        self.sumsq = np.zeros(shape)
+        self.counts = np.zeros(shape, dtype=np.int64)
+
+        # 每个已统计的 (键, 日)：读数条数、用量和、最后采集时间（纳秒），用于增量更新时判断补录和修改
+        self.day_key = np.zeros(0, dtype=np.int64)
+        self.day_day = np.zeros(0, dtype=np.int64)
+        self.day_count = np.zeros(0, dtype=np.int64)
+        self.day_sum = np.zeros(0)
+        self.day_last = np.zeros(0, dtype=np.int64)
+
+    def _grow(self, new_keys, new_activities):
+        """为新出现的键和教学活动扩展数组"""
+        for key in new_keys:
+            self.key_index[key] = len(self.keys)
+            self.keys.append(key)
+        for activity in new_activities:
+            self.activity_index[activity] = len(self.activities)
+            self.activities.append(activity)
+
+        pad = ((0, len(self.keys) - self.sums.shape[0]),
+               (0, len(self.activities) - self.sums.shape[1]), (0, 0), (0, 0))
+        self.sums = np.pad(self.sums, pad)
+        self.sumsq = np.pad(self.sumsq, pad)
+        self.counts = np.pad(self.counts, pad)
+
+    def _activity_of(self, times):
+        """获取时间对应的教学活动"""
+        return get_calendar().label(times)
+
+    def update(self, data):
+        """用新数据一次分组累加统计量，返回累加的读数条数
+
+        每个 (键, 日) 记录已统计读数的条数、用量和与最后采集时间：新出现的日子
+        整日累加；已统计的日子若原有读数不变，只累加其后追加的读数。原有读数
+        有补录、修改或删除的键清空后按本次数据重新统计（本次数据需包含该键的
+        全部历史，data.csv 追加写入时即是如此）。
+        """
+        data = data[data[self.key_column].notnull()]
+        times = data['采集时间']
+        activities = data['教学活动'].to_numpy() if '教学活动' in data.columns else self._activity_of(times)
+
+        keys = data[self.key_column].to_numpy()
+        self._grow(
+            [k for k in pd.unique(keys) if k not in self.key_index],
+            [a for a in pd.unique(activities) if a not in self.activity_index and pd.notnull(a)]
+        )
+
+        key_idx = pd.Series(keys).map(self.key_index).to_numpy()
+        activity_idx = pd.Series(activities).map(self.activity_index).to_numpy()
+        valid = pd.notnull(activity_idx)
+        if not valid.any():
+            return 0
+        key_idx = key_idx[valid].astype(np.int64)
+        activity_idx = activity_idx[valid].astype(np.int64)
+        times = times[valid]
+        usage = data['用量'].to_numpy(dtype=float)[valid]
+        stamps = times.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        weights = np.where(np.isnan(usage), 0.0, usage)
+
+        # 本次数据的 (键, 日) 单元，与已记录的单元对应（末尾追加一个空记录供新单元引用）
+        unit_of_row, units = pd.factorize(pd.MultiIndex.from_arrays([key_idx, stamps // DAY_NS]))
+        unit_key = units.get_level_values(0).to_numpy()
+        unit_day = units.get_level_values(1).to_numpy()
+        stored = pd.MultiIndex.from_arrays([self.day_key, self.day_day]).get_indexer(units)
+        known = stored >= 0
+        last = np.append(self.day_last, np.iinfo(np.int64).min)[stored]
+
+        # 已记录单元中不晚于记录时间的读数应与记录完全一致
+        before = stamps <= last[unit_of_row]
+        n_units = len(units)
+        prefix_count = np.bincount(unit_of_row[before], minlength=n_units)
+        prefix_sum = np.bincount(unit_of_row[before], weights=weights[before], minlength=n_units)
+        intact = ~known | ((prefix_count == np.append(self.day_count, 0)[stored])
+                           & (prefix_sum == np.append(self.day_sum, 0.0)[stored]))
+
+        # 本次数据首末日之间已记录、但本次数据中没有的日子视为被删除
+        n_keys = len(self.keys)
+        first_day = np.full(n_keys, np.iinfo(np.int64).max)
+        last_day = np.full(n_keys, np.iinfo(np.int64).min)
+        np.minimum.at(first_day, unit_key, unit_day)
+        np.maximum.at(last_day, unit_key, unit_day)
+        present = np.zeros(len(self.day_key), dtype=bool)
+        present[stored[known]] = True
+        removed = ~present & (self.day_day >= first_day[self.day_key]) & (self.day_day <= last_day[self.day_key])
+
+        rebuild = np.zeros(n_keys, dtype=bool)
+        rebuild[unit_key[~intact]] = True
+        rebuild[self.day_key[removed]] = True
+        if rebuild.any():
+            print(f"  {int(rebuild.sum())} 个{self.key_column}的已统计读数有补录、修改或删除，按本次数据重新统计")
+            self.sums[rebuild] = 0
+            self.sumsq[rebuild] = 0
+            self.counts[rebuild] = 0
+
+        add = rebuild[key_idx] | ~before
+        if add.any():
+            flat = np.ravel_multi_index(
+                (key_idx[add], activity_idx[add], times[add].dt.dayofweek.to_numpy(), times[add].dt.hour.to_numpy()),
+                self.sums.shape
+            )
+            size = self.sums.size
+            self.sums += np.bincount(flat, weights=usage[add], minlength=size).reshape(self.sums.shape)
+            self.sumsq += np.bincount(flat, weights=usage[add] ** 2, minlength=size).reshape(self.sums.shape)
+            self.counts += np.bincount(flat, minlength=size).reshape(self.sums.shape)
+
+        # 本次数据的单元按整日重新记录，其余已记录单元（重新统计的键除外）保留
+        keep = ~present & ~rebuild[self.day_key]
+        self.day_key = np.concatenate([self.day_key[keep], unit_key])
+        self.day_day = np.concatenate([self.day_day[keep], unit_day])
+        self.day_count = np.concatenate([self.day_count[keep], np.bincount(unit_of_row, minlength=n_units)])
+        self.day_sum = np.concatenate([self.day_sum[keep], np.bincount(unit_of_row, weights=weights, minlength=n_units)])
+        self.day_last = np.concatenate([
+            self.day_last[keep], pd.Series(stamps).groupby(unit_of_row).max().reindex(range(n_units)).to_numpy()
+        ])
+        return int(add.sum())
+
+    def _stats(self, sums, sumsq, counts):
+        """由累加量计算均值和标准差"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = sums / counts
+            std = np.sqrt(np.maximum(sumsq / counts - mean ** 2, 0))
+        return mean, std
+
+    def expected(self, key, timestamp):
+        """查询某个键在某时刻的期望用量和波动 (均值, 标准差)"""
+        if key not in self.key_index:
+            return np.nan, np.nan
+        timestamp = pd.Timestamp(timestamp)
+        activity = self._activity_of([timestamp])[0]
+        if activity not in self.activity_index:
+            return np.nan, np.nan
+
+        cell = (self.key_index[key], self.activity_index[activity], timestamp.dayofweek, timestamp.hour)
+        mean, std = self._stats(self.sums[cell], self.sumsq[cell], self.counts[cell])
+        return float(mean), float(std)
+
+    def expected_many(self, keys, times, min_count=1):
+        """批量查询期望用量和波动，未知的键或教学活动、读数少于 min_count 的单元返回NaN"""
+        times = pd.DatetimeIndex(times)
+        key_idx = pd.Series(keys).map(self.key_index).to_numpy()
+        activity_idx = pd.Series(self._activity_of(times)).map(self.activity_index).to_numpy()
+        known = pd.notnull(key_idx) & pd.notnull(activity_idx)
+
+        mean = np.full(len(times), np.nan)
+        std = np.full(len(times), np.nan)
+        if known.any():
+            cell = (key_idx[known].astype(np.int64), activity_idx[known].astype(np.int64),
+                    np.asarray(times.dayofweek)[known], np.asarray(times.hour)[known])
+            mean[known], std[known] = self._stats(self.sums[cell], self.sumsq[cell], self.counts[cell])
+            sparse = np.flatnonzero(known)[self.counts[cell] < min_count]
+            mean[sparse] = np.nan
+            std[sparse] = np.nan
+        return mean, std
+
+    def hourly_mean_table(self):
+        """按 (键, 教学活动) × 小时 汇总的平均用量表（合并星期几）"""
+        mean, _ = self._stats(self.sums.sum(axis=2), self.sumsq.sum(axis=2), self.counts.sum(axis=2))
+        index = pd.MultiIndex.from_product([self.keys, self.activities], names=[self.key_column, '教学活动'])
+        table = pd.DataFrame(mean.reshape(-1, 24), index=index, columns=pd.RangeIndex(24, name='hours'))
+
+        # 只保留出现过的 (键, 教学活动) 组合
+        observed = self.counts.sum(axis=(2, 3)).reshape(-1) > 0
+        return table[observed].fillna(0)
+
+    def hour_of_week_means(self):
+        """每个键按 星期几×小时 的平均用量 (键数, 168)，合并教学活动，无读数为NaN"""
+        mean, _ = self._stats(self.sums.sum(axis=1), self.sumsq.sum(axis=1), self.counts.sum(axis=1))
+        return mean.reshape(len(self.keys), 7 * 24)
+
+    def save(self, filename=None):
+        """持久化画像索引（先写临时文件再替换，并行读取的阶段不会读到写了一半的文件）"""
+        path = get_cache_path(filename or f'baseline_profile_{self.key_column}.npz')
+        partial = path.with_name(path.name + '.partial')
+        with open(partial, 'wb') as f:
+            np.savez_compressed(
+                f,
+                key_column=np.array(self.key_column),
+                keys=np.array(self.keys, dtype=object),
+                activities=np.array(self.activities, dtype=object),
+                calendar=np.array(get_calendar().signature()),
+                sums=self.sums, sumsq=self.sumsq, counts=self.counts,
+                day_key=self.day_key, day_day=self.day_day, day_count=self.day_count,
+                day_sum=self.day_sum, day_last=self.day_last
+            )
+        os.replace(partial, path)
+        return path
+
+    @classmethod
+    def load(cls, key_column='水表名', filename=None):
+        """读取持久化的画像索引，不存在时返回空索引"""
+        profile = cls(key_column)
+        path = get_cache_path(filename or f'baseline_profile_{key_column}.npz')
+        if not path.exists():
+            return profile
+
+        stored = np.load(path, allow_pickle=True)
+        if 'calendar' not in stored or str(stored['calendar']) != get_calendar().signature():
+            print("校历已变化，基线画像将重新累积")
+            return profile
+        if 'day_count' not in stored:
+            print("基线画像缺少逐日记录，将重新累积")
+            return profile
+
+        profile.keys = list(stored['keys'])
+        profile.key_index = {k: i for i, k in enumerate(profile.keys)}
+        profile.activities = list(stored['activities'])
+        profile.activity_index = {a: i for i, a in enumerate(profile.activities)}
+        profile.sums = stored['sums']
+        profile.sumsq = stored['sumsq']
+        profile.counts = stored['counts']
+        for name in ['day_key', 'day_day', 'day_count', 'day_sum', 'day_last']:
+            setattr(profile, name, stored[name])
+        return profile
@@ -0,0 +1,65 @@
+"""
+水表聚类 - 按周内小时用水曲线对水表做向量化 k-means，并与功能区映射比对
+"""
+
+import numpy as np
+
+
+def normalize_profiles(profiles):
+    """把 (水表数, 168) 的周内小时平均用量归一化为形状曲线（每行和为1）
+
+    缺失的小时用该表其余小时的均值补齐；总用量为0的水表返回NaN行。
+    """
+    filled = np.where(np.isnan(profiles), np.nanmean(profiles, axis=1, keepdims=True), profiles)
+    totals = filled.sum(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(totals > 0, filled / totals, np.nan)
+
+
+def squared_distances(x, centers):
+    """所有点到所有中心的欧氏距离平方 (点数, 中心数)"""
+    d = (x ** 2).sum(axis=1)[:, None] - 2 * x @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+    return np.maximum(d, 0)
+
+
+def _kmeans_pp(x, k, rng):
+    """k-means++ 初始化"""
+    centers = [x[rng.integers(len(x))]]
+    closest = squared_distances(x, centers[0][None, :])[:, 0]
+    for _ in range(1, k):
+        total = closest.sum()
+        idx = rng.choice(len(x), p=closest / total) if total > 0 else rng.integers(len(x))
+        centers.append(x[idx])
+        closest = np.minimum(closest, squared_distances(x, x[idx][None, :])[:, 0])
+    return np.array(centers)
+
+
+def kmeans(x, k, n_init=10, max_iter=100, tol=1e-8, random_state=None):
+    """向量化 k-means（Lloyd 迭代，k-means++ 初始化，取 n_init 次中惯性最小的结果）
+
+    返回 (标签, 中心, 惯性)。
+    """
+    rng = np.random.default_rng(random_state)
+    k = min(k, len(x))
+    best = None
+    for _ in range(n_init):
+        centers = _kmeans_pp(x, k, rng)
+        for _ in range(max_iter):
+            labels = squared_distances(x, centers).argmin(axis=1)
+
+            # 一次求出所有簇的新中心；空簇保留原中心
+            counts = np.bincount(labels, minlength=k)
+            sums = np.eye(k)[labels].T @ x
+            new_centers = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+
+            shift = ((new_centers - centers) ** 2).sum()
+            centers = new_centers
+            if shift <= tol:
+                break
+
+        distances = squared_distances(x, centers)
+        labels = distances.argmin(axis=1)
+        inertia = distances[np.arange(len(x)), labels].sum()
+        if best is None or inertia < best[2]:
+            best = (labels, centers, inertia)
+    return best
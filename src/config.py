@@ -17,6 +17,70 @@ DATA_CONFIG = {
     'hierarchy_file': '附件_水表层级.xlsx',  # 水表层级文件
     'main_data_file': 'data.csv',  # 主数据文件
     'aux_data_file': 'data2.csv',  # 辅助数据文件
+    'calendar_file': '校历.csv',  # 校历（可选）：开始日期,结束日期,教学活动[,类型][,优先级]
+
+    # CSV解析引擎（见 csv_reader.py）：'auto' 安装了 pyarrow 时用其多线程解析，否则用 pandas；
+    # 数据文件也可以是 .csv.gz / .csv.zst 压缩导出（data.csv 不存在时自动查找 data.csv.gz 等）
+    'csv_engine': 'auto',
+    'arrow_block_size': 16 * 1024 * 1024,  # pyarrow 每个解析块的字节数
+
+    # 读取方式：'full' 每次全量解析，'delta' 只解析追加的尾部（见 delta_ingest.py）
+    'ingest_mode': 'full',
+    'delta_ingest': {
+        'hash_chunk_bytes': 16 * 1024 * 1024,  # 散列已读部分（校验是否改动）时每次读取的字节数
+        'compact_partitions': 30,  # 增量分区超过该数量时合并
+    },
+
+    # 原始读数归档（见 meter_archive.py）：与CSV同名的归档文件存在且不早于CSV时直接读取归档
+    'archive': {
+        'suffix': '.cfa',
+        'compress_level': 6,  # zlib 压缩级别
+    },
+
+    # 历史读数回放（见 replay.py）：按采集时间顺序、按加速倍数重新发出，用于实时组件压测
+    'replay': {
+        'speedup': 1000,  # 相对真实时间的加速倍数，0 表示不限速
+        'copies': 1,  # 每个水表复制为几个虚拟水表
+        'copy_sigma': 0.1,  # 虚拟水表用量系数的对数标准差
+        'batch_size': 1000,  # 每批最多发出的读数
+        'queue_size': 100,  # 进程内回放的队列容量（批）
+        'host': '127.0.0.1',
+        'port': 9900,
+        'random_state': 42,
+    },
+
+    # 读数数据源的统一模式（见 meter_store.py）：标准列名 -> 可接受的原始列名
+    'sources': {
+        'main': {
+            'file': 'main_data_file',
+            'key': '水表号',
+            'columns': {
+                '水表号': ['水表号'],
+                '水表名': ['水表名'],
+                '采集时间': ['采集时间'],
+                '用量': ['用量'],
+            },
+        },
+        'aux': {
+            'file': 'aux_data_file',
+            'key': '用户名',
+            'columns': {
+                '用户名': ['用户名', '用户'],
+                'code': ['code', '编码', '水表编码'],
+                '采集时间': ['采集时间'],
+                '用量': ['用量'],
+            },
+        },
+    },
+
+    # 15分钟网格规整参数
+    'regularization': {
+        'freq': '15min',
+        'duplicate_policy': 'dedupe',  # 'sum' 全部相加 / 'dedupe' 去掉完全重复的行后相加 / 'first' 保留第一条
+        'reset_factor': 10,  # 负用量绝对值超过正常用量(P95)的倍数时视为计数器重置
+        'mask_resets': True,  # 计数器重置的读数按缺失处理
+        'mask_negative': False,  # 其余负用量是否按缺失处理
+    },
 
     # 功能区映射
     'area_mapping': {
@@ -42,7 +106,15 @@ OUTPUT_CONFIG = {
     'output_dir': PROJECT_ROOT / "outputs",
     'figures_dir': PROJECT_ROOT / "outputs" / "figures",
     'reports_dir': PROJECT_ROOT / "outputs" / "reports",
-    'logs_dir': PROJECT_ROOT / "outputs" / "logs"
+    'logs_dir': PROJECT_ROOT / "outputs" / "logs",
+    'cache_dir': PROJECT_ROOT / "outputs" / "cache",  # 持久化的中间结果（基线画像等）
+
+    # 报告导出（见 report_writer.py）
+    'report': {
+        'format': 'xlsx',  # 'xlsx'、'csv' 或 'csv.gz'
+        'xlsx_engine': 'auto',  # 'auto' 优先 xlsxwriter，未安装时用 openpyxl 只写模式
+        'chunk_rows': 50000,  # 每次转换写出的行数
+    }
 }
 
 # 分析参数配置
@@ -59,6 +131,88 @@ ANALYSIS_CONFIG = {
         3: '春季学期', 4: '春季学期', 5: '春季学期', 6: '春季学期',  # 3-6月
         7: '暑假', 8: '暑假',  # 7-8月
         9: '秋季学期', 10: '秋季学期', 11: '秋季学期', 12: '秋季学期'  # 9-12月
+    },
+
+    # 全层级水量平衡
+    'water_balance': {
+        'top_n': 15,  # 图表和逐日差值表展示的节点数
+    },
+
+    # 从用量推断父子关系（见 relationship_discovery.py）
+    'relationship_discovery': {
+        'freq': '1h',  # 合并到的时间粒度
+        'min_coverage': 0.5,  # 有效时段比例低于该值的水表不参与
+        'min_corr': 0.2,  # 候选子表与父表的最低相关系数
+        'max_candidates': 20,  # 每个父表保留的候选子表数
+        'total_tolerance': 0.05,  # 候选子表总用量最多超出父表的比例
+        'block_size': 512,  # 分块计算相关矩阵时每块的水表数
+        'min_r2': 0.8,  # 父表 ≈ 子表之和 的拟合优度阈值
+    },
+
+    # 校历（见 academic_calendar.py）：区间重叠时按类型的优先级标注，数值大者优先
+    'calendar': {
+        'type_priority': {'学期': 0, '假期': 1, '考试': 2, '法定节假日': 3},
+    },
+
+    # 水表 × 日 × 小时 用量汇总（见 usage_rollup.py），功能区和关系模型的日/季度/教学活动图表由它增量刷新
+    'usage_rollup': {
+        'rebuild': False,  # 丢弃已保存的汇总，按本次数据全量重建（历史数据被修改后使用）
+        'verify': False,  # 增量合并后再全量重建一次并比对结果
+    },
+
+    # 完整分析流水线（见 pipeline.py）
+    'pipeline': {
+        'max_workers': 4,  # 并行执行的阶段数
+        'resume': True,  # 中断后再次运行时从检查点继续
+    },
+
+    # 异常检测参数（中位数/MAD 稳健基线）
+    'anomaly': {
+        'z_threshold': 5.0,  # 突增判定阈值（稳健Z分数）
+        'night_hours': [0, 1, 2, 3, 4],  # 夜间时段
+        'night_z_threshold': 3.5,  # 夜间异常用水阈值
+        'shift_window_days': 3,  # 基线偏移的滚动窗口（天）
+        'shift_z_threshold': 3.0,  # 基线偏移判定阈值
+        'mad_floor': 0.01,  # MAD下限，避免零波动水表得分爆炸
+        'min_samples': 3,  # 每个基线分组的最少样本数
+        'profile_fallback': True,  # 样本不足的分组改用基线画像（功能区分析按水表名持续累积）的历史均值和标准差
+        'block_size': 256,  # 每批计算的水表数，控制内存占用
+        'top_n': 20,  # 图表展示的异常数量
+    },
+
+    # 水表聚类参数（按周内小时用水曲线）
+    'clustering': {
+        'n_clusters': None,  # 聚类数，None 时取功能区数量
+        'n_init': 10,  # k-means 重复初始化次数
+        'max_iter': 100,
+        'random_state': 42,
+        'mismatch_margin': 0.1,  # 到所属功能区的距离比最近功能区大10%以上才判为不匹配
+    },
+
+    # 漏水判定参数扫描（重采样间隔 × 窗口长度 × 容差 的全部组合）
+    'leakage_sweep': {
+        'intervals': ['15min', '30min', '1h'],  # 重采样间隔，须为网格间隔的整数倍
+        'windows': ['1h', '2h', '3h', '4h', '6h'],  # 判定窗口长度，不是间隔整数倍的组合跳过
+        'tolerances': [1e-9, 1e-3, 1e-2],  # 判定“为0”的容差
+        'baseline': ('15min', '3h', 1e-9),  # 基准组合，与漏损分析的口径一致
+        'top_n': 20,  # 比较前N名重合度和排名稳定性
+    },
+
+    # 夜间最小流量参数
+    'night_flow': {
+        'start': '02:00',  # 夜间窗口开始（可跨午夜，如 '23:00'）
+        'end': '04:00',  # 夜间窗口结束（不含）
+        'trend_days': 7,  # 比较近期与前期的天数
+        'min_nights': 7,  # 参与排名的最少有效夜数
+        'top_n': 40,  # 趋势图展示的水表数
+    },
+
+    # 快速预览（分层抽样近似）参数
+    'quick_look': {
+        'sample_fraction': 0.1,  # 每层抽取的“水表-日”比例，越小越快、误差越大
+        'min_per_stratum': 2,  # 每层最少抽样数（用于估计层内方差）
+        'confidence': 0.95,  # 置信区间水平
+        'random_state': 42,  # 随机种子，保证结果可复现
     }
 }
 
@@ -66,7 +220,23 @@ ANALYSIS_CONFIG = {
 VISUALIZATION_CONFIG = {
     'font_family': 'SimHei',
     'figure_size': (12, 8),
-    'dpi': 300
+    'dpi': 300,
+
+    # 批量小图分页参数
+    'small_multiples': {
+        'rows': 4,
+        'cols': 5,
+        'page_size': (20, 14),
+        'dpi': 100,
+        'format': 'pdf',  # 'pdf' 输出多页PDF，'png' 每页输出一张图
+    }
+}
+
+
+# 启动性能预算（由 check_startup.py 检查）
+STARTUP_CONFIG = {
+    'import_budget_ms': 1500,  # 导入 src.main 的总耗时上限
+    'forbidden_modules': ['matplotlib'],  # 启动时不应被导入的模块
 }
 
 
@@ -77,7 +247,8 @@ def create_directories():
         OUTPUT_CONFIG['output_dir'],
         OUTPUT_CONFIG['figures_dir'],
         OUTPUT_CONFIG['reports_dir'],
-        OUTPUT_CONFIG['logs_dir']
+        OUTPUT_CONFIG['logs_dir'],
+        OUTPUT_CONFIG['cache_dir']
     ]
 
     for directory in dirs_to_create:
@@ -98,4 +269,9 @@ def get_figure_path(filename):
 
 def get_report_path(filename):
     """获取报告保存路径"""
-    return OUTPUT_CONFIG['reports_dir'] / filename
\ No newline at end of file
+    return OUTPUT_CONFIG['reports_dir'] / filename
+
+
+def get_cache_path(filename):
+    """获取缓存文件保存路径"""
+    return OUTPUT_CONFIG['cache_dir'] / filename
\ No newline at end of file
@@ -0,0 +1,11 @@
+"""
+公共常量 - 读数存储、归档和各分析器共用的列名与网格常量
+"""
+
+# 所有数据源共有的标准列；其余标识列保留解析得到的类型（需与层级表的水表号一致）
+TIME_COLUMN = '采集时间'
+VALUE_COLUMN = '用量'
+SOURCE_COLUMN = '来源'
+
+# 每天的15分钟时段数
+SLOTS_PER_DAY = 96
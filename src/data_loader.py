@@ -2,20 +2,33 @@
 数据加载器 - 统一负责所有数据的读取和处理
 """
 
+import numpy as np
 import pandas as pd
 import warnings
 
 warnings.filterwarnings('ignore')
 from .config import get_data_path, DATA_CONFIG
+from .data_regularizer import build_usage_grid
+from .group_index import GroupIndex
+from .meter_store import shared_store
+from .academic_calendar import get_calendar
+from .usage_rollup import refresh_rollup
+from .report_writer import save_report
 
 
 class DataLoader:
     """数据加载器类"""
 
-    def __init__(self):
+    def __init__(self, prepared_data=None, aux_data=None, store=None):
+        self.store = store or shared_store()
         self.hierarchy_data = None
         self.main_data = None
         self.aux_data = None
+        self.group_index = None
+
+        # 由流水线注入的已加载数据（见 main.build_full_pipeline），设置后不再读取文件
+        self._prepared_data = prepared_data
+        self._aux_data = aux_data
 
     def load_hierarchy_data(self):
         """加载水表层级数据"""
@@ -26,18 +39,22 @@ class DataLoader:
         return self.hierarchy_data
 
     def load_main_data(self):
-        """加载主数据"""
+        """加载主数据（来自共享的读数存储，浅复制）"""
         print("正在加载主数据...")
-        file_path = get_data_path(DATA_CONFIG['main_data_file'])
-        self.main_data = pd.read_csv(file_path)
+        self.main_data = self.store.frame('main').copy(deep=False)
         print(f"✓ 加载完成，形状: {self.main_data.shape}")
         return self.main_data
 
     def load_aux_data(self):
         """加载辅助数据"""
         print("正在加载辅助数据...")
-        file_path = get_data_path(DATA_CONFIG['aux_data_file'])
-        self.aux_data = pd.read_csv(file_path)
+        if self._aux_data is not None:
+            # 浅复制，分析器新增的列不影响其他阶段共享的数据
+            self.aux_data = self._aux_data.copy(deep=False)
+            print(f"✓ 使用已加载的数据，形状: {self.aux_data.shape}")
+            return self.aux_data
+
+        self.aux_data = self.store.frame('aux').copy(deep=False)
         print(f"✓ 加载完成，形状: {self.aux_data.shape}")
         return self.aux_data
 
@@ -84,29 +101,68 @@ class DataLoader:
         print(f"✓ 合并完成，形状: {merged_data.shape}")
         return merged_data
 
-    def add_teaching_activities(self, data, season_mapping):
-        """添加教学活动列"""
-        data['教学活动'] = data['month'].map(season_mapping)
+    def add_teaching_activities(self, data, calendar=None):
+        """按校历添加教学活动列（无校历文件时按月份规则）"""
+        calendar = calendar or get_calendar()
+        data['教学活动'] = calendar.label(data['采集时间'])
         return data
 
-    def load_and_prepare_all_data(self):
-        """加载并准备所有数据（一站式服务）"""
-        # 加载数据
-        hierarchy_raw = self.load_hierarchy_data()
-        main_raw = self.load_main_data()
+    def regularize_usage(self, data, key_column, attribute_columns=(), report_name=None, dtype=np.float64):
+        """把读数规整到统一的15分钟网格，并输出数据质量报告（dtype 为网格矩阵的类型）"""
+        print(f"正在按{key_column}规整15分钟网格...")
+        grid = build_usage_grid(data, key_column, attribute_columns, dtype=dtype)
+
+        quality = grid.quality
+        print(f"✓ 规整完成: {len(grid.keys)} 个水表 × {len(grid.slot_times)} 个时段，"
+              f"缺失时段 {quality['缺失时段数'].sum()}，重复读数 {quality['重复读数'].sum()}，"
+              f"负用量 {quality['负用量读数'].sum()}，计数器重置 {quality['计数器重置'].sum()}")
 
-        # 预处理
-        hierarchy_processed = self.preprocess_hierarchy_data(hierarchy_raw)
+        if report_name:
+            output_path = save_report(report_name, {'数据质量': quality})
+            print(f"✓ 数据质量报告已保存到: {output_path}")
 
+        return grid
+
+    def load_usage_rollup(self, data):
+        """加载 水表 × 日 × 小时 用量汇总并合并本次数据中新增的读数（见 usage_rollup.py）"""
+        print("正在更新用量汇总...")
+        ranges = None
+        if self.group_index is not None and data is self.group_index.data:
+            ranges = self.group_index.ranges.get('code')
+        return refresh_rollup(data, ranges)
+
+    def prepare_main_data(self, main_raw, hierarchy_processed):
+        """合并、添加教学活动并筛选有效数据，返回按水表编码和时间排序的数据"""
         # 合并
         merged_data = self.merge_data(main_raw, hierarchy_processed)
 
         # 添加教学活动
-        from .config import ANALYSIS_CONFIG
-        final_data = self.add_teaching_activities(merged_data, ANALYSIS_CONFIG['season_mapping'])
+        final_data = self.add_teaching_activities(merged_data)
 
         # 筛选有效数据
         valid_data = final_data[final_data['code'].notnull()].copy()
+        valid_data['code_3'] = valid_data['code'].astype(str).str[:3]
+        return valid_data.sort_values(['code', '采集时间'], kind='mergesort').reset_index(drop=True)
+
+    def load_and_prepare_all_data(self):
+        """加载并准备所有数据（一站式服务）"""
+        if self._prepared_data is not None:
+            # 浅复制，分析器新增的列不影响其他阶段共享的数据
+            valid_data = self._prepared_data.copy(deep=False)
+        else:
+            # 加载数据
+            hierarchy_raw = self.load_hierarchy_data()
+            main_raw = self.load_main_data()
+
+            # 预处理
+            hierarchy_processed = self.preprocess_hierarchy_data(hierarchy_raw)
+
+            # 合并并筛选有效数据
+            valid_data = self.prepare_main_data(main_raw, hierarchy_processed)
+
+        # 预计算分组索引，供各分析器按组切片
+        self.group_index = GroupIndex(valid_data, group_columns=['code', 'code_3', '教学活动'])
+        valid_data = self.group_index.data
         print(f"✓ 有效数据行数: {len(valid_data)}")
 
-        return valid_data
\ No newline at end of file
+        return valid_data
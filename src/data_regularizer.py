@@ -0,0 +1,179 @@
+"""
+数据规整 - 把所有水表的读数对齐到统一的15分钟网格，并生成数据质量报告
+"""
+
+import numpy as np
+import pandas as pd
+
+from .config import DATA_CONFIG
+
+
+class UsageGrid:
+    """统一15分钟网格
+
+    values 为 (水表数, 时段数) 的用水量矩阵，缺失时段为NaN；
+    网格从最早读数当天的0点开始，因此按小时、天切块时与日历对齐。
+    first_slot/last_slot 记录每个水表实际有读数的首末时段。
+    """
+
+    def __init__(self, keys, slot_times, values, first_slot, last_slot, meta, quality):
+        self.keys = keys
+        self.slot_times = slot_times
+        self.values = values
+        self.first_slot = first_slot
+        self.last_slot = last_slot
+        self.meta = meta
+        self.quality = quality
+        self.key_index = {k: i for i, k in enumerate(keys)}
+
+    @property
+    def freq(self):
+        """网格间隔"""
+        return self.slot_times.freq
+
+    def span_mask(self):
+        """每个水表首末读数之间的时段掩码"""
+        slots = np.arange(len(self.slot_times))
+        return (slots[None, :] >= self.first_slot[:, None]) & (slots[None, :] <= self.last_slot[:, None])
+
+    def series(self, key):
+        """取单个水表在其有效区间内的时间序列"""
+        i = self.key_index[key]
+        span = slice(self.first_slot[i], self.last_slot[i] + 1)
+        return pd.Series(self.values[i, span], index=self.slot_times[span], name=key)
+
+    def rows_where(self, column, values):
+        """按元数据列筛选网格行号"""
+        return np.flatnonzero(self.meta[column].isin(values).to_numpy())
+
+    def sum_by(self, column, rows=None):
+        """按元数据列把网格行相加，返回 分组 × 时段 的DataFrame（全缺失时段保持NaN）"""
+        rows = np.arange(len(self.keys)) if rows is None else rows
+        frame = pd.DataFrame(self.values[rows], columns=self.slot_times)
+        return frame.groupby(self.meta[column].to_numpy()[rows]).sum(min_count=1)
+
+
+def _group_starts(sorted_codes):
+    """有序数组中每组第一个元素的位置"""
+    if len(sorted_codes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate([[True], sorted_codes[1:] != sorted_codes[:-1]]))
+
+
+def reading_masks(cells, times, usage, meters, n_meters):
+    """按规整规则标记读数，返回 (参与求和, 负用量, 计数器重置) 三个布尔数组
+
+    cells 为读数所在的 (水表, 时段) 编号，meters 为水表序号（0..n_meters-1）。
+    重复读数按 duplicate_policy 处理（'first' 保留每个时段按原始顺序的第一条），
+    负用量、计数器重置按 mask_negative、mask_resets 决定是否剔除。
+    """
+    params = DATA_CONFIG['regularization']
+    keep = np.ones(len(cells), dtype=bool)
+    if params['duplicate_policy'] == 'dedupe':
+        keep = ~pd.DataFrame({'cell': cells, 'time': times, 'usage': usage}).duplicated().to_numpy()
+    elif params['duplicate_policy'] == 'first':
+        keep = ~pd.Series(cells).duplicated().to_numpy()
+
+    # 绝对值超过该表正常用量（正用量的95分位数）reset_factor 倍的负值视为计数器重置
+    negative = usage < 0
+    positive = pd.Series(np.where(usage > 0, usage, np.nan)).groupby(meters).quantile(0.95)
+    typical = positive.reindex(range(n_meters)).fillna(0).to_numpy()[meters]
+    reset = negative & (np.abs(usage) > params['reset_factor'] * np.maximum(typical, 1e-9))
+    if params['mask_resets']:
+        keep &= ~reset
+    if params['mask_negative']:
+        keep &= ~negative
+    return keep, negative, reset
+
+
+def build_usage_grid(data, key_column, attribute_columns=(), time_column='采集时间', value_column='用量',
+                     dtype=np.float64):
+    """一次向量化处理，把长表读数规整到统一网格
+
+    - 非整点的读数归入所在的时段，并计数
+    - 重复读数按 duplicate_policy 处理：'sum' 全部相加，'dedupe' 先去掉
+      完全相同的重复行再相加，'first' 只保留每个时段的第一条
+    - 负用量计数；绝对值超过该表正常用量 reset_factor 倍的负值视为计数器重置
+    - 首末读数之间没有读数的时段视为缺失
+
+    读数按 (水表, 时段) 排序后逐格归并，除结果矩阵外只用与读数条数等长的数组；
+    缺失统计由每个水表有读数的时段推出，不展开 水表 × 时段 的掩码。
+    dtype 为结果矩阵的类型（求和始终按float64进行）。
+    """
+    params = DATA_CONFIG['regularization']
+    freq = pd.Timedelta(params['freq'])
+
+    data = data[data[key_column].notnull()]
+    times = pd.to_datetime(data[time_column])
+    usage = data[value_column].to_numpy(dtype=float)
+
+    meter_idx, keys = pd.factorize(data[key_column], sort=True)
+    floored = times.dt.floor(freq)
+    start = floored.min().floor('D')
+    slot_times = pd.date_range(start, floored.max(), freq=freq)
+    slot_idx = ((floored - start) // freq).to_numpy()
+
+    n_meters, n_slots = len(keys), len(slot_times)
+    flat = meter_idx.astype(np.int64) * n_slots + slot_idx
+    offgrid = np.bincount(meter_idx, weights=(times != floored).to_numpy(), minlength=n_meters)
+    times = times.to_numpy()
+
+    # 按 (水表, 时段) 稳定排序，同一时段内保持原始顺序；数据已按水表、时间排好时不必重排
+    if len(flat) > 1 and (flat[1:] < flat[:-1]).any():
+        order = np.argsort(flat, kind='stable')
+        flat, meter_idx, times, usage = flat[order], meter_idx[order], times[order], usage[order]
+
+    # 有读数的时段与重复读数
+    cell_starts = _group_starts(flat)
+    observed = flat[cell_starts]
+    observed_meter = observed // n_slots
+    observed_slot = observed - observed_meter * n_slots
+    n_observed = np.bincount(observed_meter, minlength=n_meters).astype(np.int32)
+    duplicates = np.bincount(meter_idx, minlength=n_meters) - n_observed
+
+    # 重复读数、负用量与计数器重置
+    keep, negative, reset = reading_masks(flat, times, usage, meter_idx, n_meters)
+
+    # 逐格求和，只写入有保留读数的时段
+    kept = flat[keep]
+    kept_starts = _group_starts(kept)
+    values = np.full((n_meters, n_slots), np.nan, dtype=dtype)
+    valid = np.zeros(n_meters, dtype=np.int32)
+    if len(kept):
+        sums = np.add.reduceat(usage[keep], kept_starts)
+        np.put(values, kept[kept_starts], sums)
+        valid = np.bincount(kept[kept_starts] // n_slots, weights=~np.isnan(sums),
+                            minlength=n_meters).astype(np.int32)
+
+    # 首末读数与缺失时段：同一水表相邻两个有读数时段之间的空档即缺失
+    meter_starts = _group_starts(observed_meter)
+    first_slot = observed_slot[meter_starts]
+    last_slot = observed_slot[np.append(meter_starts[1:], len(observed)) - 1]
+    expected_slots = last_slot - first_slot + 1
+    gaps = expected_slots - n_observed
+    longest_gap = np.zeros(n_meters, dtype=np.int64)
+    same_meter = observed_meter[1:] == observed_meter[:-1]
+    np.maximum.at(longest_gap, observed_meter[1:][same_meter], np.diff(observed_slot)[same_meter] - 1)
+
+    meta = pd.DataFrame(index=keys)
+    for column in attribute_columns:
+        meta[column] = data.groupby(key_column)[column].first().reindex(keys)
+
+    quality = pd.DataFrame({
+        key_column: keys,
+        '首次读数时间': slot_times[first_slot],
+        '末次读数时间': slot_times[last_slot],
+        '应有时段数': expected_slots,
+        '有效时段数': valid,
+        '缺失时段数': gaps,
+        '缺失率': (gaps / expected_slots).round(4),
+        '最长连续缺失时段数': longest_gap,
+        '重复读数': duplicates,
+        '非整点读数': offgrid.astype(np.int64),
+        '负用量读数': np.bincount(meter_idx, weights=negative, minlength=n_meters).astype(np.int64),
+        '计数器重置': np.bincount(meter_idx, weights=reset, minlength=n_meters).astype(np.int64),
+    })
+    for i, column in enumerate(attribute_columns):
+        quality.insert(1 + i, column, meta[column].to_numpy())
+
+    return UsageGrid(keys, slot_times, values, first_slot, last_slot, meta, quality)
@@ -0,0 +1,187 @@
+"""
+增量读取 - 追加式CSV导出只解析上次读取位置之后新增的尾部
+"""
+
+import hashlib
+import io
+import json
+
+import pandas as pd
+
+from .config import get_cache_path, DATA_CONFIG
+
+
+class DeltaIngestor:
+    """追加式CSV的检查点增量读取
+
+    检查点记录上次读到的字节位置、最后的采集时间，以及表头和已读部分
+    [0, 位置) 全部字节的摘要。再次读取时流式重算这段字节的摘要（只读取
+    和散列，代价远低于解析CSV），一致时只解析新增的完整行并写成一个新的
+    分区；表头或已读部分的任何字节发生变化时自动全量重建。
+    """
+
+    def __init__(self, file_path, time_column='采集时间'):
+        self.file_path = file_path
+        self.time_column = time_column
+        self.params = DATA_CONFIG['delta_ingest']
+        self.store_dir = get_cache_path(f'ingest_{file_path.name}')
+        self.checkpoint_path = self.store_dir / 'checkpoint.json'
+
+    def _hash_range(self, handle, start, stop, digest=None):
+        """分块流式散列 [start, stop) 的字节；传入 digest 时在其基础上继续"""
+        digest = digest or hashlib.sha1()
+        chunk_size = self.params['hash_chunk_bytes']
+        handle.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = handle.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+        return digest
+
+    @staticmethod
+    def _complete_end(handle, size):
+        """最后一个换行符之后的位置，未写完的最后一行留到下次读取"""
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            handle.seek(position - step)
+            chunk = handle.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline >= 0:
+                return position - step + newline + 1
+            position -= step
+        return 0
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path.exists():
+            return None
+        with open(self.checkpoint_path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def _partitions(self):
+        return sorted(self.store_dir.glob('part-*.pkl'))
+
+    def _write_partition(self, frame, number):
+        frame.to_pickle(self.store_dir / f'part-{number:05d}.pkl')
+
+    def _save_checkpoint(self, checkpoint):
+        with open(self.checkpoint_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+
+    def _full_rebuild(self, handle, size, end):
+        """全量解析并重建分区存储"""
+        for part in self._partitions():
+            part.unlink()
+
+        if end == size:
+            data = pd.read_csv(self.file_path)
+        else:
+            handle.seek(0)
+            data = pd.read_csv(io.BytesIO(handle.read(end)))
+
+        self._write_partition(data, 0)
+        return data
+
+    def _read_tail(self, handle, checkpoint, end):
+        """只解析 [上次位置, end) 之间新增的完整行
+
+        已存为字符串的列按字符串读取；其余列的类型须与已存数据一致（整数可
+        提升为浮点），否则返回 None，由调用方全量重建，保证结果与整体解析相同。
+        """
+        dtypes = checkpoint['dtypes']
+        handle.seek(checkpoint['offset'])
+        tail = pd.read_csv(io.BytesIO(handle.read(end - checkpoint['offset'])),
+                           header=None, names=checkpoint['columns'],
+                           dtype={c: str for c, t in dtypes.items() if t == 'object'})
+
+        for column, dtype in dtypes.items():
+            if dtype == 'object' or str(tail[column].dtype) == dtype:
+                continue
+            if dtype == 'float64' and pd.api.types.is_integer_dtype(tail[column]):
+                tail[column] = tail[column].astype(dtype)
+                continue
+            print(f"  {self.file_path.name} 新增数据的 {column} 列类型（{tail[column].dtype}）"
+                  f"与已存数据（{dtype}）不一致，改为全量解析")
+            return None
+        return tail
+
+    def read(self):
+        """读取文件，返回完整的数据表"""
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        checkpoint = self._load_checkpoint()
+
+        with open(self.file_path, 'rb') as handle:
+            handle.seek(0, 2)
+            size = handle.tell()
+            end = self._complete_end(handle, size)
+            handle.seek(0)
+            header = handle.readline().decode('utf-8', errors='replace').strip()
+
+            partitions = self._partitions()
+            digest = None
+            reusable = (
+                checkpoint is not None and partitions
+                and checkpoint['header'] == header
+                and checkpoint['offset'] <= end
+            )
+            if reusable:
+                digest = self._hash_range(handle, 0, checkpoint['offset'])
+                reusable = checkpoint.get('prefix_sha1') == digest.hexdigest()
+
+            tail = None
+            if reusable and end > checkpoint['offset']:
+                tail = self._read_tail(handle, checkpoint, end)
+                reusable = tail is not None
+
+            if not reusable:
+                print(f"  全量解析 {self.file_path.name}...")
+                data = self._full_rebuild(handle, size, end)
+                checkpoint = {
+                    'header': header,
+                    'columns': list(data.columns),
+                    'dtypes': {c: str(t) for c, t in data.dtypes.items()},
+                    'partitions': 1,
+                }
+                new_rows = len(data)
+                frames = [data]
+            else:
+                frames = [pd.read_pickle(part) for part in partitions]
+                new_rows = 0
+                if tail is not None:
+                    self._write_partition(tail, checkpoint['partitions'])
+                    checkpoint['partitions'] += 1
+                    frames.append(tail)
+                    new_rows = len(tail)
+                print(f"  增量读取 {self.file_path.name}: 新增 {new_rows} 行"
+                      f"（{(end - checkpoint['offset']) / 1024:.1f} KB）")
+
+            # 已读部分的摘要：增量时在上次摘要的基础上只散列新增的字节
+            if reusable:
+                digest = self._hash_range(handle, checkpoint['offset'], end, digest)
+            else:
+                digest = self._hash_range(handle, 0, end)
+            checkpoint['offset'] = end
+            checkpoint['prefix_sha1'] = digest.hexdigest()
+
+        data = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+        # 分区过多时合并为一个，避免读取大量小文件
+        if len(frames) > self.params['compact_partitions']:
+            for part in self._partitions():
+                part.unlink()
+            self._write_partition(data, 0)
+            checkpoint['partitions'] = 1
+
+        if new_rows and self.time_column in data.columns:
+            new_times = pd.to_datetime(data[self.time_column].iloc[-new_rows:])
+            previous = checkpoint.get('last_time')
+            if previous and new_rows < len(data) and new_times.min() < pd.Timestamp(previous):
+                print(f"  注意: {self.file_path.name} 新增数据的时间早于上次读取的最后时间 {previous}")
+            last_time = new_times.max() if not previous else max(new_times.max(), pd.Timestamp(previous))
+            checkpoint['last_time'] = str(last_time)
+
+        self._save_checkpoint(checkpoint)
+        return data
@@ -0,0 +1,71 @@
+"""
+分组索引 - 预计算各分组的行范围，按组取子集时无需整表扫描和复制
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class GroupIndex:
+    """预计算的行分组索引
+
+    数据先按 sort_columns 排序一次。排序后连续存放的分组（如水表编码及其
+    前缀）只记录 [起, 止) 偏移，取子集是 iloc 切片视图，不复制数据；
+    不连续的分组（如功能区、教学活动）记录行号数组，取子集的成本只与
+    子集大小有关。
+    """
+
+    def __init__(self, data, sort_columns=('code', '采集时间'), group_columns=()):
+        self.data = data.sort_values(list(sort_columns), kind='mergesort').reset_index(drop=True)
+        self.ranges = {}
+        self.positions = {}
+        for column in group_columns:
+            self.add(column)
+
+    def add(self, column):
+        """为某一列建立分组索引（列可以在建索引后才加入数据）"""
+        codes, uniques = pd.factorize(self.data[column])
+        self.ranges.pop(column, None)
+        self.positions.pop(column, None)
+
+        starts = np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1]]))
+        run_codes = codes[starts]
+        if len(np.unique(run_codes)) == len(run_codes):
+            # 每组只有一段连续的行：记录偏移范围
+            stops = np.concatenate([starts[1:], [len(codes)]])
+            self.ranges[column] = {
+                uniques[c]: (start, stop)
+                for c, start, stop in zip(run_codes, starts, stops) if c >= 0
+            }
+        else:
+            # 分散的分组：一次稳定排序得到各组的行号
+            order = np.argsort(codes, kind='stable')
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            bounds = np.concatenate([[0], np.cumsum(counts)]) + np.sum(codes < 0)
+            self.positions[column] = {
+                value: order[bounds[i]:bounds[i + 1]] for i, value in enumerate(uniques)
+            }
+
+    def keys(self, column):
+        """某列的全部分组值"""
+        groups = self.ranges.get(column, self.positions.get(column))
+        if groups is None:
+            raise KeyError(f"没有为列 {column} 建立分组索引")
+        return list(groups.keys())
+
+    def get(self, column, value):
+        """取某个分组的子集；连续分组返回切片视图，不存在的分组返回空表"""
+        if column in self.ranges:
+            start, stop = self.ranges[column].get(value, (0, 0))
+            return self.data.iloc[start:stop]
+        if column in self.positions:
+            positions = self.positions[column].get(value)
+            if positions is None:
+                return self.data.iloc[0:0]
+            return self.data.take(positions)
+        raise KeyError(f"没有为列 {column} 建立分组索引")
+
+    def items(self, column):
+        """依次返回 (分组值, 子集)"""
+        for value in self.keys(column):
+            yield value, self.get(column, value)
@@ -2,15 +2,124 @@
 漏损分析器 - 从"供水管网漏损分析.py"重构
 """
 
+import time
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import warnings
 
 warnings.filterwarnings('ignore')
 from .config import (
-    get_figure_path, get_report_path,
-    VISUALIZATION_CONFIG
+    get_figure_path,
+    ANALYSIS_CONFIG, VISUALIZATION_CONFIG
 )
+from .plotting import get_pyplot
+from .report_writer import save_report
+
+# 漏水判定窗口：3小时 = 12个15分钟时段
+WINDOW_SLOTS = 12
+
+# 判定“为0”的容差，只用于吸收浮点求和误差
+EQUAL_TOLERANCE = 1e-9
+
+# 每批计算的水表数，差分、补齐等临时矩阵只按批分配
+BLOCK_ROWS = 256
+
+
+def leakage_window_counts(values, window_slots=WINDOW_SLOTS, tolerance=EQUAL_TOLERANCE, previous=None):
+    """按行统计漏水判定的分子与分母
+
+    values 为从0点开始的15分钟网格矩阵（缺失为NaN）。与原逐表算法一致：
+    窗口内相邻时段用量差的均值为0记为“用量不变”，窗口用量均值为0记为
+    “无用水”。返回 ((用量不变窗口数 - 无用水窗口数) × 窗口长度, 有效时段数)。
+    previous 为每行第一个时段之前的读数，按天切块计算时用于补上跨天的差分。
+    """
+    n_rows, n_slots = values.shape
+    padded = np.pad(values, ((0, 0), (0, (-n_slots) % window_slots)), constant_values=np.nan)
+    before = np.full((n_rows, 1), np.nan) if previous is None else np.asarray(previous, dtype=float).reshape(n_rows, 1)
+    diff = np.diff(padded, axis=1, prepend=before)
+
+    window_diff = np.nanmean(diff.reshape(n_rows, -1, window_slots), axis=2)
+    window_usage = np.nanmean(padded.reshape(n_rows, -1, window_slots), axis=2)
+    same_consumption = np.sum(np.abs(window_diff) <= tolerance, axis=1)
+    zero_consumption = np.sum(np.abs(window_usage) <= tolerance, axis=1)
+
+    n_valid = np.sum(~np.isnan(values), axis=1)
+    return (same_consumption - zero_consumption) * window_slots, n_valid
+
+
+def leakage_ratios(values, window_slots=WINDOW_SLOTS, tolerance=EQUAL_TOLERANCE, block_rows=BLOCK_ROWS):
+    """按行向量化计算漏水比例 = 漏水时段数 / 有效时段数（见 leakage_window_counts），每批 block_rows 行"""
+    ratios = np.empty(len(values))
+    for start in range(0, len(values), block_rows):
+        leak_slots, n_valid = leakage_window_counts(values[start:start + block_rows], window_slots, tolerance)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            ratios[start:start + block_rows] = leak_slots / n_valid
+    return ratios
+
+
+def merge_slots(values, factor):
+    """把从0点开始的网格按每 factor 个时段相加（全部缺失为NaN，末尾不足的部分补NaN）"""
+    if factor == 1:
+        return values
+    n_rows, n_slots = values.shape
+    padded = np.pad(values, ((0, 0), (0, (-n_slots) % factor)), constant_values=np.nan)
+    blocks = padded.reshape(n_rows, -1, factor)
+    return np.where(np.isnan(blocks).all(axis=2), np.nan, np.nansum(blocks, axis=2))
+
+
+def leakage_sweep(values, freq, intervals, windows, tolerances, block_rows=BLOCK_ROWS):
+    """一次计算多组 (重采样间隔, 窗口长度, 容差) 下所有行的漏水比例
+
+    每个重采样间隔只合并一次网格、计算一次差分；同一间隔下的各窗口长度
+    复用这份差分，同一窗口下的各容差复用窗口均值。窗口长度不是间隔整数倍
+    的组合跳过。判定规则与 leakage_window_counts 一致。按每批 block_rows 行
+    计算，返回 ([(间隔, 窗口, 容差), ...], 行 × 参数组合 的漏水比例矩阵)。
+    """
+    combos, blocks = [], []
+    for start in range(0, len(values), block_rows):
+        combos, block = _sweep_block(values[start:start + block_rows], freq, intervals, windows, tolerances)
+        blocks.append(block)
+    if not blocks:
+        combos, block = _sweep_block(values, freq, intervals, windows, tolerances)
+        blocks.append(block)
+    return combos, np.vstack(blocks)
+
+
+def _sweep_block(values, freq, intervals, windows, tolerances):
+    """leakage_sweep 的单批计算"""
+    freq = pd.Timedelta(freq)
+    tolerances = np.asarray(tolerances, dtype=float)
+    combos, columns = [], []
+    for interval in intervals:
+        factor, rest = divmod(pd.Timedelta(interval), freq)
+        if rest or factor < 1:
+            continue
+        merged = merge_slots(values, factor)
+        n_rows, n_slots = merged.shape
+        n_valid = np.sum(~np.isnan(merged), axis=1)
+        diff = np.diff(merged, axis=1, prepend=np.nan)
+
+        for window in windows:
+            window_slots, rest = divmod(pd.Timedelta(window), pd.Timedelta(interval))
+            if rest or window_slots < 1:
+                continue
+            pad = ((0, 0), (0, (-n_slots) % window_slots))
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                window_diff = np.nanmean(np.pad(diff, pad, constant_values=np.nan).reshape(n_rows, -1, window_slots), axis=2)
+                window_usage = np.nanmean(np.pad(merged, pad, constant_values=np.nan).reshape(n_rows, -1, window_slots), axis=2)
+
+            # 容差 × 行 × 窗口 一次比较
+            same = np.sum(np.abs(window_diff)[None] <= tolerances[:, None, None], axis=2)
+            zero = np.sum(np.abs(window_usage)[None] <= tolerances[:, None, None], axis=2)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ratios = (same - zero) * window_slots / n_valid
+            for tolerance, column in zip(tolerances, ratios):
+                combos.append((interval, window, float(tolerance)))
+                columns.append(column)
+
+    matrix = np.column_stack(columns) if columns else np.zeros((len(values), 0))
+    return combos, matrix
 
 
 class LeakageAnalyzer:
@@ -19,92 +128,72 @@ class LeakageAnalyzer:
     def __init__(self, data_loader):
         self.data_loader = data_loader
         self.result = None
-
-        # 设置中文字体
-        plt.rcParams['font.sans-serif'] = [VISUALIZATION_CONFIG['font_family']]
-        plt.rcParams['axes.unicode_minus'] = False
+        self.grid = None
 
     def prepare_data(self):
         """准备数据"""
         print("正在加载辅助数据...")
 
-        # 加载辅助数据
+        # 加载辅助数据（列名与类型已按 DATA_CONFIG['sources'] 的模式规整）
         aux_data = self.data_loader.load_aux_data()
-        aux_data['采集时间'] = pd.to_datetime(aux_data['采集时间'])
-
-        # 检查必要的列
-        if 'code' not in aux_data.columns:
-            print("警告: 数据中没有'code'列，尝试查找...")
-            # 查找编码相关列
-            code_columns = [col for col in aux_data.columns if 'code' in col.lower() or '编码' in col]
-            if code_columns:
-                print(f"找到编码列: {code_columns[0]}")
-                aux_data['code'] = aux_data[code_columns[0]]
-            else:
-                print("错误: 未找到编码列")
-                return None
-
-        if '用户名' not in aux_data.columns:
-            print("警告: 数据中没有'用户名'列，尝试查找...")
-            # 查找用户相关列
-            user_columns = [col for col in aux_data.columns if '用户' in col or '名' in col]
-            if user_columns:
-                print(f"找到用户名列: {user_columns[0]}")
-                aux_data['用户名'] = aux_data[user_columns[0]]
-            else:
-                print("错误: 未找到用户名列")
-                return None
-
-        # 筛选有效数据
-        self.result = aux_data[aux_data['code'].notnull()].copy()
+
+        # 筛选有效数据（全部有效时直接使用共享数据）
+        valid = aux_data['code'].notnull()
+        self.result = aux_data if valid.all() else aux_data[valid]
         print(f"✓ 有效数据行数: {len(self.result)}")
 
+        # 按用户名规整到统一的15分钟网格
+        self.grid = self.data_loader.regularize_usage(
+            self.result, '用户名', ['code'], report_name='data_quality_data2.xlsx'
+        )
+
         return self.result
 
-    def analyze_40404T(self):
-        """分析40404T水表"""
+    def analyze_40404T(self, plot=True):
+        """分析40404T水表（plot=False 时只计算不绘图），返回其15分钟用量序列"""
         print("\n分析40404T水表...")
 
         if self.result is None:
             print("请先准备数据")
-            return
+            return None
 
-        if '40404T' in self.result['code'].values:
-            result_40404T = self.result[self.result['code'] == '40404T'].copy()
-
-            if len(result_40404T) > 0:
-                # 设置时间索引
-                result_40404T.set_index("采集时间", inplace=True)
-
-                # 计算每15分钟的用量和
-                sum_40404T = result_40404T['用量'].resample('15min').sum()
-
-                # 可视化
-                fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
-                sum_40404T.plot.line(
-                    ax=ax,
-                    title='40404T水表用水量时间序列（15分钟间隔）'
-                )
-                ax.set_xlabel('采集时间')
-                ax.set_ylabel('用水量')
-                ax.grid(True, alpha=0.3)
-
-                plt.tight_layout()
-                plt.savefig(get_figure_path('40404T_用水量时间序列.png'), dpi=VISUALIZATION_CONFIG['dpi'])
-                plt.close()
-                print("✓ 已保存: 40404T_用水量时间序列.png")
-
-                # 漏水分析
-                same_consumption = (sum_40404T.diff().resample('3h').mean() == 0).sum()
-                zero_consumption = (sum_40404T.resample('3h').mean() == 0).sum()
-
-                if len(sum_40404T) > 0:
-                    leakage_ratio = (same_consumption - zero_consumption) * 12 / len(sum_40404T)
-                    print(f"40404T水表漏水比例: {leakage_ratio:.2%}")
-            else:
-                print("40404T水表数据为空")
-        else:
+        rows = self.grid.rows_where('code', ['40404T'])
+        if len(rows) == 0:
             print("数据中没有找到40404T水表")
+            return None
+
+        # 取15分钟网格上的用量（同编码的多个用户相加），截取首末读数之间
+        sum_40404T = self.grid.sum_by('code', rows).loc['40404T']
+        if not sum_40404T.notnull().any():
+            print("40404T水表数据为空")
+            return None
+        sum_40404T = sum_40404T.loc[sum_40404T.first_valid_index():sum_40404T.last_valid_index()]
+
+        # 漏水分析（序列从网格起点对齐，窗口与日历对齐）
+        aligned = sum_40404T.reindex(self.grid.slot_times)
+        leakage_ratio = leakage_ratios(aligned.to_numpy()[None, :])[0]
+        print(f"40404T水表漏水比例: {leakage_ratio:.2%}")
+
+        if plot:
+            self.plot_40404T(sum_40404T)
+        return sum_40404T
+
+    def plot_40404T(self, sum_40404T):
+        """绘制40404T水表用水量时间序列"""
+        plt = get_pyplot()
+        fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
+        sum_40404T.plot.line(
+            ax=ax,
+            title='40404T水表用水量时间序列（15分钟间隔）'
+        )
+        ax.set_xlabel('采集时间')
+        ax.set_ylabel('用水量')
+        ax.grid(True, alpha=0.3)
+
+        plt.tight_layout()
+        plt.savefig(get_figure_path('40404T_用水量时间序列.png'), dpi=VISUALIZATION_CONFIG['dpi'])
+        plt.close()
+        print("✓ 已保存: 40404T_用水量时间序列.png")
 
     def calculate_leakage_rates(self):
         """计算所有水表的漏水率"""
@@ -114,31 +203,13 @@ class LeakageAnalyzer:
             print("请先准备数据")
             return None
 
-        res_rate = {}
-
-        for username in self.result['用户名'].unique():
-            result_tmp = self.result[self.result['用户名'] == username].copy()
-
-            if len(result_tmp) > 0:
-                try:
-                    result_tmp.set_index("采集时间", inplace=True)
-
-                    if len(result_tmp) > 1:
-                        sum_tmp = result_tmp['用量'].resample('15min').sum()
-
-                        if len(sum_tmp) > 0:
-                            same_consumption = (sum_tmp.diff().resample('3h').mean() == 0).sum()
-                            zero_consumption = (sum_tmp.resample('3h').mean() == 0).sum()
-
-                            if len(sum_tmp) > 0:
-                                leakage_ratio = (same_consumption - zero_consumption) * 12 / len(sum_tmp)
-                                res_rate[username] = leakage_ratio
-                except Exception as e:
-                    print(f"计算用户{username}漏水率失败: {e}")
+        # 在15分钟网格上一次性计算所有水表
+        ratios = leakage_ratios(self.grid.values)
+        valid = self.grid.quality['有效时段数'].to_numpy() > 1
 
         # 转换为DataFrame
-        if res_rate:
-            res = pd.DataFrame({'code': list(res_rate.keys()), 'rate': list(res_rate.values())})
+        if valid.any():
+            res = pd.DataFrame({'code': np.asarray(self.grid.keys)[valid], 'rate': ratios[valid]})
             res['rate'] = (res['rate'] * 100).round(2)
             res_sorted = res.sort_values('rate', ascending=False)
 
@@ -155,6 +226,7 @@ class LeakageAnalyzer:
         print(f"共分析 {len(leakage_rates)} 个水表的漏水率")
 
         # 漏水率分布直方图
+        plt = get_pyplot()
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
 
         ax1.hist(leakage_rates['rate'], bins=20, edgecolor='black', alpha=0.7)
@@ -189,15 +261,106 @@ class LeakageAnalyzer:
         print(f"最高漏水率: {leakage_rates['rate'].max():.2f}%")
         print(f"最低漏水率: {leakage_rates['rate'].min():.2f}%")
 
+    def sweep_parameters(self):
+        """漏水判定参数扫描：一次共享计算评估多组重采样间隔、窗口长度和容差
+
+        输出 水表 × 参数组合 的漏水率表，以及各组合与基准组合（默认为15分钟、
+        3小时、精确为0，即 calculate_leakage_rates 的口径）的排名相关、前N名重合度和各水表排名的稳定性。
+        """
+        print("\n漏水判定参数扫描...")
+
+        if self.grid is None:
+            print("请先准备数据")
+            return None
+
+        params = ANALYSIS_CONFIG['leakage_sweep']
+        start_time = time.time()
+        combos, matrix = leakage_sweep(
+            self.grid.values, self.grid.freq, params['intervals'], params['windows'], params['tolerances']
+        )
+        labels = [f'{interval}/{window}/{tolerance:g}' for interval, window, tolerance in combos]
+        valid = self.grid.quality['有效时段数'].to_numpy() > 1
+        rates = pd.DataFrame(matrix[valid] * 100, index=np.asarray(self.grid.keys)[valid], columns=labels).round(2)
+        rates.index.name = 'code'
+        print(f"✓ {len(rates)} 个水表 × {len(labels)} 组参数计算完成，用时 {time.time() - start_time:.2f} 秒")
+
+        # 排名：漏水率越高排名越前，同值取平均名次
+        ranks = rates.rank(ascending=False)
+        top_n = min(params['top_n'], len(rates))
+        in_top = ranks <= top_n
+        interval, window, tolerance = params['baseline']
+        baseline = f'{interval}/{window}/{tolerance:g}'
+
+        summary = pd.DataFrame({
+            '重采样间隔': [c[0] for c in combos],
+            '窗口长度': [c[1] for c in combos],
+            '容差': [c[2] for c in combos],
+            '平均漏水率(%)': rates.mean().round(2).to_numpy(),
+            '漏水率>0的水表比例': (rates > 0).mean().round(4).to_numpy(),
+        }, index=labels)
+        if baseline in rates.columns:
+            summary['与基准的排名相关'] = ranks.corr()[baseline].round(4)
+            summary[f'与基准前{top_n}名重合度'] = (in_top & in_top[[baseline]].to_numpy()).sum() / max(top_n, 1)
+        summary.index.name = '参数组合'
+
+        stability = pd.DataFrame({
+            '基准漏水率(%)': rates[baseline] if baseline in rates.columns else np.nan,
+            '最好名次': ranks.min(axis=1),
+            '中位名次': ranks.median(axis=1),
+            '最差名次': ranks.max(axis=1),
+            '名次标准差': ranks.std(axis=1).round(2),
+            f'进入前{top_n}名的组合比例': in_top.mean(axis=1).round(4),
+        })
+        stability = stability.sort_values(['中位名次', '最好名次'])
+
+        print(summary.sort_values('与基准的排名相关' if '与基准的排名相关' in summary else '平均漏水率(%)').head(10))
+
+        output_path = save_report('leakage_sweep.xlsx', {
+            '参数组合': summary.reset_index(),
+            '漏水率矩阵': rates.reset_index(),
+            '排名稳定性': stability.reset_index(),
+            '排名相关矩阵': ranks.corr().round(4).rename_axis('参数组合').reset_index(),
+        })
+        print(f"✓ 参数扫描结果已保存到: {output_path}")
+        return rates
+
+    def iter_daily_detail(self, block_size=500):
+        """按块生成每个用户的逐日用量明细（用户名, code, 日期, 用水量, 有效时段数）"""
+        grid = self.grid
+        slots_per_day = pd.Timedelta('1D') // grid.freq
+        n_slots = len(grid.slot_times)
+        n_days = -(-n_slots // slots_per_day)
+        days = grid.slot_times[::slots_per_day].date
+        codes = grid.meta['code'].to_numpy()
+
+        for start in range(0, len(grid.keys), block_size):
+            block = grid.values[start:start + block_size]
+            padded = np.pad(block, ((0, 0), (0, n_days * slots_per_day - n_slots)), constant_values=np.nan)
+            padded = padded.reshape(len(block), n_days, slots_per_day)
+            valid = np.sum(~np.isnan(padded), axis=2)
+            usage = np.where(valid > 0, np.nansum(padded, axis=2), np.nan)
+
+            keys = np.asarray(grid.keys[start:start + block_size])
+            yield pd.DataFrame({
+                '用户名': np.repeat(keys, n_days),
+                'code': np.repeat(codes[start:start + block_size], n_days),
+                '日期': np.tile(days, len(block)),
+                '用水量': usage.ravel().round(4),
+                '有效时段数': valid.ravel(),
+            })[valid.ravel() > 0]
+
     def save_leakage_results(self, leakage_rates):
-        """保存漏水率结果"""
+        """保存漏水率结果（有网格数据时附带逐日明细和数据质量表，流式写出）"""
         if leakage_rates is not None and len(leakage_rates) > 0:
-            output_path = get_report_path("leakage_rate.xlsx")
-            leakage_rates.to_excel(output_path, index=False)
+            sheets = {'漏水率排名': leakage_rates}
+            if self.grid is not None:
+                sheets['逐日用量明细'] = self.iter_daily_detail()
+                sheets['数据质量'] = self.grid.quality
+            output_path = save_report('leakage_rate.xlsx', sheets)
             print(f"✓ 漏水率结果已保存到: {output_path}")
 
-    def run_analysis(self):
-        """运行完整漏损分析"""
+    def run_analysis(self, plot=True):
+        """运行完整漏损分析（plot=False 为只计算的快速路径，不导入matplotlib）"""
         print("=" * 60)
         print("漏损分析开始")
         print("=" * 60)
@@ -206,14 +369,15 @@ class LeakageAnalyzer:
         self.prepare_data()
 
         # 2. 分析40404T水表
-        self.analyze_40404T()
+        self.analyze_40404T(plot=plot)
 
         # 3. 计算漏水率
         leakage_rates = self.calculate_leakage_rates()
 
         # 4. 可视化结果
         if leakage_rates is not None:
-            self.visualize_leakage_rates(leakage_rates)
+            if plot:
+                self.visualize_leakage_rates(leakage_rates)
 
             # 5. 保存结果
             self.save_leakage_results(leakage_rates)
@@ -7,13 +7,20 @@ import warnings
 warnings.filterwarnings('ignore')
 
 # 导入配置文件
-from .config import create_directories
+from .config import create_directories, get_data_path, DATA_CONFIG, ANALYSIS_CONFIG
 
 # 导入各个分析器
 from .data_loader import DataLoader
 from .relationship_analyzer import RelationshipAnalyzer
 from .leakage_analyzer import LeakageAnalyzer
 from .area_analyzer import AreaAnalyzer
+from .anomaly_analyzer import AnomalyAnalyzer
+from .quick_look import QuickLookAnalyzer
+from .night_flow_analyzer import NightFlowAnalyzer
+from .meter_archive import archive_sources
+from .replay import Replayer
+from .pipeline import Pipeline
+from .csv_reader import find_data_file
 
 
 def main_menu():
@@ -25,37 +32,143 @@ def main_menu():
     print("2. 关系模型分析")
     print("3. 漏损分析")
     print("4. 功能区分析")
-    print("5. 退出")
+    print("5. 异常检测")
+    print("6. 夜间最小流量分析")
+    print("7. 快速预览（抽样近似）")
+    print("8. 归档原始数据")
+    print("9. 回放历史数据（压测）")
+    print("10. 漏损参数扫描")
+    print("11. 退出")
     print("=" * 60)
 
 
+def _run_leakage(aux_data):
+    """漏损分析计算阶段：返回漏水率排名、40404T用量序列和规整网格（导出逐日明细与数据质量表）"""
+    analyzer = LeakageAnalyzer(DataLoader(aux_data=aux_data))
+    analyzer.prepare_data()
+    series_40404T = analyzer.analyze_40404T(plot=False)
+    return {'rates': analyzer.calculate_leakage_rates(), '40404T': series_40404T, 'grid': analyzer.grid}
+
+
+def _plot_leakage(leakage):
+    """漏损分析绘图阶段"""
+    analyzer = LeakageAnalyzer(DataLoader())
+    if leakage['40404T'] is not None:
+        analyzer.plot_40404T(leakage['40404T'])
+    if leakage['rates'] is not None:
+        analyzer.visualize_leakage_rates(leakage['rates'])
+
+
+def _export_leakage(leakage):
+    """漏损分析导出阶段：与单独运行漏损分析时导出相同的报告"""
+    analyzer = LeakageAnalyzer(DataLoader())
+    analyzer.grid = leakage['grid']
+    analyzer.save_leakage_results(leakage['rates'])
+
+
+def _run_anomaly(prepared_data, _area_figures=None):
+    """异常检测计算阶段：返回异常排名表
+
+    在功能区分析之后运行：其重建的基线画像是异常评分的回退基线。
+    """
+    analyzer = AnomalyAnalyzer(DataLoader(prepared_data=prepared_data))
+    analyzer.prepare_data()
+    analyzer.build_usage_matrix()
+    return analyzer.score_anomalies()
+
+
+def _anomaly_analyzer_with(anomalies):
+    analyzer = AnomalyAnalyzer(DataLoader())
+    analyzer.anomalies = anomalies
+    return analyzer
+
+
+def _check_errors(analyzer):
+    """分析器内部捕获并跳过的错误在流水线中视为阶段失败，避免写入完成检查点"""
+    if analyzer.errors:
+        raise RuntimeError(f"{type(analyzer).__name__} 有 {len(analyzer.errors)} 处出错，首个: {analyzer.errors[0]}")
+
+
+def _compute_stage(analyzer_class, **kwargs):
+    """计算阶段：推迟绘图运行整个分析，返回记录下的图表供绘图阶段绘制"""
+    def run(data):
+        analyzer = analyzer_class(DataLoader(prepared_data=data))
+        analyzer.defer_plots = True
+        analyzer.run_analysis(**kwargs)
+        _check_errors(analyzer)
+        return analyzer.figures
+    return run
+
+
+def _figure_stage(analyzer_class):
+    """绘图阶段：绘制计算阶段记录的图表"""
+    def run(figures):
+        analyzer = analyzer_class(DataLoader())
+        analyzer.draw_figures(figures)
+        _check_errors(analyzer)
+    return run
+
+
+def build_full_pipeline():
+    """把完整分析组织为按依赖关系调度的流水线
+
+    漏损分析只依赖 data2.csv，与关系模型、功能区、异常检测并行运行；
+    异常检测读取功能区分析写出的基线画像，排在功能区分析之后。
+    各分析的计算阶段不绘图、可以并行；绘图阶段共用 'pyplot' 资源，彼此串行。
+    分析器内部捕获的错误会使所在阶段失败，不会被记为已完成。
+    """
+    input_files = [find_data_file(get_data_path(DATA_CONFIG[key]))
+                   for key in ['hierarchy_file', 'main_data_file', 'aux_data_file']]
+    pipeline = Pipeline('full_analysis', input_files)
+
+    # 加载与预处理
+    pipeline.add('load_hierarchy', lambda: DataLoader().load_hierarchy_data())
+    pipeline.add('load_main', lambda: DataLoader().load_main_data())
+    pipeline.add('load_aux', lambda: DataLoader().load_aux_data())
+    pipeline.add('preprocess', lambda h: DataLoader().preprocess_hierarchy_data(h.copy()),
+                 deps=['load_hierarchy'])
+    pipeline.add('merge', lambda main, h: DataLoader().prepare_main_data(main, h),
+                 deps=['load_main', 'preprocess'])
+
+    # 各项分析
+    pipeline.add('relationship', _compute_stage(RelationshipAnalyzer), deps=['merge'])
+    pipeline.add('area', _compute_stage(AreaAnalyzer, save_mapping=False), deps=['merge'])
+    pipeline.add('leakage', _run_leakage, deps=['load_aux'])
+    pipeline.add('anomaly', _run_anomaly, deps=['merge', 'area'])
+    pipeline.add('night_flow', _compute_stage(NightFlowAnalyzer), deps=['merge'])
+
+    # 图表与导出
+    pipeline.add('relationship_figures', _figure_stage(RelationshipAnalyzer), deps=['relationship'],
+                 resources=['pyplot'])
+    pipeline.add('area_figures', _figure_stage(AreaAnalyzer), deps=['area'], resources=['pyplot'])
+    pipeline.add('night_flow_figures', _figure_stage(NightFlowAnalyzer), deps=['night_flow'],
+                 resources=['pyplot'])
+    pipeline.add('leakage_figures', _plot_leakage, deps=['leakage'], resources=['pyplot'])
+    pipeline.add('anomaly_figures', lambda a: _anomaly_analyzer_with(a).visualize_anomalies(),
+                 deps=['anomaly'], resources=['pyplot'])
+    pipeline.add('export_leakage', _export_leakage, deps=['leakage'])
+    pipeline.add('export_anomaly', lambda a: _anomaly_analyzer_with(a).save_anomaly_results(),
+                 deps=['anomaly'])
+    pipeline.add('export_area_mapping', lambda: AreaAnalyzer(DataLoader()).save_area_mapping())
+
+    return pipeline
+
+
 def run_full_analysis():
     """运行完整分析"""
     print("\n" + "=" * 60)
     print("开始完整分析")
     print("=" * 60)
 
-    # 创建数据加载器
-    data_loader = DataLoader()
-
-    # 1. 关系模型分析
-    print("\n>>> 第1部分：关系模型分析")
-    relation_analyzer = RelationshipAnalyzer(data_loader)
-    relation_analyzer.run_analysis()
-
-    # 2. 漏损分析
-    print("\n>>> 第2部分：漏损分析")
-    leakage_analyzer = LeakageAnalyzer(data_loader)
-    leakage_analyzer.run_analysis()
-
-    # 3. 功能区分析
-    print("\n>>> 第3部分：功能区分析")
-    area_analyzer = AreaAnalyzer(data_loader)
-    area_analyzer.run_analysis()
+    params = ANALYSIS_CONFIG['pipeline']
+    success = build_full_pipeline().run(max_workers=params['max_workers'], resume=params['resume'])
 
     print("\n" + "=" * 60)
-    print("完整分析完成！")
-    print(f"所有结果已保存到: outputs/ 目录")
+    if success:
+        print("完整分析完成！")
+        print(f"所有结果已保存到: outputs/ 目录")
+    else:
+        print("完整分析未完成，修复问题后重新运行将从中断处继续")
     print("=" * 60)
 
 
@@ -85,6 +198,20 @@ def run_leakage_analysis():
     print("\n漏损分析完成！")
 
 
+def run_leakage_sweep():
+    """运行漏水判定参数扫描"""
+    print("\n" + "=" * 60)
+    print("开始漏损参数扫描")
+    print("=" * 60)
+
+    data_loader = DataLoader()
+    analyzer = LeakageAnalyzer(data_loader)
+    analyzer.prepare_data()
+    analyzer.sweep_parameters()
+
+    print("\n漏损参数扫描完成！")
+
+
 def run_area_analysis():
     """运行功能区分析"""
     print("\n" + "=" * 60)
@@ -98,6 +225,77 @@ def run_area_analysis():
     print("\n功能区分析完成！")
 
 
+def run_anomaly_analysis():
+    """运行异常检测"""
+    print("\n" + "=" * 60)
+    print("开始异常检测")
+    print("=" * 60)
+
+    data_loader = DataLoader()
+    analyzer = AnomalyAnalyzer(data_loader)
+    analyzer.run_analysis()
+
+    print("\n异常检测完成！")
+
+
+def run_night_flow_analysis():
+    """运行夜间最小流量分析"""
+    print("\n" + "=" * 60)
+    print("开始夜间最小流量分析")
+    print("=" * 60)
+
+    data_loader = DataLoader()
+    analyzer = NightFlowAnalyzer(data_loader)
+    analyzer.run_analysis()
+
+    print("\n夜间最小流量分析完成！")
+
+
+def run_quick_look():
+    """运行快速预览（分层抽样近似）"""
+    print("\n" + "=" * 60)
+    print("开始快速预览")
+    print("=" * 60)
+
+    fraction = input("抽样比例 (0-1，直接回车使用默认值): ").strip()
+    data_loader = DataLoader()
+    analyzer = QuickLookAnalyzer(data_loader, sample_fraction=float(fraction) if fraction else None)
+    analyzer.run_analysis()
+
+    print("\n快速预览完成！")
+
+
+def run_archive():
+    """把原始CSV归档为压缩归档文件，之后的分析直接读取归档"""
+    print("\n" + "=" * 60)
+    print("开始归档原始数据")
+    print("=" * 60)
+
+    summary = archive_sources()
+    if not summary.empty:
+        print(summary.to_string(index=False))
+
+    print("\n归档完成！")
+
+
+def run_replay():
+    """回放历史数据：进程内空消费者测回放本身的吞吐，或在本地端口等待被测组件连接"""
+    print("\n" + "=" * 60)
+    print("开始回放历史数据")
+    print("=" * 60)
+
+    speedup = input("加速倍数 (0 表示不限速，直接回车使用默认值): ").strip()
+    copies = input("虚拟倍数 (直接回车使用默认值): ").strip()
+    mode = input("1. 进程内  2. 本地端口 (默认1): ").strip()
+    replayer = Replayer(speedup=float(speedup) if speedup else None, copies=int(copies) if copies else None)
+    if mode == '2':
+        replayer.serve()
+    else:
+        replayer.run(lambda batch: None)
+
+    print("\n回放完成！")
+
+
 def main():
     """主函数"""
     # 创建必要的目录
@@ -107,7 +305,7 @@ def main():
         main_menu()
 
         try:
-            choice = input("请选择分析类型 (1-5): ").strip()
+            choice = input("请选择分析类型 (1-11): ").strip()
 
             if choice == '1':
                 run_full_analysis()
@@ -118,13 +316,25 @@ def main():
             elif choice == '4':
                 run_area_analysis()
             elif choice == '5':
+                run_anomaly_analysis()
+            elif choice == '6':
+                run_night_flow_analysis()
+            elif choice == '7':
+                run_quick_look()
+            elif choice == '8':
+                run_archive()
+            elif choice == '9':
+                run_replay()
+            elif choice == '10':
+                run_leakage_sweep()
+            elif choice == '11':
                 print("感谢使用，再见！")
                 break
             else:
                 print("无效选择，请重新输入")
 
             # 询问是否继续
-            if choice != '5':
+            if choice != '11':
                 continue_choice = input("\n是否继续分析？(y/n): ").strip().lower()
                 if continue_choice != 'y':
                     print("感谢使用，再见！")
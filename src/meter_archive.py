@@ -0,0 +1,304 @@
+"""
+读数归档 - 把多年的原始读数按 水表 × 月 分块、列式压缩存储，读回时无需重新解析CSV
+"""
+
+import json
+import struct
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from .config import get_data_path, DATA_CONFIG
+from .constants import TIME_COLUMN, VALUE_COLUMN, SOURCE_COLUMN
+from .csv_reader import compression_of, find_data_file
+
+MAGIC = b'CFMA1\n'
+# 文件末尾：索引长度 (8字节) + MAGIC
+_FOOTER = struct.Struct('<Q')
+
+# 用量按定点整数存储时尝试的最大小数位数
+MAX_DECIMALS = 6
+
+
+def run_length_encode(values):
+    """游程编码，返回 (每段的值, 每段的长度)"""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return values, np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], values[1:] != values[:-1]]))
+    lengths = np.diff(np.concatenate([starts, [len(values)]]))
+    return values[starts], lengths
+
+
+def run_length_decode(run_values, lengths):
+    """游程解码"""
+    return np.repeat(run_values, lengths)
+
+
+def usage_decimals(values):
+    """用量能无损表示为定点整数的最少小数位数，无法表示时返回 None"""
+    finite = values[np.isfinite(values)]
+    for decimals in range(MAX_DECIMALS + 1):
+        scale = 10.0 ** decimals
+        scaled = np.round(finite * scale)
+        if np.abs(scaled).max(initial=0) < 2 ** 53 and np.array_equal(scaled / scale, finite):
+            return decimals
+    return None
+
+
+def _encode_block(times, values, decimals):
+    """编码一个块：采集时间取差分后游程编码；用量定点化后取差分，缺失位置单独游程编码
+
+    返回 (块元数据, 压缩后的字节)。
+    """
+    time_runs, time_lengths = run_length_encode(np.diff(times))
+    missing = np.isnan(values)
+    missing_values, missing_lengths = run_length_encode(missing)
+
+    if decimals is None:
+        usage = np.where(missing, 0.0, values)
+    else:
+        usage = np.diff(np.round(np.where(missing, 0.0, values) * 10.0 ** decimals).astype(np.int64), prepend=0)
+
+    payload = b''.join([
+        time_runs.astype(np.int64).tobytes(), time_lengths.astype(np.int64).tobytes(),
+        missing_lengths.astype(np.int64).tobytes(), usage.tobytes(),
+    ])
+    meta = {
+        'rows': len(times),
+        'start': int(times[0]),
+        'end': int(times[-1]),
+        'time_runs': len(time_runs),
+        'missing_runs': len(missing_lengths),
+        'missing_first': bool(missing_values[0]) if len(missing_values) else False,
+    }
+    return meta, zlib.compress(payload, DATA_CONFIG['archive']['compress_level'])
+
+
+def _decode_block(meta, payload, decimals):
+    """解码一个块，返回 (采集时间 int64 纳秒, 用量)"""
+    arrays = np.frombuffer(zlib.decompress(payload), dtype=np.int64)
+    n_runs, n_missing, rows = meta['time_runs'], meta['missing_runs'], meta['rows']
+    time_runs = arrays[:n_runs]
+    time_lengths = arrays[n_runs:2 * n_runs]
+    missing_lengths = arrays[2 * n_runs:2 * n_runs + n_missing]
+    usage = arrays[2 * n_runs + n_missing:]
+
+    times = np.empty(rows, dtype=np.int64)
+    times[0] = meta['start']
+    np.cumsum(run_length_decode(time_runs, time_lengths), out=times[1:])
+    times[1:] += meta['start']
+
+    if decimals is None:
+        values = usage.view(np.float64).copy()
+    else:
+        values = np.cumsum(usage) / 10.0 ** decimals
+    if n_missing > 1 or meta['missing_first']:
+        flags = (np.arange(n_missing) % 2 == 0) == meta['missing_first']
+        values[run_length_decode(flags, missing_lengths)] = np.nan
+    return times, values
+
+
+class MeterArchive:
+    """原始读数的长期归档文件
+
+    读数按 (水表, 月, 水表属性) 切成块，块内按采集时间排序：采集时间存差分的
+    游程编码（固定采集间隔时一个月只有几段），用量存定点整数的差分，缺失值
+    位置单独游程编码，整块再用 zlib 压缩。文件末尾是按水表和月份的块索引，
+    读取时只解压需要的块。读出的数据与 MeterStore 规范化后的数据一致。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+        self.last_read = None
+
+    @classmethod
+    def for_source(cls, source):
+        """某个数据源对应的归档文件（与CSV同名，后缀不同）"""
+        schema = DATA_CONFIG['sources'][source]
+        csv_path = get_data_path(DATA_CONFIG[schema['file']])
+        if compression_of(csv_path) is not None:
+            csv_path = csv_path.with_suffix('')
+        return cls(csv_path.with_suffix(DATA_CONFIG['archive']['suffix']))
+
+    @classmethod
+    def write(cls, path, data, source, source_bytes=None):
+        """把规范化后的读数写为归档文件"""
+        start_time = time.time()
+        key = DATA_CONFIG['sources'][source]['key']
+        attributes = [c for c in data.columns if c not in (key, TIME_COLUMN, VALUE_COLUMN, SOURCE_COLUMN)]
+        data = data.sort_values([key, TIME_COLUMN], kind='mergesort')
+
+        times = data[TIME_COLUMN].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        values = data[VALUE_COLUMN].to_numpy(dtype=float)
+        decimals = usage_decimals(values)
+
+        # 水表、月份或属性变化处切块
+        months = data[TIME_COLUMN].to_numpy(dtype='datetime64[M]').view(np.int64)
+        codes = [pd.factorize(data[c])[0] for c in [key] + attributes] + [months]
+        changed = np.zeros(len(data), dtype=bool)
+        changed[0:1] = True
+        for c in codes:
+            changed[1:] |= c[1:] != c[:-1]
+        starts = np.flatnonzero(changed)
+        stops = np.append(starts[1:], len(data))
+
+        labels = data[[key] + attributes].iloc[starts].astype(object)
+        labels = labels.where(labels.notnull(), None).to_numpy().tolist()
+        blocks = []
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            for (start, stop), label, month in zip(zip(starts, stops), labels, months[starts]):
+                meta, payload = _encode_block(times[start:stop], values[start:stop], decimals)
+                meta.update({
+                    'key': label[0],
+                    'attributes': label[1:],
+                    'month': str(np.datetime64(int(month), 'M')),
+                    'offset': f.tell(),
+                    'size': len(payload),
+                })
+                f.write(payload)
+                blocks.append(meta)
+
+            index = json.dumps({
+                'source': source,
+                'key': key,
+                'attributes': attributes,
+                'dtypes': {c: str(data[c].dtype) for c in [key] + attributes},
+                'decimals': decimals,
+                'rows': len(data),
+                'source_bytes': source_bytes,
+                'blocks': blocks,
+            }, ensure_ascii=False).encode('utf-8')
+            index = zlib.compress(index)
+            f.write(index)
+            f.write(_FOOTER.pack(len(index)) + MAGIC)
+
+        archive = cls(path)
+        print(f"✓ 已归档 {len(data)} 条读数到 {path.name}: {len(blocks)} 个块，"
+              f"压缩比 {archive.compression_ratio():.1f}，用时 {time.time() - start_time:.2f} 秒")
+        return archive
+
+    @property
+    def index(self):
+        """块索引（首次访问时从文件末尾读取）"""
+        if self._index is None:
+            with open(self.path, 'rb') as f:
+                f.seek(-(_FOOTER.size + len(MAGIC)), 2)
+                footer = f.read()
+                if footer[_FOOTER.size:] != MAGIC:
+                    raise ValueError(f"{self.path.name} 不是完整的读数归档文件")
+                length, = _FOOTER.unpack(footer[:_FOOTER.size])
+                f.seek(-(_FOOTER.size + len(MAGIC) + length), 2)
+                self._index = json.loads(zlib.decompress(f.read(length)).decode('utf-8'))
+        return self._index
+
+    def compression_ratio(self):
+        """原始CSV大小与归档文件大小之比"""
+        source_bytes = self.index['source_bytes']
+        return source_bytes / self.path.stat().st_size if source_bytes else float('nan')
+
+    def blocks(self, keys=None, start=None, end=None):
+        """按水表和月份筛选块"""
+        keys = None if keys is None else set(keys)
+        start = None if start is None else str(pd.Timestamp(start).to_period('M'))
+        end = None if end is None else str(pd.Timestamp(end).to_period('M'))
+        return [
+            block for block in self.index['blocks']
+            if (keys is None or block['key'] in keys)
+            and (start is None or block['month'] >= start)
+            and (end is None or block['month'] <= end)
+        ]
+
+    def read(self, keys=None, start=None, end=None):
+        """读取（部分）水表、月份的读数，返回按 (水表, 采集时间) 排序的规范化数据
+
+        块在文件中按写入时的 (水表, 采集时间) 顺序存放，按块顺序拼接即已排序。
+        """
+        return self.read_blocks(self.blocks(keys, start, end))
+
+    def read_blocks(self, blocks):
+        """解码指定的块（取自块索引，保持索引中的顺序时结果已排序）"""
+        start_time = time.time()
+        index = self.index
+
+        times, values = [], []
+        with open(self.path, 'rb') as f:
+            for block in blocks:
+                f.seek(block['offset'])
+                block_times, block_values = _decode_block(block, f.read(block['size']), index['decimals'])
+                times.append(block_times)
+                values.append(block_values)
+
+        rows = np.array([block['rows'] for block in blocks], dtype=np.int64)
+        columns = [index['key']] + index['attributes']
+        labels = np.empty((len(blocks), len(columns)), dtype=object)
+        for i, block in enumerate(blocks):
+            labels[i] = [block['key']] + block['attributes']
+        data = {}
+        for i, column in enumerate(columns):
+            series = pd.Series(np.repeat(labels[:, i], rows))
+            dtype = index['dtypes'][column]
+            data[column] = series.astype(dtype) if dtype != 'object' else series
+        data[TIME_COLUMN] = (np.concatenate(times) if times else np.zeros(0, dtype=np.int64)).view('datetime64[ns]')
+        data[VALUE_COLUMN] = np.concatenate(values) if values else np.zeros(0)
+        frame = pd.DataFrame(data)
+        frame[SOURCE_COLUMN] = pd.Categorical.from_codes(np.zeros(len(frame), dtype=np.int8), [index['source']])
+
+        seconds = max(time.time() - start_time, 1e-9)
+        source_mb = (index['source_bytes'] or 0) * len(frame) / max(index['rows'], 1) / 1024 ** 2
+        self.last_read = {
+            'rows': len(frame),
+            'blocks': len(blocks),
+            'seconds': seconds,
+            'rows_per_second': len(frame) / seconds,
+            'source_mb_per_second': source_mb / seconds,
+        }
+        return frame
+
+    def summary(self):
+        """归档的大小、压缩比和最近一次读取的解码吞吐量"""
+        stats = {
+            '文件': self.path.name,
+            '读数': self.index['rows'],
+            '块数': len(self.index['blocks']),
+            '原始大小(MB)': round((self.index['source_bytes'] or 0) / 1024 ** 2, 2),
+            '归档大小(MB)': round(self.path.stat().st_size / 1024 ** 2, 2),
+            '压缩比': round(self.compression_ratio(), 2),
+        }
+        if self.last_read is not None:
+            stats['解码读数/秒'] = round(self.last_read['rows_per_second'])
+            stats['解码吞吐(原始MB/秒)'] = round(self.last_read['source_mb_per_second'], 1)
+        return stats
+
+
+def archive_sources(store=None):
+    """把各数据源的CSV归档为压缩归档文件，并读回校验、报告解码吞吐量"""
+    from .meter_store import read_csv, MeterStore
+
+    summaries = []
+    for source, schema in DATA_CONFIG['sources'].items():
+        csv_path = find_data_file(get_data_path(DATA_CONFIG[schema['file']]))
+        if not csv_path.exists():
+            print(f"跳过 {source}: 找不到 {csv_path.name}")
+            continue
+
+        start_time = time.time()
+        data = MeterStore.normalize(read_csv(csv_path), source, schema)
+        parse_seconds = time.time() - start_time
+
+        archive = MeterArchive.write(MeterArchive.for_source(source).path, data, source, csv_path.stat().st_size)
+        restored = archive.read()
+        if len(restored) != len(data):
+            raise ValueError(f"{archive.path.name} 读回的行数与原始数据不一致")
+
+        summary = archive.summary()
+        summary['CSV解析用时(秒)'] = round(parse_seconds, 2)
+        summary['归档读取用时(秒)'] = round(archive.last_read['seconds'], 2)
+        summaries.append(summary)
+        print(f"  CSV解析 {parse_seconds:.2f} 秒，归档读取 {archive.last_read['seconds']:.2f} 秒"
+              f"（{summary['解码读数/秒']} 条/秒）")
+    return pd.DataFrame(summaries)
@@ -0,0 +1,201 @@
+"""
+夜间最小流量分析器 - 逐表逐夜计算夜间时段的最小和平均用量，找出夜间流量持续上升的水表
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+import warnings
+
+warnings.filterwarnings('ignore')
+from .config import ANALYSIS_CONFIG
+from .plotting import render_small_multiples, StagedPlotting
+from .report_writer import save_report
+
+
+def _slot_of(clock, freq):
+    """'HH:MM' 在一天中的时段序号"""
+    return pd.Timedelta(f'{clock}:00') // freq
+
+
+def night_windows(values, slot_times, start, end):
+    """把 水表 × 时段 矩阵切成 水表 × 夜 × 夜间时段 的三维数组（不复制重排之外的数据）
+
+    网格从0点开始。夜间窗口为 [start, end)，跨午夜时（如 23:00–04:00）
+    归属窗口开始的那一天。返回 (三维数组, 每夜开始日期)。
+    """
+    freq = slot_times.freq
+    slots_per_day = pd.Timedelta('1D') // freq
+    first = _slot_of(start, freq)
+    length = (_slot_of(end, freq) - first) % slots_per_day or slots_per_day
+
+    n_meters, n_slots = values.shape
+    n_nights = -(-(n_slots - first) // slots_per_day)
+    span = values[:, first:]
+    span = np.pad(span, ((0, 0), (0, n_nights * slots_per_day - span.shape[1])), constant_values=np.nan)
+    windows = span.reshape(n_meters, n_nights, slots_per_day)[:, :, :length]
+    nights = slot_times[first::slots_per_day][:n_nights].normalize()
+    return windows, nights
+
+
+def nanslope(y):
+    """按行计算 y 对序号的最小二乘斜率（忽略NaN）"""
+    mask = ~np.isnan(y)
+    x = np.broadcast_to(np.arange(y.shape[1], dtype=float), y.shape)
+    count = mask.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        x_mean = np.where(mask, x, 0).sum(axis=1) / count
+        y_mean = np.nansum(y, axis=1) / count
+        dx = np.where(mask, x - x_mean[:, None], 0)
+        dy = np.where(mask, y - y_mean[:, None], 0)
+        return (dx * dy).sum(axis=1) / (dx ** 2).sum(axis=1)
+
+
+class NightFlowAnalyzer(StagedPlotting):
+    """夜间最小流量分析器"""
+
+    def __init__(self, data_loader):
+        self.data_loader = data_loader
+        self.result = None
+        self.grid = None
+        self.params = ANALYSIS_CONFIG['night_flow']
+
+        self.nights = None
+        self.night_min = None
+        self.night_mean = None
+        self.ranking = None
+        self.figures = []
+        self.errors = []
+
+    def prepare_data(self):
+        """准备数据并规整到15分钟网格"""
+        self.result = self.data_loader.load_and_prepare_all_data()
+        self.grid = self.data_loader.regularize_usage(self.result, 'code', ['水表名'])
+        return self.result
+
+    def compute_night_flow(self):
+        """一次计算所有水表、所有夜晚的夜间最小用量和平均用量"""
+        print(f"\n计算夜间最小流量（{self.params['start']}–{self.params['end']}）...")
+
+        if self.grid is None:
+            print("请先准备数据")
+            return None
+
+        start_time = time.time()
+        windows, self.nights = night_windows(
+            self.grid.values, self.grid.slot_times, self.params['start'], self.params['end']
+        )
+
+        # 有效时段不足一半的夜晚不参与统计
+        valid = np.sum(~np.isnan(windows), axis=2)
+        enough = valid * 2 >= windows.shape[2]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.night_min = np.where(enough, np.nanmin(windows, axis=2), np.nan)
+            self.night_mean = np.where(enough, np.nanmean(windows, axis=2), np.nan)
+
+        n_meters, n_nights = self.night_min.shape
+        print(f"✓ {n_meters} 个水表 × {n_nights} 夜计算完成，用时 {time.time() - start_time:.2f} 秒")
+        return self.night_min
+
+    def rank_rising_meters(self):
+        """按近期与前期夜间最小用量之差排名，找出夜间流量上升的水表"""
+        if self.night_min is None:
+            print("请先计算夜间流量")
+            return None
+
+        days = self.params['trend_days']
+        recent = self.night_min[:, -days:]
+        previous = self.night_min[:, -2 * days:-days]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            recent_mean = np.nanmean(recent, axis=1)
+            previous_mean = np.nanmean(previous, axis=1)
+            overall_mean = np.nanmean(self.night_min, axis=1)
+
+        n_valid = np.sum(~np.isnan(self.night_min), axis=1)
+        ranking = pd.DataFrame({
+            'code': np.asarray(self.grid.keys),
+            '水表名': self.grid.meta['水表名'].to_numpy(),
+            '有效夜数': n_valid,
+            '平均夜间最小用量': overall_mean.round(4),
+            '前期夜间最小用量': previous_mean.round(4),
+            '近期夜间最小用量': recent_mean.round(4),
+            '变化量': (recent_mean - previous_mean).round(4),
+            '趋势斜率(每夜)': nanslope(self.night_min).round(5),
+        })
+        ranking['变化率'] = (ranking['变化量'] / ranking['前期夜间最小用量'].where(ranking['前期夜间最小用量'] > 0)).round(4)
+
+        ranking = ranking[(n_valid >= self.params['min_nights']) & (ranking['变化量'] > 0)]
+        self.ranking = ranking.sort_values('变化量', ascending=False).reset_index(drop=True)
+
+        print(f"✓ 夜间流量上升的水表: {len(self.ranking)} 个")
+        print(self.ranking.head(10)[['code', '水表名', '前期夜间最小用量', '近期夜间最小用量', '变化量']])
+        return self.ranking
+
+    def iter_nightly_detail(self, block_size=500):
+        """按块生成逐表逐夜明细"""
+        codes = np.asarray(self.grid.keys)
+        names = self.grid.meta['水表名'].to_numpy()
+        dates = self.nights.date
+        for start in range(0, len(codes), block_size):
+            night_min = self.night_min[start:start + block_size]
+            night_mean = self.night_mean[start:start + block_size]
+            n = len(night_min)
+            yield pd.DataFrame({
+                'code': np.repeat(codes[start:start + n], len(dates)),
+                '水表名': np.repeat(names[start:start + n], len(dates)),
+                '日期': np.tile(dates, n),
+                '夜间最小用量': night_min.ravel().round(4),
+                '夜间平均用量': night_mean.ravel().round(4),
+            })
+
+    def visualize_trends(self):
+        """绘制夜间流量上升水表的逐夜趋势"""
+        if self.ranking is None or len(self.ranking) == 0:
+            print("没有夜间流量上升的水表")
+            return
+
+        top = self.ranking.head(self.params['top_n'])
+        rows = [self.grid.key_index[code] for code in top['code']]
+        cube = np.stack([self.night_min[rows], self.night_mean[rows]], axis=1)
+        names = [f'{code} {name}' for code, name in zip(top['code'], top['水表名'])]
+        self.figure('plot_trends', cube, names, self.nights)
+
+    def plot_trends(self, cube, names, nights):
+        """分页绘制 (水表, [夜间最小用量, 夜间平均用量], 夜) 的逐夜曲线"""
+        paths = render_small_multiples(
+            cube, names, ['夜间最小用量', '夜间平均用量'], nights,
+            f"夜间流量上升水表（{self.params['start']}–{self.params['end']}）", '夜间流量趋势.pdf',
+            xlabel='日期'
+        )
+        print(f"✓ 已保存: {', '.join(p.name for p in paths)}")
+
+    def save_results(self):
+        """保存排名和逐夜明细"""
+        if self.night_min is None:
+            return
+        output_path = save_report('night_flow.xlsx', {
+            '夜间流量上升排名': self.ranking if self.ranking is not None else pd.DataFrame(),
+            '逐夜明细': self.iter_nightly_detail(),
+        })
+        print(f"✓ 夜间流量结果已保存到: {output_path}")
+
+    def run_analysis(self, plot=True):
+        """运行夜间最小流量分析"""
+        print("=" * 60)
+        print("夜间最小流量分析开始")
+        print("=" * 60)
+
+        self.prepare_data()
+        if self.compute_night_flow() is not None:
+            self.rank_rising_meters()
+            if plot:
+                self.visualize_trends()
+            self.save_results()
+
+        print("=" * 60)
+        print("夜间最小流量分析完成")
+        print("=" * 60)
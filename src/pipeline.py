@@ -0,0 +1,164 @@
+"""
+分析流水线 - 按依赖关系并行调度各阶段，并为每个阶段保存检查点
+"""
+
+import hashlib
+import json
+import pickle
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .config import get_cache_path
+
+
+class Stage:
+    """流水线阶段
+
+    func 以各依赖阶段的输出为位置参数；resources 中的资源同一时刻只允许
+    一个阶段占用（如 'pyplot'，matplotlib的全局状态不是线程安全的）。
+    """
+
+    def __init__(self, name, func, deps=(), resources=(), checkpoint=True):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.resources = set(resources)
+        self.checkpoint = checkpoint
+
+
+class Pipeline:
+    """依赖感知的并行调度器
+
+    无依赖关系的阶段在线程池中并发执行。每个阶段完成后输出写入检查点，
+    运行中断后再次运行会跳过已完成的阶段；全部成功后清除检查点。
+    输入文件（大小、修改时间）变化时已有检查点作废。
+    """
+
+    def __init__(self, name, input_files=()):
+        self.name = name
+        self.stages = {}
+        self.checkpoint_dir = get_cache_path(f'pipeline_{name}')
+        self.fingerprint = self._fingerprint(input_files)
+
+    @staticmethod
+    def _fingerprint(input_files):
+        digest = hashlib.sha1()
+        for path in input_files:
+            stat = path.stat() if path.exists() else None
+            digest.update(f'{path}:{stat.st_size if stat else -1}:{stat.st_mtime_ns if stat else -1}'.encode())
+        return digest.hexdigest()
+
+    def add(self, name, func, deps=(), resources=(), checkpoint=True):
+        """添加阶段"""
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"阶段 {name} 依赖的 {dep} 尚未定义")
+        self.stages[name] = Stage(name, func, deps, resources, checkpoint)
+        return self
+
+    def _manifest_path(self):
+        return self.checkpoint_dir / 'manifest.json'
+
+    def _load_completed(self):
+        """读取与当前输入一致的已完成阶段"""
+        path = self._manifest_path()
+        if not path.exists():
+            return set()
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('fingerprint') != self.fingerprint:
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+            return set()
+        return set(manifest['completed']) & set(self.stages)
+
+    def _save_completed(self, completed):
+        with open(self._manifest_path(), 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': self.fingerprint, 'completed': sorted(completed)}, f,
+                      ensure_ascii=False, indent=2)
+
+    def _output_path(self, name):
+        return self.checkpoint_dir / f'{name}.pkl'
+
+    def _load_output(self, name, outputs):
+        """按需读取已完成阶段的检查点输出"""
+        if name not in outputs:
+            with open(self._output_path(name), 'rb') as f:
+                outputs[name] = pickle.load(f)
+        return outputs[name]
+
+    def _needed_outputs(self, pending):
+        """待运行阶段需要的依赖输出"""
+        return {dep for name in pending for dep in self.stages[name].deps}
+
+    def run(self, max_workers=4, resume=True):
+        """运行流水线，全部成功返回True"""
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        completed = self._load_completed() if resume else set()
+
+        # 不保存检查点的阶段若被待运行阶段依赖，需要重新运行
+        pending = [name for name in self.stages if name not in completed]
+        while True:
+            rerun = {dep for dep in self._needed_outputs(pending)
+                     if dep in completed and not self.stages[dep].checkpoint}
+            if not rerun:
+                break
+            completed -= rerun
+            pending = [name for name in self.stages if name not in completed]
+
+        if completed:
+            print(f"从检查点继续，跳过已完成阶段: {', '.join(sorted(completed))}")
+
+        outputs = {}
+        running = {}
+        busy_resources = set()
+        failed = None
+        start_time = time.time()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                # 提交所有依赖已完成且资源空闲的阶段
+                if failed is None:
+                    for name in list(pending):
+                        stage = self.stages[name]
+                        if all(dep in completed for dep in stage.deps) and not (stage.resources & busy_resources):
+                            args = [self._load_output(dep, outputs) for dep in stage.deps]
+                            print(f"\n>>> 开始阶段: {name}")
+                            running[executor.submit(self._run_stage, stage, args)] = name
+                            busy_resources |= stage.resources
+                            pending.remove(name)
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    busy_resources -= self.stages[name].resources
+                    try:
+                        outputs[name], elapsed = future.result()
+                    except Exception as e:
+                        print(f"✗ 阶段 {name} 失败: {e}")
+                        failed = name
+                        continue
+
+                    completed.add(name)
+                    self._save_completed(completed)
+                    print(f"✓ 阶段 {name} 完成，用时 {elapsed:.1f} 秒")
+
+        if failed is not None:
+            print(f"流水线在阶段 {failed} 中断，重新运行将从检查点继续")
+            return False
+
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        print(f"✓ 流水线 {self.name} 全部完成，用时 {time.time() - start_time:.1f} 秒")
+        return True
+
+    def _run_stage(self, stage, args):
+        """执行单个阶段并写入检查点"""
+        start_time = time.time()
+        output = stage.func(*args)
+        if stage.checkpoint:
+            with open(self._output_path(stage.name), 'wb') as f:
+                pickle.dump(output, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return output, time.time() - start_time
@@ -0,0 +1,128 @@
+"""
+绘图工具 - 按需加载matplotlib，以及批量小图（small multiples）分页渲染
+
+matplotlib只在真正绘图时才导入，纯计算的分析流程不承担其导入、
+字体缓存和后端初始化的开销。
+"""
+
+import numpy as np
+
+from .config import get_figure_path, VISUALIZATION_CONFIG
+
+_pyplot = None
+
+
+def get_pyplot():
+    """导入并返回pyplot，首次调用时设置中文字体"""
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib.pyplot as plt
+
+        plt.rcParams['font.sans-serif'] = [VISUALIZATION_CONFIG['font_family']]
+        plt.rcParams['axes.unicode_minus'] = False
+        _pyplot = plt
+    return _pyplot
+
+
+class StagedPlotting:
+    """计算与绘图可以分成两个阶段运行的分析器
+
+    defer_plots 为True时，figure() 只记录绘图方法名和绘图所需的数据，之后由
+    draw_figures() 统一绘制：流水线中计算阶段不占用 'pyplot'，可与其他分析并行，
+    只有绘图阶段串行。分析中捕获并跳过的错误经 error() 记录在 errors 中，
+    调用方据此判断分析是否完整完成。使用者需在 __init__ 中初始化
+    self.figures 和 self.errors 为空列表。
+    """
+
+    defer_plots = False
+
+    def figure(self, method, *args):
+        """调用绘图方法；推迟绘图时只记录 (方法名, 参数)"""
+        if self.defer_plots:
+            self.figures.append((method, args))
+        else:
+            getattr(self, method)(*args)
+
+    def draw_figures(self, figures):
+        """绘制计算阶段记录的图表"""
+        for method, args in figures:
+            getattr(self, method)(*args)
+
+    def error(self, message):
+        """打印并记录被跳过的错误"""
+        print(message)
+        self.errors.append(message)
+
+
+def render_small_multiples(cube, names, series_labels, x_values, title, filename,
+                           xlabel='小时', ylabel='用水量'):
+    """把多个水表的曲线分页排成小图网格
+
+    cube 为预先聚合好的 (对象数, 曲线数, 横轴点数) 数组。每页只创建一次
+    共享坐标轴的图形，翻页时仅替换线条数据，因此渲染成本与页数而不是
+    水表数成正比。format 为 'pdf' 时输出多页PDF，为 'png' 时每页一张图。
+
+    返回生成的文件路径列表。
+    """
+    plt = get_pyplot()
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    params = VISUALIZATION_CONFIG['small_multiples']
+    rows, cols = params['rows'], params['cols']
+    per_page = rows * cols
+    n_items = len(names)
+    n_pages = -(-n_items // per_page)
+    if n_pages == 0:
+        return []
+
+    fig, axes = plt.subplots(rows, cols, figsize=params['page_size'],
+                             sharex=True, sharey=True, squeeze=False)
+    axes = axes.ravel()
+    lines = [ax.plot(x_values, np.zeros((len(x_values), len(series_labels))), linewidth=1) for ax in axes]
+    for ax in axes:
+        ax.grid(True, alpha=0.3)
+    for ax in axes[-cols:]:
+        ax.set_xlabel(xlabel)
+    for ax in axes[::cols]:
+        ax.set_ylabel(ylabel)
+    fig.legend(lines[0], series_labels, loc='upper right', ncol=len(series_labels))
+
+    stem = filename.rsplit('.', 1)[0]
+    paths = []
+    pdf = None
+    if params['format'] == 'pdf':
+        paths.append(get_figure_path(f'{stem}.pdf'))
+        pdf = PdfPages(paths[0])
+
+    try:
+        for page in range(n_pages):
+            chunk = cube[page * per_page:(page + 1) * per_page]
+
+            for k, ax in enumerate(axes):
+                if k < len(chunk):
+                    ax.set_visible(True)
+                    for line, series in zip(lines[k], chunk[k]):
+                        line.set_ydata(series)
+                    ax.set_title(str(names[page * per_page + k]), fontsize=9)
+                else:
+                    ax.set_visible(False)
+
+            # 同一页共享纵轴范围
+            low, high = np.nanmin(chunk), np.nanmax(chunk)
+            low = min(low, 0) if np.isfinite(low) else 0
+            high = high if np.isfinite(high) and high > low else low + 1
+            axes[0].set_ylim(low, high * 1.05)
+            fig.suptitle(f'{title}（第{page + 1}/{n_pages}页）', fontsize=14)
+
+            if pdf is not None:
+                pdf.savefig(fig, dpi=params['dpi'])
+            else:
+                path = get_figure_path(f'{stem}_第{page + 1}页.png')
+                fig.savefig(path, dpi=params['dpi'])
+                paths.append(path)
+    finally:
+        if pdf is not None:
+            pdf.close()
+        plt.close(fig)
+
+    return paths
@@ -0,0 +1,404 @@
+"""
+快速预览 - 对“水表-日”分层抽样，近似计算功能区用水曲线和漏水率排名并给出置信区间
+"""
+
+import time
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+import warnings
+
+warnings.filterwarnings('ignore')
+from .config import (
+    get_figure_path,
+    DATA_CONFIG, VISUALIZATION_CONFIG, ANALYSIS_CONFIG
+)
+from .academic_calendar import get_calendar
+from .constants import SLOTS_PER_DAY
+from .data_regularizer import reading_masks
+from .leakage_analyzer import leakage_window_counts
+from .plotting import get_pyplot
+from .report_writer import save_report
+
+
+def stratified_sample(strata, fraction, min_per_stratum=2, random_state=None):
+    """分层简单随机抽样
+
+    strata 为每个总体单元的层编号（0..H-1）。每层抽取 ceil(N_h × fraction) 个单元，
+    且不少于 min_per_stratum（不超过 N_h）。返回 (抽中单元位置, 各层总体数, 各层样本数)。
+    """
+    rng = np.random.default_rng(random_state)
+    population = np.bincount(strata)
+    take = np.minimum(population, np.maximum(min_per_stratum, np.ceil(population * fraction).astype(np.int64)))
+
+    # 层内随机排序后取前 take 个
+    order = np.lexsort((rng.random(len(strata)), strata))
+    starts = np.cumsum(population) - population
+    rank = np.arange(len(strata)) - starts[strata[order]]
+    return np.sort(order[rank < take[strata[order]]]), population, take
+
+
+def stratified_totals(values, strata, population):
+    """各层总量的无偏估计及其方差
+
+    values 为抽中单元的观测矩阵 (n, k)，strata 为其层编号。
+    层总量 = N_h·ȳ_h，方差 = N_h²·(1 - n_h/N_h)·s_h²/n_h；各层独立，可直接相加。
+    """
+    frame = pd.DataFrame(values).groupby(strata)
+    n_strata = len(population)
+    mean = frame.mean().reindex(range(n_strata)).fillna(0).to_numpy()
+    var = frame.var(ddof=1).reindex(range(n_strata)).fillna(0).to_numpy()
+    taken = np.bincount(strata, minlength=n_strata)[:, None]
+
+    N = population[:, None].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = np.where(taken > 0, N ** 2 * (1 - taken / N) * var / taken, 0.0)
+    return N * mean, variance
+
+
+class QuickLookAnalyzer:
+    """快速预览分析器
+
+    以“水表-日”为抽样单元、（分组, 月份）为层抽样，只在样本上聚合，
+    把层内均值按总体单元数放大为总量估计；输出均为近似值，附带置信区间。
+    先从归档块索引或分组索引列出单元并抽样，只读取抽中单元的读数。
+    sample_fraction 越小越快，区间越宽。
+    """
+
+    def __init__(self, data_loader, sample_fraction=None):
+        self.data_loader = data_loader
+        self.params = dict(ANALYSIS_CONFIG['quick_look'])
+        if sample_fraction is not None:
+            self.params['sample_fraction'] = sample_fraction
+        self.z = NormalDist().inv_cdf(0.5 + self.params['confidence'] / 2)
+
+        self.place2area = {
+            place.strip(): area
+            for area, places in DATA_CONFIG['area_mapping'].items()
+            for place in places
+        }
+        self.sampling_summary = []
+        self.area_curves = {}
+        self.leakage_rates = None
+
+    @property
+    def label(self):
+        """标注在输出上的近似说明"""
+        return (f"近似：抽样比例 {self.params['sample_fraction']:.0%}，"
+                f"{self.params['confidence']:.0%}置信区间")
+
+    def _meter_days(self, source):
+        """列出数据源全部的 (水表, 日) 单元及水表属性，不扫描读数
+
+        有归档时按块索引中每块的首末读数时间展开，否则按分组索引中每个水表的
+        首末读数展开；首末读数之间的每一天都是一个单元（没有读数的日子用量为0，
+        不影响总量估计）。返回 (单元表, 数据源总读数行数)。
+        """
+        key = DATA_CONFIG['sources'][source]['key']
+        store = self.data_loader.store
+        archive = store.archive(source)
+        if archive is not None:
+            index = archive.index
+            columns = [key] + index['attributes']
+            spans = pd.DataFrame(
+                [[block['key']] + block['attributes'] + [block['start'], block['end']] for block in index['blocks']],
+                columns=columns + ['first', 'last'],
+            )
+            for column in columns:
+                if index['dtypes'][column] != 'object':
+                    spans[column] = spans[column].astype(index['dtypes'][column])
+            total_rows = index['rows']
+        else:
+            frame = store.frame(source)
+            ranges = store.indexes[source].ranges[key]
+            starts = np.array([start for start, _ in ranges.values()], dtype=np.int64)
+            stops = np.array([stop for _, stop in ranges.values()], dtype=np.int64)
+            times = frame['采集时间'].to_numpy().view(np.int64)
+            spans = frame.iloc[starts].drop(columns=['采集时间', '用量', '来源']).reset_index(drop=True)
+            spans['first'] = times[starts]
+            spans['last'] = times[stops - 1]
+            total_rows = len(frame)
+
+        # 首末读数之间的每一天
+        day = pd.Timedelta('1D').value
+        first_day = spans['first'].to_numpy() // day
+        n_days = spans['last'].to_numpy() // day - first_day + 1
+        units = spans.drop(columns=['first', 'last']).loc[spans.index.repeat(n_days)].reset_index(drop=True)
+        offset = np.arange(n_days.sum()) - np.repeat(np.cumsum(n_days) - n_days, n_days)
+        units['day'] = ((np.repeat(first_day, n_days) + offset) * day).view('datetime64[ns]')
+        units = units.drop_duplicates([key, 'day']).reset_index(drop=True)
+        units['month'] = units['day'].dt.month
+        return units, total_rows
+
+    def _sample_units(self, units, layers):
+        """按 layers 分层抽样，返回抽中的单元（附 stratum 列）和各层总体数"""
+        strata, _ = pd.factorize(pd.MultiIndex.from_frame(units[layers]))
+        sampled, population, _ = stratified_sample(
+            strata, self.params['sample_fraction'],
+            self.params['min_per_stratum'], self.params['random_state']
+        )
+        sample = units.iloc[sampled].reset_index(drop=True)
+        sample['stratum'] = strata[sampled]
+        return sample, population
+
+    def _load_units(self, source, sample, lead=pd.Timedelta(0)):
+        """只读取抽中单元当天（及之前 lead 时长）的读数
+
+        有归档时只解码抽中单元所在的 (水表, 月) 块；否则在共享读数存储中按
+        分组索引找到每个水表的行范围，再按时间二分定位，只取出这些行。
+        """
+        key = DATA_CONFIG['sources'][source]['key']
+        store = self.data_loader.store
+        archive = store.archive(source)
+        first = sample['day'] - lead
+        stop = sample['day'] + pd.Timedelta('1D')
+        if archive is not None:
+            months = set(zip(sample[key], first.dt.strftime('%Y-%m'))) | set(zip(sample[key], sample['day'].dt.strftime('%Y-%m')))
+            return archive.read_blocks([
+                block for block in archive.index['blocks'] if (block['key'], block['month']) in months
+            ])
+
+        frame = store.frame(source)
+        ranges = store.indexes[source].ranges[key]
+        times = frame['采集时间'].to_numpy()
+        lows, highs = [], []
+        for value, group in sample.groupby(key, sort=False, observed=True):
+            start, end = ranges[value]
+            lows.append(start + np.searchsorted(times[start:end], first[group.index].to_numpy()))
+            highs.append(start + np.searchsorted(times[start:end], stop[group.index].to_numpy()))
+        lows, highs = np.concatenate(lows), np.concatenate(highs)
+        lengths = highs - lows
+        rows = np.repeat(lows - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return frame.take(np.unique(rows)).reset_index(drop=True)
+
+    def _summarize(self, name, key_column, units, sample, population, rows, total_rows):
+        """记录并打印抽样规模"""
+        self.sampling_summary.append({
+            '数据': name,
+            '抽样单元': f'{key_column}-日',
+            '层数': len(population),
+            '总体单元数': len(units),
+            '样本单元数': len(sample),
+            '样本读数行数': rows,
+            '总读数行数': total_rows,
+        })
+        print(f"✓ {name}: 从 {len(population)} 层 {len(units)} 个{key_column}-日中抽取 {len(sample)} 个，"
+              f"只读取 {rows} 条读数（{rows / max(total_rows, 1):.1%}）")
+
+    @staticmethod
+    def _locate(sample, key_column, keys, days):
+        """每条读数所属的样本序号（不属于任何样本为 -1）"""
+        units = pd.MultiIndex.from_arrays([sample[key_column].to_numpy(), sample['day'].to_numpy()])
+        return units.get_indexer(pd.MultiIndex.from_arrays([keys, days]))
+
+    def estimate_area_curves(self):
+        """估计各功能区按季度、教学活动的小时用水量曲线"""
+        print("\n估计功能区小时用水量曲线（抽样近似）...")
+
+        # 有层级编码且映射到功能区的水表
+        units, total_rows = self._meter_days('main')
+        hierarchy = self.data_loader.preprocess_hierarchy_data(self.data_loader.load_hierarchy_data())
+        units = units[units['水表号'].isin(hierarchy.loc[hierarchy['code'].notnull(), '水表号'])]
+        units = units.assign(area=units['水表名'].map(self.place2area))
+        units = units[units['area'].notnull()].reset_index(drop=True)
+        if units.empty:
+            print("没有映射到功能区的数据")
+            return None
+        units['教学活动'] = get_calendar().label(units['day'])
+        units['season'] = units['day'].dt.quarter
+
+        sample, population = self._sample_units(units, ['area', '教学活动', 'month'])
+        data = self._load_units('main', sample)
+        data = data[data['水表名'].map(self.place2area).notnull()]
+        self._summarize('data.csv', '水表号', units, sample, population, len(data), total_rows)
+
+        # 每个样本单元的24小时用量
+        times = data['采集时间']
+        pos = self._locate(sample, '水表号', data['水表号'].to_numpy(), times.dt.normalize().to_numpy())
+        hit = pos >= 0
+        hourly = np.zeros((len(sample), 24))
+        usage = np.nan_to_num(data['用量'].to_numpy(dtype=float))
+        np.add.at(hourly, (pos[hit], times.dt.hour.to_numpy()[hit]), usage[hit])
+
+        sample_strata = sample['stratum'].to_numpy()
+        totals, variances = stratified_totals(hourly, sample_strata, population)
+
+        # 每层的功能区、季度、教学活动（层按月份和教学活动划分，取层内任一样本即可）
+        stratum_info = sample.groupby('stratum')[['area', 'season', '教学活动']].first()
+        stratum_info = stratum_info.reindex(range(len(population))).reset_index(drop=True)
+
+        for column, label in [('season', '季度'), ('教学活动', '教学活动')]:
+            keys = [stratum_info['area'], stratum_info[column]]
+            total = pd.DataFrame(totals).groupby(keys).sum().stack()
+            se = np.sqrt(pd.DataFrame(variances).groupby(keys).sum().stack())
+            curve = pd.DataFrame({
+                '估计用水量': total,
+                '下限': (total - self.z * se).clip(lower=0),
+                '上限': total + self.z * se,
+                '标准误': se,
+            })
+            curve.index.names = ['功能区', label, '小时']
+            curve['相对误差'] = (self.z * se / total.where(total > 0)).round(4)
+            self.area_curves[label] = curve.reset_index()
+
+        return self.area_curves
+
+    def estimate_leakage_rates(self):
+        """估计各用户的漏水率（比率估计，按天抽样）
+
+        每个样本日单独从0点开始划分3小时窗口，窗口与完整网格一致；
+        第一个时段的差分取前一天最后一个时段的读数，与全量计算相同。
+        重复读数、负用量和计数器重置按完整网格的规整规则处理（见 data_regularizer.py），
+        判断计数器重置的正常用量取自读取到的样本读数。
+        """
+        print("\n估计漏水率排名（抽样近似）...")
+
+        units, total_rows = self._meter_days('aux')
+        units = units[units['code'].notnull()].reset_index(drop=True)
+        sample, population = self._sample_units(units, ['用户名', 'month'])
+
+        freq = pd.Timedelta('15min')
+        data = self._load_units('aux', sample, lead=freq)
+        data = data[data['code'].notnull()]
+        self._summarize('data2.csv', '用户名', units, sample, population, len(data), total_rows)
+
+        # 按完整网格的规则标记参与求和的读数
+        times = data['采集时间']
+        floored = times.dt.floor(freq)
+        usage = data['用量'].to_numpy(dtype=float)
+        meters, meter_keys = pd.factorize(data['用户名'])
+        slot = ((floored - floored.min()) // freq).to_numpy() if len(data) else np.zeros(0, dtype=np.int64)
+        keep, _, _ = reading_masks(meters.astype(np.int64) * (slot.max(initial=0) + 1) + slot,
+                                   times.to_numpy(), usage, meters, len(meter_keys))
+
+        # 样本日 × (前一天最后一个时段 + 96 个时段) 的用量矩阵；
+        # 每天最后一个时段的读数同时是下一天样本的“前一个时段”
+        users = data['用户名'].to_numpy()
+        day = floored.dt.normalize()
+        column = ((floored - day) // freq).to_numpy() + 1
+        own = self._locate(sample, '用户名', users, day.to_numpy())
+        carried = column == SLOTS_PER_DAY
+        following = self._locate(sample, '用户名', users[carried], (day[carried] + pd.Timedelta('1D')).to_numpy())
+
+        pos = np.concatenate([own, following])
+        column = np.concatenate([column, np.zeros(len(following), dtype=column.dtype)])
+        usage = np.concatenate([usage, usage[carried]])
+        take = np.concatenate([keep, keep[carried]]) & (pos >= 0)
+        sums = np.zeros((len(sample), SLOTS_PER_DAY + 1))
+        counts = np.zeros((len(sample), SLOTS_PER_DAY + 1), dtype=np.int32)
+        np.add.at(sums, (pos[take], column[take]), usage[take])
+        np.add.at(counts, (pos[take], column[take]), 1)
+        sums[counts == 0] = np.nan
+
+        leak_slots, n_valid = leakage_window_counts(sums[:, 1:], previous=sums[:, 0])
+        users = sample['用户名'].to_numpy()
+        sample_strata = sample['stratum'].to_numpy()
+        stratum_user = pd.Series(users).groupby(sample_strata).first().reindex(range(len(population)))
+
+        # 比率 = 漏水时段总量 / 有效时段总量，方差用线性化残差 e = a - p·m 估计
+        counts = np.column_stack([leak_slots, n_valid]).astype(float)
+        totals, _ = stratified_totals(counts, sample_strata, population)
+        by_user = pd.DataFrame(totals, columns=['leak', 'valid']).groupby(stratum_user.to_numpy()).sum()
+        ratio = by_user['leak'] / by_user['valid'].where(by_user['valid'] > 1)
+
+        residual = leak_slots - ratio.reindex(users).to_numpy() * n_valid
+        _, residual_var = stratified_totals(np.nan_to_num(residual)[:, None], sample_strata, population)
+        se = np.sqrt(pd.Series(residual_var[:, 0]).groupby(stratum_user.to_numpy()).sum()) / by_user['valid']
+
+        res = pd.DataFrame({
+            'code': ratio.index,
+            'rate': (ratio * 100).round(2).to_numpy(),
+            '下限': ((ratio - self.z * se) * 100).round(2).to_numpy(),
+            '上限': ((ratio + self.z * se) * 100).round(2).to_numpy(),
+        }).dropna(subset=['rate'])
+        self.leakage_rates = res.sort_values('rate', ascending=False).reset_index(drop=True)
+        return self.leakage_rates
+
+    def visualize_area_curves(self):
+        """绘制带置信区间的功能区小时用水曲线"""
+        plt = get_pyplot()
+        for label, curve in self.area_curves.items():
+            areas = sorted(curve['功能区'].unique())
+            fig, axes = plt.subplots(len(areas), 1, figsize=(12, 4 * len(areas)), squeeze=False)
+            for ax, area in zip(axes[:, 0], areas):
+                for series, group in curve[curve['功能区'] == area].groupby(label):
+                    line, = ax.plot(group['小时'], group['估计用水量'], label=str(series))
+                    ax.fill_between(group['小时'], group['下限'], group['上限'],
+                                    color=line.get_color(), alpha=0.2)
+                ax.set_title(f'{area}功能区用水量的变化趋势图（按{label}，{self.label}）')
+                ax.set_xlabel('小时')
+                ax.set_ylabel('用水量')
+                ax.legend()
+                ax.grid(True, alpha=0.3)
+
+            filename = f'快速预览_功能区{label}用水趋势.png'
+            plt.tight_layout()
+            plt.savefig(get_figure_path(filename), dpi=VISUALIZATION_CONFIG['dpi'])
+            plt.close()
+            print(f"✓ 已保存: {filename}")
+
+    def visualize_leakage_rates(self, top_n=15):
+        """绘制带置信区间的漏水率排名"""
+        if self.leakage_rates is None or len(self.leakage_rates) == 0:
+            print("没有漏水率数据可可视化")
+            return
+
+        top_data = self.leakage_rates.head(top_n)
+        error = [top_data['rate'] - top_data['下限'], top_data['上限'] - top_data['rate']]
+
+        plt = get_pyplot()
+        fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
+        ax.barh(range(len(top_data)), top_data['rate'], xerr=error, capsize=3)
+        ax.set_yticks(range(len(top_data)))
+        ax.set_yticklabels(top_data['code'])
+        ax.invert_yaxis()
+        ax.set_xlabel('漏水率 (%)')
+        ax.set_title(f'漏水率排名前{len(top_data)}（{self.label}）')
+        ax.grid(True, alpha=0.3, axis='x')
+
+        plt.tight_layout()
+        plt.savefig(get_figure_path('快速预览_漏水率排名.png'), dpi=VISUALIZATION_CONFIG['dpi'])
+        plt.close()
+        print("✓ 已保存: 快速预览_漏水率排名.png")
+
+    def save_results(self, elapsed):
+        """保存近似结果，第一张表记录抽样说明"""
+        summary = pd.DataFrame(self.sampling_summary)
+        summary['抽样比例'] = self.params['sample_fraction']
+        summary['置信水平'] = self.params['confidence']
+        summary['用时(秒)'] = round(elapsed, 2)
+        summary['说明'] = '结果为分层抽样近似值，并非全量计算'
+
+        sheets = {'抽样说明': summary}
+        for label, curve in self.area_curves.items():
+            sheets[f'功能区{label}曲线(近似)'] = curve
+        if self.leakage_rates is not None:
+            sheets['漏水率排名(近似)'] = self.leakage_rates
+        output_path = save_report('quick_look.xlsx', sheets)
+        print(f"✓ 快速预览结果已保存到: {output_path}")
+
+    def run_analysis(self, plot=True):
+        """运行快速预览"""
+        print("=" * 60)
+        print(f"快速预览开始（{self.label}）")
+        print("=" * 60)
+
+        start_time = time.time()
+        self.estimate_area_curves()
+        self.estimate_leakage_rates()
+        elapsed = time.time() - start_time
+        print(f"\n✓ 近似计算用时 {elapsed:.1f} 秒")
+
+        if plot:
+            self.visualize_area_curves()
+            self.visualize_leakage_rates()
+        self.save_results(elapsed)
+
+        if self.leakage_rates is not None:
+            print("\n漏水率排名前10（近似）:")
+            print(self.leakage_rates.head(10))
+
+        print("=" * 60)
+        print("快速预览完成（结果为近似值）")
+        print("=" * 60)
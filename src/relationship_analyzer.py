@@ -2,39 +2,51 @@
 关系模型分析器 - 从"关系模型的构建及误差分析.py"重构
 """
 
+import time
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 import warnings
 
 warnings.filterwarnings('ignore')
 from .config import (
-    get_figure_path, get_report_path,
+    get_figure_path,
     ANALYSIS_CONFIG, VISUALIZATION_CONFIG,
     DATA_CONFIG
 )
+from .plotting import get_pyplot, StagedPlotting
+from .water_balance import MeterTree, water_balance
+from .relationship_discovery import (
+    aggregate_slots, remove_periodic_profile, standardize_rows, correlated_candidates, greedy_sum_fit
+)
+from .report_writer import ReportWriter
 
 
-class RelationshipAnalyzer:
+class RelationshipAnalyzer(StagedPlotting):
     """关系模型分析器"""
 
     def __init__(self, data_loader):
         self.data_loader = data_loader
         self.result = None
-
-        # 设置中文字体
-        plt.rcParams['font.sans-serif'] = [VISUALIZATION_CONFIG['font_family']]
-        plt.rcParams['axes.unicode_minus'] = False
+        self.groups = None
+        self.grid = None
+        self.rollup = None
+        self.tree = None
+        self.balance = None
+        self.discovered = None
+        self.figures = []
+        self.errors = []
 
     def prepare_data(self):
         """准备数据"""
         self.result = self.data_loader.load_and_prepare_all_data()
+        self.groups = self.data_loader.group_index
 
-        # 添加6小时时间片
-        self.result['6hour'] = pd.cut(
-            x=self.result['hours'],
-            bins=[-1, 6, 12, 18, 24],
-            labels=[1, 2, 3, 4]
-        ).astype(int) + (self.result['采集时间'].dt.dayofyear - 1) * 4
+        # 按水表编码规整到统一的15分钟网格
+        self.grid = self.data_loader.regularize_usage(self.result, 'code', ['name', '水表名', 'code_3'])
+
+        # 6小时、1天粒度由 水表 × 日 × 小时 用量汇总得到，只合并新增的读数
+        self.rollup = self.data_loader.load_usage_rollup(self.result)
 
         return self.result
 
@@ -45,27 +57,35 @@ class RelationshipAnalyzer:
             return
 
         print("开始分析不同时间粒度的用水关系...")
+        hourly = self.rollup.table(self.rollup.attribute('name'))
+
+        # 添加6小时时间片
+        hourly['6hour'] = pd.cut(
+            x=hourly['hours'],
+            bins=[-1, 6, 12, 18, 24],
+            labels=[1, 2, 3, 4]
+        ).astype(int) + (hourly['dayofyear'] - 1) * 4
 
         # 1. 15分钟粒度
         try:
-            tmp_15min = self.result.groupby(['name', '采集时间']).agg({'用量': 'sum'}).unstack()
-            self.plot_time_granularity(tmp_15min, '15分钟', '水表关系模型图_15分钟.png')
+            tmp_15min = pd.concat({'用量': self.grid.sum_by('name')}, axis=1)
+            self.figure('plot_time_granularity', tmp_15min, '15分钟', '水表关系模型图_15分钟.png')
         except Exception as e:
-            print(f"15分钟粒度分析出错: {e}")
+            self.error(f"15分钟粒度分析出错: {e}")
 
         # 2. 6小时粒度
         try:
-            tmp_6hour = self.result.groupby(['name', '6hour']).agg({'用量': 'sum'}).unstack()
-            self.plot_time_granularity(tmp_6hour, '6小时', '水表关系模型图_6小时.png')
+            tmp_6hour = hourly.groupby(['name', '6hour']).agg({'用量': 'sum'}).unstack()
+            self.figure('plot_time_granularity', tmp_6hour, '6小时', '水表关系模型图_6小时.png')
         except Exception as e:
-            print(f"6小时粒度分析出错: {e}")
+            self.error(f"6小时粒度分析出错: {e}")
 
         # 3. 1天粒度
         try:
-            tmp_1day = self.result.groupby(['name', 'date']).agg({'用量': 'sum'}).unstack()
-            self.plot_time_granularity(tmp_1day, '1天', '水表关系模型图_1天.png')
+            tmp_1day = hourly.groupby(['name', 'date']).agg({'用量': 'sum'}).unstack()
+            self.figure('plot_time_granularity', tmp_1day, '1天', '水表关系模型图_1天.png')
         except Exception as e:
-            print(f"1天粒度分析出错: {e}")
+            self.error(f"1天粒度分析出错: {e}")
 
     def plot_time_granularity(self, data, title_suffix, filename):
         """绘制特定时间粒度的图表"""
@@ -73,7 +93,7 @@ class RelationshipAnalyzer:
             print(f"{title_suffix}粒度: 数据不足")
             return
 
-        available_names = data.columns.get_level_values(1).unique()
+        available_names = data.index.unique()
         selected_names = []
 
         # 选择一级和二级水表
@@ -82,6 +102,7 @@ class RelationshipAnalyzer:
                 selected_names.append(level)
 
         if len(selected_names) >= 2:
+            plt = get_pyplot()
             fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
 
             try:
@@ -100,7 +121,7 @@ class RelationshipAnalyzer:
                 print(f"✓ 已保存: {filename}")
 
             except Exception as e:
-                print(f"绘制{title_suffix}图表失败: {e}")
+                self.error(f"绘制{title_suffix}图表失败: {e}")
                 plt.close()
         else:
             print(f"{title_suffix}粒度: 一级或二级水表数据不足")
@@ -109,16 +130,13 @@ class RelationshipAnalyzer:
         """按水表编码前缀分析"""
         print("\n开始按编码前缀分析...")
 
-        # 创建编码前缀列
-        self.result['code_3'] = self.result['code'].astype(str).str[:3]
-
         for code_prefix in ANALYSIS_CONFIG['target_codes']:
             print(f"分析编码前缀: {code_prefix}")
 
-            result_code = self.result[self.result['code_3'] == code_prefix].copy()
+            rows = self.grid.rows_where('code_3', [code_prefix])
 
-            if len(result_code) > 0:
-                available_names = result_code['name'].unique()
+            if len(rows) > 0:
+                available_names = self.grid.meta['name'].iloc[rows].unique()
                 selected_names = []
 
                 for level in ['一级表计编码', '二级表计编码']:
@@ -127,42 +145,36 @@ class RelationshipAnalyzer:
 
                 if len(selected_names) >= 2:
                     try:
-                        tmp = result_code.groupby(['name', '采集时间']).agg({'用量': 'sum'}).unstack()
-                        cumulative_data = tmp.T.loc['用量', selected_names].fillna(0).cumsum()
-
-                        fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
-                        cumulative_data.plot.line(
-                            ax=ax,
-                            title=f'水表关系模型图(15分钟)—{code_prefix}',
-                            ylabel='累计用水量',
-                            alpha=0.7
-                        )
-                        ax.legend(selected_names)
-                        ax.grid(True, alpha=0.3)
-
-                        plt.tight_layout()
-                        plt.savefig(
-                            get_figure_path(f'累计用水量关系_{code_prefix}.png'),
-                            dpi=VISUALIZATION_CONFIG['dpi']
-                        )
-                        plt.close()
-                        print(f"✓ 已保存: 累计用水量关系_{code_prefix}.png")
+                        tmp = self.grid.sum_by('name', rows)
+                        cumulative_data = tmp.T[selected_names].fillna(0).cumsum()
+                        self.figure('plot_cumulative_usage', cumulative_data, selected_names,
+                                    f'水表关系模型图(15分钟)—{code_prefix}', f'累计用水量关系_{code_prefix}.png')
 
                     except Exception as e:
-                        print(f"分析{code_prefix}失败: {e}")
+                        self.error(f"分析{code_prefix}失败: {e}")
                 else:
                     print(f"编码前缀{code_prefix}的一级或二级水表数据不足")
             else:
                 print(f"编码前缀{code_prefix}没有数据")
 
+    def plot_cumulative_usage(self, cumulative, selected_names, title, filename):
+        """绘制一级、二级水表的累计用水量曲线"""
+        plt = get_pyplot()
+        fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
+        cumulative.plot.line(ax=ax, title=title, ylabel='累计用水量', alpha=0.7)
+        ax.legend(selected_names)
+        ax.grid(True, alpha=0.3)
+
+        plt.tight_layout()
+        plt.savefig(get_figure_path(filename), dpi=VISUALIZATION_CONFIG['dpi'])
+        plt.close()
+        print(f"✓ 已保存: {filename}")
+
     def analyze_405_meters(self):
         """分析405水表"""
         print("\n开始分析405水表...")
 
-        if 'code_3' not in self.result.columns:
-            self.result['code_3'] = self.result['code'].astype(str).str[:3]
-
-        result_405 = self.result[self.result['code_3'] == '405'].copy()
+        result_405 = self.groups.get('code_3', '405')
 
         if len(result_405) == 0:
             print("没有找到405水表数据")
@@ -172,12 +184,15 @@ class RelationshipAnalyzer:
         if '水表名' in result_405.columns:
             # 删除排除的建筑
             exclude_buildings = ANALYSIS_CONFIG['exclude_buildings']
-            result_405_filtered = result_405[~result_405['水表名'].isin(exclude_buildings)].copy()
+            meta = self.grid.meta
+            rows_405 = np.flatnonzero(
+                ((meta['code_3'] == '405') & ~meta['水表名'].isin(exclude_buildings)).to_numpy()
+            )
 
             # 绘制累计用水量关系
             try:
-                tmp_405 = result_405_filtered.groupby(['name', '采集时间']).agg({'用量': 'sum'}).unstack()
-                available_names = tmp_405.columns.get_level_values(1).unique()
+                tmp_405 = self.grid.sum_by('name', rows_405)
+                available_names = tmp_405.index.unique()
                 selected_names = []
 
                 for level in ['一级表计编码', '二级表计编码']:
@@ -185,25 +200,12 @@ class RelationshipAnalyzer:
                         selected_names.append(level)
 
                 if len(selected_names) >= 2:
-                    cumulative_405 = tmp_405.T.loc['用量', selected_names].fillna(0).cumsum()
-
-                    fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
-                    cumulative_405.plot.line(
-                        ax=ax,
-                        title='405水表一级和二级水表关系模型图(15分钟)',
-                        ylabel='累计用水量',
-                        alpha=0.7
-                    )
-                    ax.legend(selected_names)
-                    ax.grid(True, alpha=0.3)
-
-                    plt.tight_layout()
-                    plt.savefig(get_figure_path('405水表分析.png'), dpi=VISUALIZATION_CONFIG['dpi'])
-                    plt.close()
-                    print("✓ 已保存: 405水表分析.png")
+                    cumulative_405 = tmp_405.T[selected_names].fillna(0).cumsum()
+                    self.figure('plot_cumulative_usage', cumulative_405, selected_names,
+                                '405水表一级和二级水表关系模型图(15分钟)', '405水表分析.png')
 
             except Exception as e:
-                print(f"分析405水表失败: {e}")
+                self.error(f"分析405水表失败: {e}")
         else:
             print("结果中没有'水表名'列")
 
@@ -213,14 +215,11 @@ class RelationshipAnalyzer:
 
         # 排除特定建筑
         exclude_buildings = ANALYSIS_CONFIG['exclude_buildings']
-        result_filtered = self.result[~self.result['水表名'].isin(exclude_buildings)].copy()
 
         for code_prefix in ANALYSIS_CONFIG['target_codes']:
-            if 'code_3' not in result_filtered.columns:
-                result_filtered['code_3'] = result_filtered['code'].astype(str).str[:3]
-
-            if code_prefix in result_filtered['code_3'].unique():
-                result_error = result_filtered[result_filtered['code_3'] == code_prefix].copy()
+            if code_prefix in self.groups.keys('code_3'):
+                result_error = self.groups.get('code_3', code_prefix)
+                result_error = result_error[~result_error['水表名'].isin(exclude_buildings)]
 
                 if len(result_error) > 0:
                     try:
@@ -240,10 +239,215 @@ class RelationshipAnalyzer:
                         else:
                             print(f"{code_prefix} 缺少一级或二级水表数据")
                     except Exception as e:
-                        print(f"计算{code_prefix}误差失败: {e}")
+                        self.error(f"计算{code_prefix}误差失败: {e}")
                 else:
                     print(f"{code_prefix} 没有数据")
 
+    def analyze_water_balance(self):
+        """全层级水量平衡：每个有子表的节点计算 父表 - 子表之和，按未解释损失排名"""
+        print("\n开始全层级水量平衡分析...")
+
+        if self.grid is None:
+            print("请先准备数据")
+            return None
+
+        meta = self.grid.meta
+        codes = meta.index.astype(str)
+        self.tree = MeterTree(codes)
+        usage = pd.DataFrame(self.grid.values, index=codes, columns=self.grid.slot_times)
+
+        # 一次稀疏矩阵乘法得到所有节点、所有时段的差值
+        imbalance, values = water_balance(self.tree, usage)
+        valid = ~np.isnan(imbalance)
+        parent_total = np.where(valid, values, 0).sum(axis=1)
+        loss = np.nansum(imbalance, axis=1)
+
+        n_children = np.array([len(self.tree.children[code]) for code in self.tree.codes])
+        info = meta.set_axis(codes).reindex(self.tree.codes)
+        balance = pd.DataFrame({
+            'code': self.tree.codes,
+            '水表名': info['水表名'].to_numpy(),
+            '层级': info['name'].to_numpy(),
+            '子表数': n_children,
+            '子树水表数': self.tree.tout - self.tree.tin,
+            '有效时段数': valid.sum(axis=1),
+            '父表用量': parent_total,
+            '子表用量合计': parent_total - loss,
+            '未解释损失': loss,
+            '子树累计损失': self.tree.subtree_sums(np.where(n_children > 0, loss, 0)),
+        })
+        balance['损失率'] = (balance['未解释损失'] / balance['父表用量'].where(balance['父表用量'] > 0)).round(4)
+        balance = balance[balance['子表数'] > 0].sort_values('未解释损失', ascending=False)
+        self.balance = balance.reset_index(drop=True)
+
+        print(f"✓ {len(self.tree)} 个水表、{len(self.balance)} 个父节点 × {imbalance.shape[1]} 个时段的差值计算完成")
+        print(self.balance.head(10)[['code', '水表名', '层级', '子表数', '未解释损失', '损失率']])
+
+        # 损失最大节点的逐日差值
+        top_n = ANALYSIS_CONFIG['water_balance']['top_n']
+        top = self.balance['code'].head(top_n)
+        daily = pd.DataFrame(
+            imbalance[[self.tree.position(code) for code in top]],
+            index=top, columns=self.grid.slot_times
+        ).T.resample('D').sum(min_count=1)
+        daily.index.name = '日期'
+
+        with ReportWriter('water_balance.xlsx') as writer:
+            writer.write_sheet('节点损失排名', self.balance)
+            writer.write_sheet('逐日差值', daily, index=True)
+        output_path = writer.paths[0]
+        print(f"✓ 水量平衡结果已保存到: {output_path}")
+
+        self.figure('plot_water_balance', self.balance.head(top_n))
+        return self.balance
+
+    def plot_water_balance(self, top_balance):
+        """绘制未解释损失最大的节点"""
+        if len(top_balance) == 0:
+            print("没有可绘制的父节点")
+            return
+
+        labels = [f"{code} {name}" if isinstance(name, str) else code
+                  for code, name in zip(top_balance['code'], top_balance['水表名'])]
+
+        plt = get_pyplot()
+        fig, ax = plt.subplots(figsize=VISUALIZATION_CONFIG['figure_size'])
+        ax.barh(range(len(top_balance)), top_balance['未解释损失'])
+        ax.set_yticks(range(len(top_balance)))
+        ax.set_yticklabels(labels)
+        ax.invert_yaxis()
+        for i, rate in enumerate(top_balance['损失率']):
+            if pd.notnull(rate):
+                ax.text(top_balance['未解释损失'].iloc[i], i, f' {rate:.1%}', va='center')
+        ax.set_xlabel('未解释损失（父表 - 子表之和）')
+        ax.set_title(f'全层级水量平衡：未解释损失排名前{len(top_balance)}')
+        ax.grid(True, alpha=0.3, axis='x')
+
+        plt.tight_layout()
+        plt.savefig(get_figure_path('水量平衡_损失排名.png'), dpi=VISUALIZATION_CONFIG['dpi'])
+        plt.close()
+        print("✓ 已保存: 水量平衡_损失排名.png")
+
+    def discover_relationships(self):
+        """从用量序列推断父子关系（父表 ≈ 子表之和），并与水表层级表比对
+
+        按小时合并网格、减去各表 星期几×小时 的平均曲线后分块计算相关矩阵，为每个
+        水表保留总用量不超过它、相关系数最高的若干候选子表，再在候选中逐步选出
+        和最接近它的子表集合。
+        拟合优度达到阈值的作为推断关系；同一子表被多个父表选中时归属总用量
+        最小的父表（直接上级）。
+        """
+        print("\n开始从用量推断水表父子关系...")
+
+        if self.grid is None:
+            print("请先准备数据")
+            return None
+
+        params = ANALYSIS_CONFIG['relationship_discovery']
+        start_time = time.time()
+
+        # 按小时合并，覆盖率不足的水表不参与
+        factor = max(pd.Timedelta(params['freq']) // self.grid.freq, 1)
+        values = aggregate_slots(self.grid.values, factor)
+        usable = np.flatnonzero(np.mean(~np.isnan(values), axis=1) >= params['min_coverage'])
+        all_codes = self.grid.meta.index.astype(str)
+        codes = np.asarray(all_codes[usable])
+        names = self.grid.meta['水表名'].to_numpy()[usable]
+        totals = np.nanmean(values[usable], axis=1) * values.shape[1]
+
+        # 去掉各表的周内平均曲线（缺失的小时即取平均值），只比较各自的波动
+        slot_times = self.grid.slot_times[::factor][:values.shape[1]]
+        x = remove_periodic_profile(values[usable], np.asarray(slot_times.dayofweek * 24 + slot_times.hour))
+        centered = ((x - x.mean(axis=1, keepdims=True)) ** 2).sum(axis=1)
+
+        candidates, correlations, compared = correlated_candidates(
+            standardize_rows(x), totals, params['max_candidates'], params['min_corr'],
+            params['total_tolerance'], params['block_size']
+        )
+
+        # 每个水表作为父表，在候选中选出和最接近它的子表集合
+        fits, links = [], []
+        for i, pool in enumerate(candidates):
+            if len(pool) == 0 or centered[i] == 0:
+                continue
+            selected, rss = greedy_sum_fit(x[i], x[pool])
+            if not selected:
+                continue
+            r2 = 1 - rss / centered[i]
+            fits.append((i, len(selected), r2, totals[pool[selected]].sum() / totals[i]))
+            if r2 >= params['min_r2']:
+                links.extend((i, pool[s], correlations[i][s], r2) for s in selected)
+
+        links = pd.DataFrame(links, columns=['parent', 'child', '相关系数', '父表拟合R2']).astype(
+            {'parent': int, 'child': int, '相关系数': float, '父表拟合R2': float})
+        links = links.iloc[np.argsort(totals[links['parent'].to_numpy()], kind='stable')]
+        links = links.drop_duplicates('child').sort_values(['parent', 'child'])
+        parent, child = links['parent'].to_numpy(), links['child'].to_numpy()
+
+        # 层级表的关系及其在同一小时网格上的拟合优度
+        tree = MeterTree(all_codes)
+        imbalance, _ = water_balance(tree, pd.DataFrame(x, index=codes))
+        rows = imbalance[[tree.position(code) for code in codes]]
+        tree_children = np.array([len(tree.children[code]) for code in codes])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            tree_r2 = np.where(tree_children > 0, 1 - (rows ** 2).sum(axis=1) / centered, np.nan)
+        tree_parent = np.array([tree.parent[code] for code in codes], dtype=object)
+
+        self.discovered = pd.DataFrame({
+            '父表code': codes[parent],
+            '父表水表名': names[parent],
+            '子表code': codes[child],
+            '子表水表名': names[child],
+            '相关系数': links['相关系数'].round(4).to_numpy(),
+            '父表拟合R2': links['父表拟合R2'].round(4).to_numpy(),
+            '层级表父表': tree_parent[child],
+        })
+        self.discovered['与层级表一致'] = self.discovered['层级表父表'] == self.discovered['父表code']
+
+        fit_table = pd.DataFrame(fits, columns=['i', '推断子表数', '推断R2', '子表合计/父表']).set_index('i')
+        fit_table = fit_table.reindex(range(len(codes)))
+        fit_table.insert(0, 'code', codes)
+        fit_table.insert(1, '水表名', names)
+        fit_table['层级表子表数'] = tree_children
+        fit_table['层级表R2'] = tree_r2
+        fit_table = fit_table[fit_table['推断子表数'].notnull() | (tree_children > 0)].round(4)
+
+        # 与层级表不符：推断出层级表没有的关系，以及用量不支持的层级表关系
+        position = {code: i for i, code in enumerate(codes)}
+        inferred = set(zip(parent, child))
+        unsupported = [
+            (position[tree_parent[c]], c) for c in range(len(codes))
+            if tree_parent[c] in position and tree_r2[position[tree_parent[c]]] < params['min_r2']
+            and (position[tree_parent[c]], c) not in inferred
+        ]
+        mismatched = self.discovered[~self.discovered['与层级表一致']]
+        disagreements = pd.concat([
+            mismatched.assign(类型=np.where(mismatched['层级表父表'].isnull(), '层级表中无父表', '父表与层级表不同')),
+            pd.DataFrame({
+                '类型': '层级表关系未得到用量支持',
+                '父表code': codes[[p for p, _ in unsupported]],
+                '父表水表名': names[[p for p, _ in unsupported]],
+                '子表code': codes[[c for _, c in unsupported]],
+                '子表水表名': names[[c for _, c in unsupported]],
+                '层级表父表': codes[[p for p, _ in unsupported]],
+                '层级表R2': tree_r2[[p for p, _ in unsupported]].round(4),
+            }),
+        ], ignore_index=True)
+        disagreements = disagreements[['类型', '父表code', '父表水表名', '子表code', '子表水表名', '层级表父表', '相关系数', '父表拟合R2', '层级表R2']]
+
+        n = len(codes)
+        print(f"✓ {n} 个水表，比较 {compared} 对（全部两两比较为 {n * (n - 1)} 对），"
+              f"用时 {time.time() - start_time:.2f} 秒")
+        print(f"✓ 推断关系 {len(self.discovered)} 条，其中与层级表一致 {int(self.discovered['与层级表一致'].sum())} 条；"
+              f"与层级表不符 {len(disagreements)} 处")
+
+        with ReportWriter('relationship_discovery.xlsx') as writer:
+            writer.write_sheet('推断关系', self.discovered)
+            writer.write_sheet('父表拟合', fit_table)
+            writer.write_sheet('与层级表不符', disagreements)
+        print(f"✓ 关系推断结果已保存到: {writer.paths[0]}")
+        return self.discovered
+
     def run_analysis(self):
         """运行完整分析流程"""
         print("=" * 60)
@@ -265,6 +469,12 @@ class RelationshipAnalyzer:
         # 5. 误差分析
         self.error_analysis()
 
+        # 6. 全层级水量平衡
+        self.analyze_water_balance()
+
+        # 7. 从用量推断父子关系并与层级表比对
+        self.discover_relationships()
+
         print("=" * 60)
         print("关系模型分析完成")
         print("=" * 60)
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+关系发现 - 从用量序列推断父子水表关系：分块相关筛选候选子表，再检验父表是否等于候选子表之和
+"""
+
+import numpy as np
+
+
+def aggregate_slots(values, factor, min_valid=0.5):
+    """把 水表 × 时段 矩阵按每 factor 个时段合并
+
+    合并后的值为有效时段的均值乘以 factor（缺失时段按同一小时内的均值估计），
+    有效时段比例低于 min_valid 时为缺失。
+    """
+    n, t = values.shape
+    t = t // factor * factor
+    blocks = values[:, :t].reshape(n, -1, factor)
+    valid = (~np.isnan(blocks)).sum(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        merged = np.nansum(blocks, axis=2) / valid * factor
+    return np.where(valid >= min_valid * factor, merged, np.nan)
+
+
+def remove_periodic_profile(x, groups):
+    """减去每个水表在各周期分组（如 星期几×小时）上的平均用量，缺失值记为0
+
+    父表 = 子表之和 在减去各自的平均曲线后仍然成立，而所有水表共有的昼夜
+    规律被去掉，相关系数和拟合优度只反映各表自身的波动。
+    """
+    n_groups = groups.max() + 1
+    valid = ~np.isnan(x)
+    sums = np.zeros((len(x), n_groups))
+    counts = np.zeros((len(x), n_groups))
+    for g in range(n_groups):
+        columns = groups == g
+        sums[:, g] = np.where(valid[:, columns], x[:, columns], 0).sum(axis=1)
+        counts[:, g] = valid[:, columns].sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        profile = sums / counts
+    return np.where(valid, x - profile[:, groups], 0.0)
+
+
+def standardize_rows(x):
+    """按行中心化并归一化为单位长度，两行的内积即相关系数；常数行为0"""
+    centered = x - x.mean(axis=1, keepdims=True)
+    norms = np.sqrt((centered ** 2).sum(axis=1, keepdims=True))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(norms > 0, centered / norms, 0.0)
+
+
+def correlated_candidates(z, totals, max_candidates, min_corr, tolerance=0.05, block_size=512):
+    """为每个水表找候选子表：总用量不超过它 (1+tolerance) 倍、相关系数最高的至多 max_candidates 个
+
+    水表按总用量升序排列后，水表 i 的候选只可能在 [0, limit_i) 中，分块计算
+    相关矩阵时每块父表只与前缀部分的水表做矩阵乘法，内存为 block_size × n。
+    返回 (按父表的候选序号列表, 对应的相关系数列表, 参与比较的水表对数)。
+    """
+    n = len(totals)
+    order = np.argsort(totals, kind='stable')
+    sorted_totals = totals[order]
+    limits = np.searchsorted(sorted_totals, sorted_totals * (1 + tolerance), side='right')
+    zs = z[order]
+
+    candidates = [np.zeros(0, dtype=np.int64)] * n
+    correlations = [np.zeros(0)] * n
+    compared = 0
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        width = limits[start:stop].max()
+        corr = zs[start:stop] @ zs[:width].T
+        compared += int((limits[start:stop] - 1).sum())
+
+        # 总用量超出上限的和自身不作为候选
+        columns = np.arange(width)
+        parents = np.arange(start, stop)
+        allowed = (columns[None, :] < limits[start:stop, None]) & (columns[None, :] != parents[:, None])
+        corr = np.where(allowed & (corr >= min_corr), corr, -np.inf)
+
+        k = min(max_candidates, width)
+        if k == 0:
+            continue
+        top = np.argpartition(-corr, k - 1, axis=1)[:, :k]
+        top_corr = np.take_along_axis(corr, top, axis=1)
+        for row, (idx, values) in enumerate(zip(top, top_corr)):
+            keep = np.isfinite(values)
+            rank = np.argsort(-values[keep])
+            candidates[order[start + row]] = order[idx[keep][rank]]
+            correlations[order[start + row]] = values[keep][rank]
+    return candidates, correlations, compared
+
+
+def greedy_sum_fit(target, pool):
+    """从候选池中前向逐步选出子集，使 target 与子集之和（系数均为1）的残差平方和最小
+
+    每一步加入使残差下降最多的候选，不再下降时停止；已选子表的子表不会被
+    重复选入（会使和偏大）。返回 (选中的池内序号, 残差平方和)。
+    """
+    gram = pool @ pool.T
+    cross = pool @ target
+    rss = float(target @ target)
+    selected = []
+    accumulated = np.zeros(len(pool))
+    available = np.ones(len(pool), dtype=bool)
+    while available.any():
+        # 加入候选 c 后残差平方和的变化：-2<r, c> + <c, c>，其中 r = target - 已选之和
+        change = -2 * (cross - accumulated) + np.diag(gram)
+        change = np.where(available, change, np.inf)
+        best = int(np.argmin(change))
+        if change[best] >= 0:
+            break
+        selected.append(best)
+        available[best] = False
+        accumulated += gram[best]
+        rss += change[best]
+    return selected, max(rss, 0.0)
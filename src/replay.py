@@ -0,0 +1,251 @@
+"""
+读数回放 - 把历史导出按采集时间顺序、按设定的加速倍数重新发出，作为实时组件压测的流量
+"""
+
+import csv
+import json
+import queue
+import socket
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .config import DATA_CONFIG, OUTPUT_CONFIG
+from .constants import TIME_COLUMN, VALUE_COLUMN, SOURCE_COLUMN
+from .meter_store import shared_store
+
+METER_COLUMN = '水表'
+DUE_COLUMN = 'due'
+
+# 队列中表示回放结束的标记
+_END = None
+
+
+class LagStats:
+    """端到端延迟统计：每条读数从计划发出时刻到被消费者处理完的时间"""
+
+    def __init__(self):
+        self.lags = []
+        self.single = []
+        self.events = 0
+        self.first = None
+        self.last = None
+
+    def _done(self, done):
+        done = time.time() if done is None else done
+        self.first = done if self.first is None else self.first
+        self.last = done
+        return done
+
+    def record(self, due, done=None):
+        """记录一批读数的计划发出时刻（time.time() 秒）"""
+        done = self._done(done)
+        due = np.asarray(due, dtype=float)
+        self.lags.append(done - due)
+        self.events += len(due)
+
+    def record_one(self, due, done=None):
+        """记录单条读数（逐条消费时避免为每条建数组）"""
+        self.single.append(self._done(done) - due)
+        self.events += 1
+
+    def summary(self):
+        lags = np.concatenate(self.lags + [np.array(self.single, dtype=float)]) * 1000
+        elapsed = (self.last - self.first) if self.events else 0.0
+        stats = {'消费读数': self.events, '消费吞吐(条/秒)': round(self.events / elapsed) if elapsed > 0 else None}
+        for name, q in [('P50', 50), ('P95', 95), ('P99', 99)]:
+            stats[f'延迟{name}(毫秒)'] = round(float(np.percentile(lags, q)), 2) if len(lags) else None
+        stats['最大延迟(毫秒)'] = round(float(lags.max()), 2) if len(lags) else None
+        return stats
+
+
+class Replayer:
+    """历史读数回放器
+
+    data.csv、data2.csv 的读数（来自共享的读数存储）合并后按采集时间排序，
+    每条读数的计划发出时刻为 开始时刻 + (采集时间 - 首条采集时间) / 加速倍数；
+    到点的读数按批发出（每批不超过 batch_size 条），speedup 为 0 时不限速。
+    copies 大于1时每个水表复制为多个虚拟水表（水表名加 #序号，用量乘以
+    每个虚拟水表固定的随机系数），用于放大流量。
+    """
+
+    def __init__(self, speedup=None, copies=None, batch_size=None, sources=None, store=None):
+        self.params = DATA_CONFIG['replay']
+        self.speedup = self.params['speedup'] if speedup is None else speedup
+        self.copies = max(int(copies or self.params['copies']), 1)
+        self.batch_size = batch_size or self.params['batch_size']
+        self.sources = list(sources or DATA_CONFIG['sources'])
+        self.store = store or shared_store()
+        self.report = None
+
+    def _events(self):
+        """所有数据源的读数合并为 (来源, 水表, 采集时间, 用量) 并按采集时间排序"""
+        frames = []
+        for source in self.sources:
+            data = self.store.frame(source)
+            key = DATA_CONFIG['sources'][source]['key']
+            frames.append(pd.DataFrame({
+                SOURCE_COLUMN: source,
+                METER_COLUMN: data[key].astype(str).to_numpy(),
+                TIME_COLUMN: data[TIME_COLUMN].to_numpy(),
+                VALUE_COLUMN: data[VALUE_COLUMN].to_numpy(),
+            }))
+        events = pd.concat(frames, ignore_index=True)
+        return events.sort_values(TIME_COLUMN, kind='mergesort').reset_index(drop=True)
+
+    def _virtual_meters(self, events):
+        """虚拟水表：每条读数的水表序号、(水表, 副本) 的名称和用量系数，整个回放中固定"""
+        meters, uniques = pd.factorize(events[METER_COLUMN])
+        rng = np.random.default_rng(self.params['random_state'])
+        factors = rng.lognormal(0, self.params['copy_sigma'], (len(uniques), self.copies))
+        factors[:, 0] = 1.0
+        names = np.array([f'{m}#{c}' if c else m for m in uniques for c in range(self.copies)], dtype=object)
+        return meters, names, factors
+
+    def _multiply(self, events, meters, names, factors):
+        """每条读数复制为 copies 条虚拟水表读数，同一时刻的副本相邻，仍按时间有序"""
+        copy = np.tile(np.arange(self.copies), len(events))
+        rows = np.repeat(np.arange(len(events)), self.copies)
+        multiplied = events.iloc[rows].reset_index(drop=True)
+        multiplied[METER_COLUMN] = names[meters[rows] * self.copies + copy]
+        multiplied[VALUE_COLUMN] = multiplied[VALUE_COLUMN].to_numpy() * factors[meters[rows], copy]
+        return multiplied
+
+    def batches(self):
+        """按计划时刻生成读数批（带计划发出时刻列 due）"""
+        events = self._events()
+        if events.empty:
+            return
+        if self.copies > 1:
+            meters, names, factors = self._virtual_meters(events)
+        times = events[TIME_COLUMN].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        start = time.time()
+        offsets = (times - times[0]) / 1e9 / self.speedup if self.speedup else np.zeros(len(times))
+        due = start + offsets
+
+        # 以原始读数为单位推进，按批复制成虚拟水表，复制后的内存只与批大小有关
+        step = max(self.batch_size // self.copies, 1)
+        i = 0
+        while i < len(events):
+            now = time.time()
+            j = min(int(np.searchsorted(due, now, side='right')), i + step)
+            if j <= i:
+                time.sleep(min(due[i] - now, 0.5))
+                continue
+            batch = events.iloc[i:j].reset_index(drop=True)
+            if self.copies > 1:
+                batch = self._multiply(batch, meters[i:j], names, factors)
+            batch[DUE_COLUMN] = np.repeat(due[i:j], self.copies)
+            yield batch
+            i = j
+
+    def _finish(self, produced, lag, started, behind):
+        """汇总并记录一次回放"""
+        elapsed = time.time() - started
+        self.report = {
+            '加速倍数': self.speedup or '不限速',
+            '虚拟倍数': self.copies,
+            '发出读数': produced,
+            '用时(秒)': round(elapsed, 3),
+            '发出吞吐(条/秒)': round(produced / elapsed) if elapsed > 0 else None,
+            '发出最大落后(秒)': round(behind, 3),
+        }
+        self.report.update(lag.summary())
+        self._log_run()
+        print("✓ 回放完成: " + "，".join(f"{k} {v}" for k, v in self.report.items() if v is not None))
+        return self.report
+
+    def run(self, consumer, queue_size=None):
+        """进程内回放：生产线程按计划把读数批放入有界队列，调用线程逐批交给 consumer
+
+        consumer 接收一个读数批 (DataFrame)，返回后即记为处理完成。返回回放报告。
+        """
+        batches = queue.Queue(maxsize=queue_size or self.params['queue_size'])
+        counters = {'produced': 0, 'behind': 0.0}
+        errors = []
+
+        def produce():
+            try:
+                for batch in self.batches():
+                    counters['behind'] = max(counters['behind'], time.time() - batch[DUE_COLUMN].iat[0])
+                    batches.put(batch)
+                    counters['produced'] += len(batch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                batches.put(_END)
+
+        lag = LagStats()
+        started = time.time()
+        producer = threading.Thread(target=produce, name='replay-producer', daemon=True)
+        producer.start()
+        while True:
+            batch = batches.get()
+            if batch is _END:
+                break
+            consumer(batch)
+            lag.record(batch[DUE_COLUMN].to_numpy())
+        producer.join()
+        if errors:
+            raise errors[0]
+        return self._finish(counters['produced'], lag, started, counters['behind'])
+
+    def serve(self, host=None, port=None):
+        """通过本地TCP端口回放：等待一个客户端连接后按行发出JSON读数（含计划发出时刻 due）
+
+        延迟由客户端统计（见 read_socket），这里只报告发出吞吐。
+        """
+        host = host or self.params['host']
+        port = self.params['port'] if port is None else port
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind((host, port))
+            server.listen(1)
+            print(f"等待客户端连接 {host}:{server.getsockname()[1]} ...")
+            connection, address = server.accept()
+            print(f"✓ 客户端已连接: {address[0]}:{address[1]}")
+            produced, behind = 0, 0.0
+            started = time.time()
+            with connection:
+                try:
+                    for batch in self.batches():
+                        behind = max(behind, time.time() - batch[DUE_COLUMN].iat[0])
+                        lines = batch.to_json(orient='records', lines=True, force_ascii=False, date_format='iso')
+                        connection.sendall(lines.encode('utf-8') + b'\n')
+                        produced += len(batch)
+                except (BrokenPipeError, ConnectionResetError):
+                    print("客户端已断开，停止回放")
+        return self._finish(produced, LagStats(), started, behind)
+
+    def _log_run(self):
+        """追加到回放日志 outputs/logs/replay_runs.csv"""
+        log_path = OUTPUT_CONFIG['logs_dir'] / 'replay_runs.csv'
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not log_path.exists()
+        with open(log_path, 'a', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(['回放时间'] + list(self.report))
+            writer.writerow([datetime.now().strftime('%Y-%m-%d %H:%M:%S')] + list(self.report.values()))
+
+
+def read_socket(host=None, port=None, lag=None):
+    """连接回放端口，逐条生成读数字典；传入 LagStats 时记录每条读数的端到端延迟
+
+    延迟在读数交给调用方之前记录，不含调用方处理这条读数的时间。
+    """
+    params = DATA_CONFIG['replay']
+    host = host or params['host']
+    port = params['port'] if port is None else port
+    with socket.create_connection((host, port)) as connection:
+        with connection.makefile('r', encoding='utf-8') as stream:
+            for line in stream:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if lag is not None:
+                    lag.record_one(record[DUE_COLUMN])
+                yield record
@@ -0,0 +1,214 @@
+"""
+报告导出 - 按块流式写出多表报告，内存占用与表的大小无关，并记录导出耗时和文件大小
+"""
+
+import csv
+import gzip
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from .config import get_report_path, OUTPUT_CONFIG
+
+# xlsx 单张表的最大行数（含表头）
+XLSX_MAX_ROWS = 1048576
+
+# xlsx 表名不允许的字符
+_INVALID_SHEET_CHARS = str.maketrans({c: '_' for c in '[]:*?/\\'})
+
+# xlsx 表名的最大长度
+XLSX_MAX_TITLE = 31
+
+# 'auto' 回退到 openpyxl 时只提示一次
+_fallback_noticed = False
+
+
+def _iter_chunks(data, chunk_rows):
+    """把 DataFrame 或 DataFrame 块的可迭代对象统一为块序列"""
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, max(len(data), 1), chunk_rows):
+            yield data.iloc[start:start + chunk_rows]
+    else:
+        for chunk in data:
+            yield chunk
+
+
+def _cell_value(value):
+    """列表等容器写为文本，与 DataFrame.to_excel 一致"""
+    return str(value) if isinstance(value, (list, tuple, set, dict)) else value
+
+
+def _cell_rows(chunk):
+    """把一块数据转换为单元格值的行（NaN/NaT 写为空）"""
+    values = chunk.astype(object).where(chunk.notnull(), None)
+    for column in chunk.columns[chunk.dtypes == object]:
+        values[column] = values[column].map(_cell_value)
+    return values.itertuples(index=False, name=None)
+
+
+class ReportWriter:
+    """流式多表报告写出器
+
+    format 为 'xlsx' 时用 xlsxwriter 的 constant_memory 模式（未安装则用 openpyxl
+    的 write_only 模式），行写入临时文件而不是驻留内存，超过单表行数上限自动续表；
+    'csv' / 'csv.gz' 时每张表写为 <报告名>_<表名>.csv[.gz]。
+    数据按 chunk_rows 分块转换写出，可以传入生成 DataFrame 块的迭代器。
+    """
+
+    def __init__(self, filename, fmt=None):
+        params = OUTPUT_CONFIG['report']
+        self.fmt = fmt or params['format']
+        self.chunk_rows = params['chunk_rows']
+        self.stem = filename.rsplit('.', 1)[0] if filename.endswith('.xlsx') else filename
+        self.paths = []
+        self.sheet_rows = {}
+        self.start_time = time.time()
+
+        self._workbook = None
+        self._engine = None
+        self._titles = set()
+        if self.fmt == 'xlsx':
+            self.paths.append(get_report_path(f'{self.stem}.xlsx'))
+            self._open_workbook(params['xlsx_engine'])
+        elif self.fmt not in ('csv', 'csv.gz'):
+            raise ValueError(f"不支持的报告格式: {self.fmt}")
+
+    def _open_workbook(self, engine):
+        if engine in ('auto', 'xlsxwriter'):
+            try:
+                import xlsxwriter
+                self._workbook = xlsxwriter.Workbook(str(self.paths[0]), {
+                    'constant_memory': True,
+                    'nan_inf_to_errors': True,
+                    'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+                })
+                self._engine = 'xlsxwriter'
+                return
+            except ImportError:
+                if engine == 'xlsxwriter':
+                    raise
+                global _fallback_noticed
+                if not _fallback_noticed:
+                    print("  未安装 xlsxwriter，xlsx 报告改用 openpyxl 只写模式导出（较慢，见 requirements.txt）")
+                    _fallback_noticed = True
+        from openpyxl import Workbook
+        self._workbook = Workbook(write_only=True)
+        self._engine = 'openpyxl'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._engine == 'xlsxwriter':
+            self._workbook.close()
+
+    def write_sheet(self, name, data, index=False):
+        """写出一张表；data 为 DataFrame 或 DataFrame 块的迭代器"""
+        chunks = _iter_chunks(data, self.chunk_rows)
+        if index:
+            chunks = (chunk.reset_index() for chunk in chunks)
+        if self.fmt == 'xlsx':
+            rows = self._write_xlsx(name, chunks)
+        else:
+            rows = self._write_csv(name, chunks)
+        self.sheet_rows[name] = rows
+        return rows
+
+    def _sheet_title(self, name, part):
+        """合法且在工作簿内唯一的表名：截断到31个字符后重名时加数字后缀（不区分大小写）"""
+        title = name.translate(_INVALID_SHEET_CHARS)
+        if part > 1:
+            title = f'{title[:XLSX_MAX_TITLE - 4]}_{part}'
+        title = title[:XLSX_MAX_TITLE]
+
+        candidate, n = title, 1
+        while candidate.lower() in self._titles:
+            n += 1
+            suffix = f'_{n}'
+            candidate = title[:XLSX_MAX_TITLE - len(suffix)] + suffix
+        self._titles.add(candidate.lower())
+        return candidate
+
+    def _new_sheet(self, name, part):
+        title = self._sheet_title(name, part)
+        if self._engine == 'xlsxwriter':
+            return self._workbook.add_worksheet(title)
+        return self._workbook.create_sheet(title)
+
+    def _append(self, sheet, row_idx, row):
+        if self._engine == 'xlsxwriter':
+            sheet.write_row(row_idx, 0, row)
+        else:
+            sheet.append(row)
+
+    def _write_xlsx(self, name, chunks):
+        total, part, sheet, header, used = 0, 0, None, None, XLSX_MAX_ROWS
+        for chunk in chunks:
+            if header is None:
+                header = [str(c) for c in chunk.columns]
+            for row in _cell_rows(chunk):
+                if used >= XLSX_MAX_ROWS:
+                    part += 1
+                    sheet = self._new_sheet(name, part)
+                    self._append(sheet, 0, header)
+                    used = 1
+                self._append(sheet, used, row)
+                used += 1
+                total += 1
+        if sheet is None:
+            # 空表也写出表头
+            sheet = self._new_sheet(name, 1)
+            if header is not None:
+                self._append(sheet, 0, header)
+        return total
+
+    def _write_csv(self, name, chunks):
+        path = get_report_path(f'{self.stem}_{name}.{self.fmt}')
+        self.paths.append(path)
+        opener = gzip.open if self.fmt == 'csv.gz' else open
+        total = 0
+        with opener(path, 'wt', encoding='utf-8-sig', newline='') as f:
+            for i, chunk in enumerate(chunks):
+                chunk.to_csv(f, index=False, header=(i == 0))
+                total += len(chunk)
+        return total
+
+    def close(self):
+        """保存文件，打印并记录导出耗时和文件大小"""
+        if self._engine == 'xlsxwriter':
+            self._workbook.close()
+        elif self._engine == 'openpyxl':
+            self._workbook.save(self.paths[0])
+
+        elapsed = time.time() - self.start_time
+        size = sum(path.stat().st_size for path in self.paths)
+        rows = sum(self.sheet_rows.values())
+        print(f"  导出 {len(self.sheet_rows)} 张表 {rows} 行，{size / 1024:.1f} KB，用时 {elapsed:.2f} 秒"
+              f"（{self._engine or self.fmt}）")
+        self._log_export(rows, size, elapsed)
+        return self.paths
+
+    def _log_export(self, rows, size, elapsed):
+        """追加到导出日志 outputs/logs/report_exports.csv"""
+        log_path = OUTPUT_CONFIG['logs_dir'] / 'report_exports.csv'
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not log_path.exists()
+        with open(log_path, 'a', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(['导出时间', '报告', '格式', '表', '行数', '文件大小(字节)', '用时(秒)'])
+            writer.writerow([
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S'), self.stem, self._engine or self.fmt,
+                ';'.join(f'{name}:{n}' for name, n in self.sheet_rows.items()), rows, size, round(elapsed, 3)
+            ])
+
+
+def save_report(filename, sheets, fmt=None, index=False):
+    """把 {表名: 数据} 写成一份报告，返回报告主文件路径"""
+    with ReportWriter(filename, fmt) as writer:
+        for name, data in sheets.items():
+            writer.write_sheet(name, data, index=index)
+    return writer.paths[0]
@@ -0,0 +1,349 @@
+"""
+用量汇总 - 按月分块保存的 水表 × 日 × 小时 用量和与读数计数，只重新汇总新增或变化的 (水表, 日)
+"""
+
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from .config import get_cache_path, ANALYSIS_CONFIG
+from .academic_calendar import get_calendar
+from .group_index import GroupIndex
+
+# 每月一个块：逐小时的用量和/读数数，以及用于发现变化的逐日用量和/读数数
+BLOCK_ARRAYS = ('sums', 'counts', 'day_sums', 'day_counts')
+
+
+def _expand(starts, lengths):
+    """把若干 [start, start + length) 区间展开为连续的行号数组"""
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return offsets + np.arange(int(lengths.sum()))
+
+
+def _month_range(month):
+    """某月（'YYYY-MM'）的第一天和天数"""
+    first = np.datetime64(month, 'M')
+    first_day = first.astype('datetime64[D]')
+    return first_day, int(((first + 1).astype('datetime64[D]') - first_day).astype(np.int64))
+
+
+class UsageRollup:
+    """水表 × 日 × 小时 用量汇总
+
+    以可累加的 用量和/读数计数 保存每个 (水表, 日期, 小时) 单元，按月分块
+    存放在缓存目录中，每月一个文件。功能区、季度、教学活动、6小时等粒度
+    的汇总都由它按组相加得到，代价只与 分组数 × 天数 有关，不再扫描全部
+    读数。合并新数据时按 (水表, 日) 比较读数数和用量和，只重新汇总新出现
+    或发生变化的单元，保存时只重写变化过的月份。
+    """
+
+    def __init__(self, key_column='code', attribute_columns=('水表名', 'name')):
+        self.key_column = key_column
+        self.attribute_columns = list(attribute_columns)
+        self.directory = get_cache_path(f'usage_rollup_{key_column}')
+
+        self.keys = []
+        self.key_index = {}
+        self.attributes = pd.DataFrame(columns=self.attribute_columns, dtype=object)
+
+        # 月份 -> 该月的数组（按需从磁盘读取）；已保存的月份；有改动待保存的月份
+        self.blocks = {}
+        self.stored = set()
+        self.dirty = set()
+
+        # 最近一次 update 的数据覆盖的水表和日期，table() 默认只汇总这个范围
+        self.scope = None
+
+    @property
+    def months(self):
+        return sorted(self.stored | set(self.blocks))
+
+    def _month_path(self, month):
+        return self.directory / f'month-{month}.npz'
+
+    def _block(self, month, create=False):
+        """某月的数组，并为之后新增的水表补行；不存在且 create 为 False 时返回 None"""
+        block = self.blocks.get(month)
+        if block is None:
+            if month in self.stored:
+                with np.load(self._month_path(month)) as stored:
+                    block = {name: stored[name] for name in BLOCK_ARRAYS}
+            elif create:
+                _, n_days = _month_range(month)
+                block = {
+                    'sums': np.zeros((0, n_days, 24)),
+                    'counts': np.zeros((0, n_days, 24), dtype=np.int32),
+                    'day_sums': np.zeros((0, n_days)),
+                    'day_counts': np.zeros((0, n_days), dtype=np.int32),
+                }
+            else:
+                return None
+            self.blocks[month] = block
+
+        missing = len(self.keys) - len(block['sums'])
+        if missing:
+            for name, array in block.items():
+                block[name] = np.pad(array, [(0, missing)] + [(0, 0)] * (array.ndim - 1))
+        return block
+
+    def update(self, data, ranges=None):
+        """把本次数据合并进汇总，返回重新汇总的读数条数
+
+        数据按 (水表, 采集时间) 排序后，每个 (水表, 日) 是连续的一段，一次
+        向量化求出各段的读数数和用量和并与已保存的逐日值比较：新出现或发生
+        变化（补录、改值、删行）的单元按小时重新汇总并整体替换，本次数据
+        范围内已保存但数据中没有读数的单元清零，其余单元不动。合并后在
+        本次数据范围内的结果与直接对数据分组求和一致。
+
+        ranges 为排序后各水表的 [起, 止) 行范围（即 GroupIndex.ranges[key_column]），
+        传入时直接使用，否则先建一次分组索引。
+        """
+        if ranges is None:
+            index = GroupIndex(data[data[self.key_column].notnull()], sort_columns=(self.key_column, '采集时间'),
+                               group_columns=[self.key_column])
+            data, ranges = index.data, index.ranges[self.key_column]
+        if not ranges:
+            self.scope = ([], None, None)
+            return 0
+
+        keys = list(ranges)
+        bounds = np.array([ranges[key] for key in keys], dtype=np.int64).reshape(-1, 2)
+        starts, stops = bounds[:, 0], bounds[:, 1]
+
+        # 本次数据中各水表的属性（取每个水表的第一行）
+        current = pd.DataFrame(
+            {c: data[c].to_numpy()[starts] for c in self.attribute_columns if c in data.columns}, index=keys
+        )
+        self.attributes = current.combine_first(self.attributes)
+        for key in keys:
+            if key not in self.key_index:
+                self.key_index[key] = len(self.keys)
+                self.keys.append(key)
+        rows = np.array([self.key_index[k] for k in keys], dtype=np.int64)
+
+        # GroupIndex 排序后的数据中各水表的行范围首尾相接，直接取切片，不必按行号复制
+        if np.array_equal(starts[1:], stops[:-1]):
+            positions = slice(int(starts[0]), int(stops[-1]))
+        else:
+            positions = _expand(starts, stops - starts)
+        meters = np.repeat(rows, stops - starts)
+        times = data['采集时间'].to_numpy(dtype='datetime64[ns]')[positions]
+        days = times.astype('datetime64[D]')
+        usage = data['用量'].to_numpy(dtype=float)[positions]
+        usage = np.where(np.isnan(usage), 0.0, usage)
+        self.scope = (keys, days.min(), days.max())
+
+        # 每个 (水表, 日) 连续段的读数数和用量和
+        change = np.ones(len(days), dtype=bool)
+        change[1:] = (meters[1:] != meters[:-1]) | (days[1:] != days[:-1])
+        run_starts = np.flatnonzero(change)
+        run_counts = np.diff(np.append(run_starts, len(days)))
+        run_sums = np.add.reduceat(usage, run_starts)
+        run_meters, run_days = meters[run_starts], days[run_starts]
+        run_months = run_days.astype('datetime64[M]')
+
+        scope_months = np.arange(self.scope[1].astype('datetime64[M]'), self.scope[2].astype('datetime64[M]') + 1)
+        replaced = 0
+        for month in scope_months:
+            key = str(month)
+            month_runs = np.flatnonzero(run_months == month)
+            block = self._block(key, create=len(month_runs) > 0)
+            if block is None:
+                continue
+            first_day, n_days = _month_range(key)
+            run_day = (run_days[month_runs] - first_day).astype(np.int64)
+            run_meter = run_meters[month_runs]
+
+            # 数据范围内已保存、但本次数据中没有读数的单元
+            present = np.zeros(block['day_counts'].shape, dtype=bool)
+            present[run_meter, run_day] = True
+            lo = max(int((self.scope[1] - first_day).astype(np.int64)), 0)
+            hi = min(int((self.scope[2] - first_day).astype(np.int64)) + 1, n_days)
+            stale = np.zeros_like(present)
+            stale[rows, lo:hi] = (block['day_counts'][rows, lo:hi] > 0) & ~present[rows, lo:hi]
+
+            # 新出现或读数数、用量和有变化的单元
+            changed = (block['day_counts'][run_meter, run_day] != run_counts[month_runs]) | (
+                block['day_sums'][run_meter, run_day] != run_sums[month_runs]
+            )
+            if not changed.any() and not stale.any():
+                continue
+
+            cleared = stale.copy()
+            cleared[run_meter[changed], run_day[changed]] = True
+            for name in BLOCK_ARRAYS:
+                block[name][cleared] = 0
+
+            changed_runs = month_runs[changed]
+            block['day_counts'][run_meter[changed], run_day[changed]] = run_counts[changed_runs]
+            block['day_sums'][run_meter[changed], run_day[changed]] = run_sums[changed_runs]
+
+            # 只对变化单元中的读数按小时重新汇总
+            idx = _expand(run_starts[changed_runs], run_counts[changed_runs])
+            hours = ((times[idx] - days[idx]) // np.timedelta64(1, 'h')).astype(np.int64)
+            flat = (meters[idx] * n_days + (days[idx] - first_day).astype(np.int64)) * 24 + hours
+            cells, inverse = np.unique(flat, return_inverse=True)
+            np.put(block['sums'], cells, np.bincount(inverse, weights=usage[idx]))
+            np.put(block['counts'], cells, np.bincount(inverse))
+
+            self.dirty.add(key)
+            replaced += len(idx)
+        return replaced
+
+    def attribute(self, column):
+        """最近一次 update 的数据中各水表的属性（水表 -> 值），可直接或映射后作为 table() 的分组"""
+        keys = self.keys if self.scope is None else self.scope[0]
+        return self.attributes[column].reindex(keys).rename(column)
+
+    def _cube(self, rows, first_day, last_day):
+        """若干水表在 [first_day, last_day] 的逐小时 (用量和, 读数数)，形状 (行, 天, 24)"""
+        sums, counts = [], []
+        for month in np.arange(first_day.astype('datetime64[M]'), last_day.astype('datetime64[M]') + 1):
+            month_first, n_days = _month_range(str(month))
+            lo = max(int((first_day - month_first).astype(np.int64)), 0)
+            hi = min(int((last_day - month_first).astype(np.int64)) + 1, n_days)
+            block = self._block(str(month))
+            if block is None:
+                sums.append(np.zeros((len(rows), hi - lo, 24)))
+                counts.append(np.zeros((len(rows), hi - lo, 24), dtype=np.int32))
+            else:
+                sums.append(block['sums'][rows, lo:hi])
+                counts.append(block['counts'][rows, lo:hi])
+        return np.concatenate(sums, axis=1), np.concatenate(counts, axis=1)
+
+    def _bounds(self, start=None, end=None):
+        """查询的日期范围，未指定时为已有月份的首尾"""
+        months = self.months
+        if start is None:
+            start = _month_range(months[0])[0]
+        if end is None:
+            first, n_days = _month_range(months[-1])
+            end = first + n_days - 1
+        return np.datetime64(start, 'D'), np.datetime64(end, 'D')
+
+    def table(self, group, keys=None, start=None, end=None):
+        """按 group（水表 -> 分组 的 Series）汇总为长表，只含有读数的 (分组, 日期, 小时)
+
+        返回列: 分组名, date, season, dayofyear, 教学活动, hours, 用量。keys、start、end
+        默认取最近一次 update 的数据范围，结果与直接对该数据按相同列分组求和一致。
+        """
+        if self.scope is not None:
+            keys = self.scope[0] if keys is None else keys
+            start = self.scope[1] if start is None else start
+            end = self.scope[2] if end is None else end
+        keys = self.keys if keys is None else [k for k in keys if k in self.key_index]
+        name = group.name or 'group'
+        columns = [name, 'date', 'season', 'dayofyear', '教学活动', 'hours', '用量']
+
+        labels = group.reindex(keys).to_numpy()
+        valid = pd.notnull(labels)
+        if not self.months or not valid.any():
+            return pd.DataFrame(columns=columns)
+
+        start, end = self._bounds(start, end)
+        rows = np.array([self.key_index[k] for k in keys], dtype=np.int64)[valid]
+
+        # 按分组相加：排序后用 reduceat 一次完成
+        codes, uniques = pd.factorize(labels[valid], sort=True)
+        order = np.argsort(codes, kind='stable')
+        group_starts = np.searchsorted(codes[order], np.arange(len(uniques)))
+        hourly_sums, hourly_counts = self._cube(rows[order], start, end)
+        sums = np.add.reduceat(hourly_sums, group_starts, axis=0)
+        counts = np.add.reduceat(hourly_counts, group_starts, axis=0)
+
+        g, d, h = np.nonzero(counts > 0)
+        days = start + np.arange(sums.shape[1])
+        dates = pd.DatetimeIndex(days)
+        return pd.DataFrame({
+            name: np.asarray(uniques)[g],
+            'date': days.astype(object)[d],
+            'season': np.asarray(dates.quarter)[d],
+            'dayofyear': np.asarray(dates.dayofyear)[d],
+            '教学活动': get_calendar().label_dates(days)[d],
+            'hours': h,
+            '用量': sums[g, d, h],
+        }, columns=columns)
+
+    def difference(self, other):
+        """与另一份汇总（如全量重建）在 other 的数据范围内比较，返回 (用量和最大差值, 读数计数不一致的单元数)"""
+        if other.scope is None or other.scope[1] is None:
+            return 0.0, 0
+        keys, start, end = other.scope
+        other_sums, other_counts = other._cube([other.key_index[k] for k in keys], start, end)
+        if any(k not in self.key_index for k in keys):
+            return np.inf, int((other_counts > 0).sum())
+        sums, counts = self._cube([self.key_index[k] for k in keys], start, end)
+        return float(np.abs(sums - other_sums).max(initial=0.0)), int((counts != other_counts).sum())
+
+    def save(self):
+        """保存有改动的月份和水表信息，未改动的月份不重写；不再属于汇总的月份文件被删除"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for month in sorted(self.dirty):
+            np.savez(self._month_path(month), **self._block(month))
+        self.stored |= self.dirty
+        self.dirty.clear()
+        for path in self.directory.glob('month-*.npz'):
+            if path.stem[len('month-'):] not in self.stored:
+                path.unlink()
+
+        np.savez(
+            self.directory / 'meta.npz',
+            key_column=np.array(self.key_column),
+            keys=np.array(self.keys, dtype=object),
+            attribute_columns=np.array(self.attribute_columns, dtype=object),
+            attributes=self.attributes.reindex(self.keys).to_numpy(dtype=object),
+            months=np.array(sorted(self.stored), dtype=object),
+        )
+        return self.directory
+
+    @classmethod
+    def load(cls, key_column='code'):
+        """读取持久化的用量汇总（各月的数组在用到时才读取），不存在时返回空汇总"""
+        rollup = cls(key_column)
+        path = rollup.directory / 'meta.npz'
+        if not path.exists():
+            return rollup
+
+        with np.load(path, allow_pickle=True) as stored:
+            rollup.keys = list(stored['keys'])
+            rollup.key_index = {k: i for i, k in enumerate(rollup.keys)}
+            rollup.attribute_columns = list(stored['attribute_columns'])
+            rollup.attributes = pd.DataFrame(stored['attributes'], index=rollup.keys, columns=rollup.attribute_columns)
+            rollup.stored = set(stored['months'])
+        return rollup
+
+
+# 功能区与关系模型分析在流水线中可能并行，读-改-写持久化文件时串行
+_lock = threading.Lock()
+
+
+def refresh_rollup(data, ranges=None):
+    """加载持久化的用量汇总，合并本次数据中新增或变化的读数后保存
+
+    ANALYSIS_CONFIG['usage_rollup'] 中 rebuild 为 True 时丢弃已保存的汇总
+    全量重建；verify 为 True 时另做一次全量重建并与增量结果比对。
+    """
+    params = ANALYSIS_CONFIG['usage_rollup']
+    with _lock:
+        start_time = time.time()
+        rollup = UsageRollup() if params['rebuild'] else UsageRollup.load()
+        replaced = rollup.update(data, ranges)
+        changed_months = len(rollup.dirty)
+        if rollup.dirty or params['rebuild']:
+            rollup.save()
+        print(f"✓ 用量汇总重新汇总 {replaced} 条新增或变化的读数（{changed_months} 个月），"
+              f"用时 {time.time() - start_time:.2f} 秒，共 {len(rollup.keys)} 个水表 × {len(rollup.months)} 个月")
+
+        if params['verify']:
+            start_time = time.time()
+            rebuilt = UsageRollup()
+            rebuilt.update(data, ranges)
+            max_diff, mismatched = rollup.difference(rebuilt)
+            if max_diff <= 1e-6 * max(abs(float(np.nansum(data['用量']))), 1.0) and mismatched == 0:
+                print(f"✓ 增量汇总与全量重建一致（重建用时 {time.time() - start_time:.2f} 秒）")
+            else:
+                print(f"⚠ 增量汇总与全量重建不一致：用量和最大差值 {max_diff:g}，读数计数不一致 {mismatched} 个单元，"
+                      f"请设置 ANALYSIS_CONFIG['usage_rollup']['rebuild'] = True 重建")
+        return rollup
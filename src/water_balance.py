@@ -0,0 +1,102 @@
+"""
+水量平衡 - 把水表层级解析为父子树，用稀疏关联矩阵一次计算所有节点的父表-子表差值
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+def _stem(code):
+    """去掉数值编码的 '.0' 后缀"""
+    return code[:-2] if code.endswith('.0') else code
+
+
+class MeterTree:
+    """水表层级树
+
+    水表编码由各级编码拼接而成，子表编码以父表编码为前缀，因此每个编码的父节点
+    是它最长的、同样在表中的真前缀（中间层缺失时直接挂到更上一级）。Excel按数值
+    读入的编码带有 '.0' 后缀，比较前缀时忽略。节点按深度优先顺序编号，子树在
+    该顺序中是连续区间 [tin, tout)，可 O(1) 切片查询。
+    """
+
+    def __init__(self, codes):
+        codes = pd.Index(pd.unique(pd.Series(codes, dtype=str)))
+        by_stem = {_stem(code): code for code in codes}
+
+        parent = {}
+        for code in codes:
+            stem = _stem(code)
+            parent[code] = next(
+                (by_stem[stem[:k]] for k in range(len(stem) - 1, 0, -1) if stem[:k] in by_stem), None
+            )
+
+        children = {code: [] for code in codes}
+        for code in sorted(codes, key=_stem):
+            if parent[code] is not None:
+                children[parent[code]].append(code)
+
+        # 深度优先遍历（欧拉序），子树为连续区间
+        order, tin, tout, depth = [], {}, {}, {}
+        roots = sorted((code for code in codes if parent[code] is None), key=_stem)
+        stack = [(code, 0, False) for code in reversed(roots)]
+        while stack:
+            code, level, exiting = stack.pop()
+            if exiting:
+                tout[code] = len(order)
+                continue
+            tin[code] = len(order)
+            depth[code] = level
+            order.append(code)
+            stack.append((code, level, True))
+            stack.extend((child, level + 1, False) for child in reversed(children[code]))
+
+        self.codes = pd.Index(order)
+        self.parent = parent
+        self.children = children
+        self.roots = roots
+        self.depth = np.array([depth[code] for code in order])
+        self.tin = np.array([tin[code] for code in order])
+        self.tout = np.array([tout[code] for code in order])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def position(self, code):
+        """节点在深度优先顺序中的位置"""
+        return self.codes.get_loc(code)
+
+    def subtree(self, code):
+        """子树（含自身）的全部编码"""
+        i = self.position(code)
+        return self.codes[self.tin[i]:self.tout[i]]
+
+    def incidence_matrix(self):
+        """节点 × 节点的稀疏关联矩阵：自身为 +1，直接子表为 -1
+
+        左乘 节点 × 时段 的用量矩阵即得每个节点每个时段的“父表 - 子表之和”。
+        """
+        n = len(self.codes)
+        child_pos = [i for i, code in enumerate(self.codes) if self.parent[code] is not None]
+        parent_pos = [self.position(self.parent[self.codes[i]]) for i in child_pos]
+        rows = np.concatenate([np.arange(n), parent_pos]).astype(np.int64)
+        cols = np.concatenate([np.arange(n), child_pos]).astype(np.int64)
+        data = np.concatenate([np.ones(n), -np.ones(len(child_pos))])
+        return sparse.csr_matrix((data, (rows, cols)), shape=(n, n))
+
+    def subtree_sums(self, values):
+        """按子树求和：values 为按深度优先顺序排列的节点数组"""
+        prefix = np.concatenate([[0.0], np.cumsum(values)])
+        return prefix[self.tout] - prefix[self.tin]
+
+
+def water_balance(tree, usage):
+    """计算所有节点、所有时段的父表-子表差值
+
+    usage 为 编码 × 时段 的用量DataFrame（缺失为NaN），按 tree 的节点顺序对齐；
+    没有读数的节点整行为NaN。任一相关水表缺失的时段差值为NaN。
+    返回 (差值矩阵, 对齐后的用量矩阵)。
+    """
+    values = usage.reindex(tree.codes).to_numpy(dtype=float)
+    return tree.incidence_matrix() @ values, values